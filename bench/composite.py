@@ -0,0 +1,67 @@
+# ----------------------------------------------------
+# Composite API のサブ要求一括処理のベンチマーク
+# ----------------------------------------------------
+# サブ要求1件の Composite 呼び出しを N 回行う場合と、
+# N 件のサブ要求を1回の呼び出しにまとめた場合の処理時間を比較する (HTTP通信は含まない)
+#
+# 実行方法 (リポジトリのルートで):
+#   python bench/composite.py [サブ要求数] [繰り返し回数]
+import json
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import stub_api  # noqa: E402
+
+HEADERS = {
+    'Authorization': 'Bearer dummy_token_abc',
+    'Content-Type': 'application/json',
+    'X-API-Key': 'dummy_key_xyz',
+}
+
+
+def build_sub_requests(count):
+    sub_requests = [{"method": "GET", "url": "/services/data/v62.0/query?q=SELECT+Id+FROM+Lead", "referenceId": "GetLead"}]
+    for i in range(1, count):
+        sub_requests.append({
+            "method": "PATCH",
+            "url": "/services/data/v62.0/sobjects/Lead/@{GetLead.records[0].attributes.url}",
+            "referenceId": f"Lead{i}",
+            "body": {"EmailPermissionFlag__c": "@{GetLead.records[0].EmailPermissionFlag__c}"},
+        })
+    return sub_requests
+
+
+def measure(client, bodies, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        for body in bodies:
+            response = client.post(stub_api.COMPOSITE_PATH, data=body, headers=HEADERS)
+            assert response.status_code == 200, response.get_data()
+    return (time.perf_counter() - start) / iterations * 1e3
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else stub_api.COMPOSITE_MAX_SUBREQUESTS
+    iterations = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    # ログ出力の負荷を除外する
+    logging.disable(logging.CRITICAL)
+    client = stub_api.app.test_client()
+
+    sub_requests = build_sub_requests(count)
+    single_bodies = [json.dumps({"compositeRequest": [sub_request]}) for sub_request in sub_requests]
+    # 参照を含むサブ要求を単独で送ると参照エラーになるため、単独呼び出しは参照を除いた内容で比較する
+    single_bodies = [body.replace('@{GetLead.records[0].attributes.url}', '00QGC000001rXNgo2AG')
+                         .replace('"@{GetLead.records[0].EmailPermissionFlag__c}"', 'true') for body in single_bodies]
+    batch_body = json.dumps({"allOrNone": True, "compositeRequest": sub_requests})
+
+    single_ms = measure(client, single_bodies, iterations)
+    batch_ms = measure(client, [batch_body], iterations)
+    print(f"{count} x single subrequest : {single_ms:8.3f} ms")
+    print(f"1 x {count} subrequests     : {batch_ms:8.3f} ms ({batch_ms / single_ms:.0%} of single calls)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+# ----------------------------------------------------
+# Job ID の払い出しのベンチマークと重複確認
+# ----------------------------------------------------
+# 1. 以前の方式 (uuid4 の先頭8文字) と連番 (hi/lo) 方式の1件あたりのCPU時間を比較する
+# 2. sqlite のジョブストアを共有する複数プロセス x 複数スレッドで払い出した Job ID について、
+#    重複がないこと・18文字のIDのチェックサムが正しいこと・スレッドごとに単調増加していることを確認する
+#
+# 実行方法 (リポジトリのルートで):
+#   python bench/job_id_allocator.py [--processes 4] [--threads 8] [--ids 50000] [--block-size 1000]
+import argparse
+import math
+import multiprocessing
+import os
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import stub_api  # noqa: E402
+
+INTERFACE_ID = 'IF-630008'
+
+
+# 以前の generate_job_id
+def legacy_job_id(interface_id):
+    return f"{interface_id.replace('-', '')}750GC00000{str(uuid.uuid4())[:8].upper()}ZAQ"
+
+
+def measure(func, iterations):
+    start = time.process_time()
+    for _ in range(iterations):
+        func(INTERFACE_ID)
+    return (time.process_time() - start) / iterations * 1e6
+
+
+# 1プロセス分: threads 個のスレッドでそれぞれ ids 件を払い出し、スレッドごとの Job ID のリストを返す
+def allocate_in_process(args):
+    db_path, block_size, threads, ids = args
+    store = stub_api.SqliteJobStore(db_path, stub_api.JOB_STORE_MAX_JOBS, stub_api.JOB_STATE_TTL_SECONDS)
+    allocator = stub_api.JobIdAllocator(store.reserve_job_ids, block_size)
+    prefix = INTERFACE_ID.replace('-', '')
+    results = [[] for _ in range(threads)]
+
+    def run(out):
+        for _ in range(ids):
+            out.append(prefix + allocator.next_id())
+
+    workers = [threading.Thread(target=run, args=(out,)) for out in results]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return results
+
+
+def check_job_ids(per_thread):
+    all_ids = set()
+    total = invalid = not_monotonic = 0
+    prefix_length = len(INTERFACE_ID.replace('-', ''))
+    for job_ids in per_thread:
+        previous = None
+        for job_id in job_ids:
+            total += 1
+            all_ids.add(job_id)
+            sf_id = job_id[prefix_length:]
+            if len(sf_id) != 18 or stub_api.to_sf_id18(sf_id[:15]) != sf_id:
+                invalid += 1
+            # 連番は62進数 (0-9A-Za-z) の固定桁数なので、文字コード順の比較で大小が分かる
+            if previous is not None and sf_id[5:15] <= previous:
+                not_monotonic += 1
+            previous = sf_id[5:15]
+    return total, total - len(all_ids), invalid, not_monotonic
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Job ID の払い出しのベンチマークと重複確認')
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--threads', type=int, default=8, help='1プロセスあたりのスレッド数')
+    parser.add_argument('--ids', type=int, default=50000, help='1スレッドあたりの払い出し件数')
+    parser.add_argument('--block-size', type=int, default=stub_api.JOB_ID_BLOCK_SIZE, help='一度に予約する連番の件数')
+    parser.add_argument('--iterations', type=int, default=200000, help='CPU時間の計測の繰り返し回数')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    print(f"{'generator':<28} {'cpu (us/id)':>12}")
+    legacy_us = measure(legacy_job_id, args.iterations)
+    print(f"{'uuid4 (legacy)':<28} {legacy_us:>12.2f}")
+    allocator_us = measure(stub_api.generate_job_id, args.iterations)
+    print(f"{'sequence (memory store)':<28} {allocator_us:>12.2f}  ({1 - allocator_us / legacy_us:.0%} saved)")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'jobs.db')
+        stub_api.SqliteJobStore(db_path, stub_api.JOB_STORE_MAX_JOBS, stub_api.JOB_STATE_TTL_SECONDS)
+        start = time.perf_counter()
+        with multiprocessing.get_context('fork').Pool(args.processes) as pool:
+            per_process = pool.map(allocate_in_process, [(db_path, args.block_size, args.threads, args.ids)] * args.processes)
+        elapsed = time.perf_counter() - start
+
+    per_thread = [job_ids for results in per_process for job_ids in results]
+    total, duplicates, invalid, not_monotonic = check_job_ids(per_thread)
+    print(f"\nsqlite store: {args.processes} processes x {args.threads} threads x {args.ids} ids "
+          f"(block size {args.block_size}): {total / elapsed:,.0f} ids/s")
+    print(f"ids: {total}  duplicates: {duplicates}  invalid checksum: {invalid}  not monotonic: {not_monotonic}")
+    # 以前の方式 (32ビットの乱数) で同じ件数を払い出した場合に1件以上重複する確率 (誕生日問題の近似)
+    print(f"legacy collision probability for {total} ids: {1 - math.exp(-total * (total - 1) / 2 / 2 ** 32):.1%}")
+    if duplicates or invalid or not_monotonic:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,375 @@
+# ----------------------------------------------------
+# Bulk API 2.0 の一連の処理を並列に実行する負荷試験ツール
+# ----------------------------------------------------
+# 起動済みのスタブサーバーに対して、INTERFACE_MAPPING の全オブジェクトについて以下の流れを繰り返し実行する
+#   OAuth トークン取得 -> ジョブ作成 (POST) -> CSVアップロード (PUT) -> UploadComplete (PATCH)
+#   -> ジョブ詳細のポーリング (GET) -> 結果CSV 3種の取得 -> Composite API
+# スループット、ルートごとのレイテンシ (p50/p95/p99)、サーバープロセスのメモリ使用量 (RSS) を出力し、
+# 結果をJSONに保存して別バージョンの結果と比較できる
+#
+# 実行方法 (リポジトリのルートで):
+#   # ジョブの処理時間を短くしてサーバーを起動する
+#   STUB_JOB_LATENCY_PROFILES='{"default": {"queue": {"dist": "fixed", "seconds": 0}, "processing": {"dist": "fixed", "seconds": 0.2}}}' \
+#       python3 stub_api.py 8888 &
+#   python bench/load_bulk_api.py --port 8888 --concurrency 16 --flows 200 --rows 1000 --server-pid $! --output result.json
+#   # 前回の結果と比較する
+#   python bench/load_bulk_api.py --port 8888 --server-pid <PID> --compare result.json
+import argparse
+import csv
+import datetime
+import http.client
+import json
+import os
+import sys
+import threading
+import time
+import urllib.parse
+from collections import defaultdict
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from stub_api import (  # noqa: E402
+    BASE_PATH, COMPOSITE_PATH, CSV_FILE_MAP, INTERFACE_MAPPING, OAUTH_TOKEN_PATH,
+)
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data')
+
+API_HEADERS = {
+    'Authorization': 'Bearer dummy_token_abc',
+    'X-API-Key': 'dummy_key_xyz',
+}
+OAUTH_BODY = urllib.parse.urlencode({
+    'grant_type': 'client_credentials',
+    'client_id': 'stg',
+    'client_secret': 'e3b0c44298fc1c149afbf4c8996fb92427ae41e4649b934ca495991b7852b855',
+})
+COMPOSITE_BODY = json.dumps({
+    "compositeRequest": [
+        {"method": "GET", "url": "/services/data/v62.0/query?q=SELECT+EmailPermissionFlag__c+FROM+Lead", "referenceId": "GetLead"},
+        {"method": "PATCH", "url": "/services/data/v62.0/sobjects/Lead/00QGC000001rXNgo2AG",
+         "referenceId": "Lead", "body": {"EmailPermissionFlag__c": "@{GetLead.records[0].EmailPermissionFlag__c}"}},
+    ]
+})
+RESULT_ROUTES = (
+    ('successful_results', 'successfulResults'),
+    ('failed_results', 'failedResults'),
+    ('unprocessed_records', 'unprocessedRecords/'),
+)
+PERCENTILES = (50, 95, 99)
+
+
+# アップロード用CSV: 成功結果CSVのヘッダーから sf__ 列を除いた列で rows 件を生成する
+def build_upload_csv(object_name, rows):
+    with open(os.path.join(DATA_DIR, f"{CSV_FILE_MAP[object_name]}_success.csv"), encoding='utf-8', newline='') as f:
+        header = [column for column in next(csv.reader(f)) if not column.startswith('sf__')]
+    lines = [','.join(header)]
+    for i in range(rows):
+        lines.append(','.join(f'"{column[:8]}{i}"' for column in header))
+    return ('\n'.join(lines) + '\n').encode('utf-8')
+
+
+# pid とその子プロセス (prefork のワーカーなど) の RSS の合計 (KB)。取得できない場合は None
+def read_rss_kb(pid):
+    total = 0
+    pending = [pid]
+    while pending:
+        current = pending.pop()
+        try:
+            with open(f'/proc/{current}/status') as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        total += int(line.split()[1])
+                        break
+            for tid in os.listdir(f'/proc/{current}/task'):
+                with open(f'/proc/{current}/task/{tid}/children') as f:
+                    pending.extend(int(child) for child in f.read().split())
+        except (OSError, ValueError):
+            if current == pid:
+                return None
+    return total
+
+
+class RssSampler(threading.Thread):
+    def __init__(self, pid, interval):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.samples = []
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.is_set():
+            rss = read_rss_kb(self.pid)
+            if rss is not None:
+                self.samples.append(rss)
+            self.stopped.wait(self.interval)
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        rss = read_rss_kb(self.pid)
+        if rss is not None:
+            self.samples.append(rss)
+
+
+class LoadClient:
+    def __init__(self, host, port, timeout, recorder):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.recorder = recorder
+        self.conn = None
+
+    # 1リクエストを送信してレイテンシを記録し、(ステータス, ボディ) を返す。通信エラーの場合は (None, None)
+    def request(self, route, method, path, body=None, headers=None):
+        start = time.perf_counter()
+        try:
+            if self.conn is None:
+                self.conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            self.conn.request(method, path, body=body, headers=headers or {})
+            response = self.conn.getresponse()
+            data = response.read()
+            status = response.status
+            if response.will_close:
+                self.close()
+        except (OSError, http.client.HTTPException):
+            self.close()
+            self.recorder.record(route, time.perf_counter() - start, None, 0, len(body or b''))
+            return None, None
+        self.recorder.record(route, time.perf_counter() - start, status, len(data), len(body or b''))
+        return status, data
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+
+class Recorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.bytes_in = defaultdict(int)
+        self.bytes_out = defaultdict(int)
+        self.job_seconds = []
+        self.failed_flows = 0
+
+    def record(self, route, seconds, status, received, sent):
+        with self.lock:
+            self.latencies[route].append(seconds)
+            self.bytes_in[route] += received
+            self.bytes_out[route] += sent
+            if status is None or status >= 400:
+                self.errors[route] += 1
+
+
+def json_headers():
+    return dict(API_HEADERS, **{'Content-Type': 'application/json'})
+
+
+# 1オブジェクト分の一連の処理。途中で失敗した場合は False
+def run_flow(client, recorder, object_name, upload_body, args):
+    status, _ = client.request('oauth_token', 'POST', OAUTH_TOKEN_PATH, OAUTH_BODY.encode('utf-8'),
+                               {'Content-Type': 'application/x-www-form-urlencoded'})
+    if status != 200:
+        return False
+
+    job_request = json.dumps({"operation": "upsert", "object": object_name, "contentType": "CSV", "lineEnding": "LF"})
+    status, data = client.request('create_job', 'POST', BASE_PATH, job_request.encode('utf-8'), json_headers())
+    if status != 200:
+        return False
+    job_id = json.loads(data)["id"]
+    job_path = f"{BASE_PATH}/{job_id}"
+
+    status, _ = client.request('upload_csv', 'PUT', f"{job_path}/batches", upload_body,
+                               dict(API_HEADERS, **{'Content-Type': 'text/csv'}))
+    if status not in (200, 201):
+        return False
+    status, _ = client.request('upload_complete', 'PATCH', job_path, b'{"state": "UploadComplete"}', json_headers())
+    if status != 200:
+        return False
+
+    # JobComplete になるまでポーリング
+    start = time.perf_counter()
+    deadline = start + args.poll_timeout
+    while True:
+        status, data = client.request('get_job', 'GET', job_path, headers=dict(API_HEADERS, Accept='application/json'))
+        if status != 200:
+            return False
+        if json.loads(data).get("state") == "JobComplete":
+            break
+        if time.perf_counter() > deadline:
+            return False
+        time.sleep(args.poll_interval)
+    with recorder.lock:
+        recorder.job_seconds.append(time.perf_counter() - start)
+
+    ok = True
+    for route, suffix in RESULT_ROUTES:
+        status, _ = client.request(route, 'GET', f"{job_path}/{suffix}", headers=dict(API_HEADERS, Accept='text/csv'))
+        ok = ok and status == 200
+
+    for _ in range(args.composite_calls):
+        status, _ = client.request('composite', 'POST', COMPOSITE_PATH, COMPOSITE_BODY.encode('utf-8'), json_headers())
+        ok = ok and status == 200
+    return ok
+
+
+def worker(args, recorder, uploads, objects, counter, counter_lock):
+    client = LoadClient(args.host, args.port, args.timeout, recorder)
+    try:
+        while True:
+            with counter_lock:
+                index = counter[0]
+                if index >= args.flows:
+                    return
+                counter[0] += 1
+            object_name = objects[index % len(objects)]
+            if not run_flow(client, recorder, object_name, uploads[object_name], args):
+                with recorder.lock:
+                    recorder.failed_flows += 1
+    finally:
+        client.close()
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def summarize(args, recorder, elapsed, rss_before, rss_samples):
+    routes = {}
+    total = 0
+    for route, values in sorted(recorder.latencies.items()):
+        values.sort()
+        total += len(values)
+        routes[route] = {
+            "count": len(values),
+            "errors": recorder.errors[route],
+            "mean_ms": sum(values) / len(values) * 1e3,
+            "max_ms": values[-1] * 1e3,
+            "bytes_in": recorder.bytes_in[route],
+            "bytes_out": recorder.bytes_out[route],
+        }
+        for pct in PERCENTILES:
+            routes[route][f"p{pct}_ms"] = percentile(values, pct) * 1e3
+
+    job_seconds = sorted(recorder.job_seconds)
+    result = {
+        "timestamp": datetime.datetime.now().isoformat(timespec='seconds'),
+        "label": args.label,
+        "config": {key: getattr(args, key) for key in ("concurrency", "flows", "rows", "objects", "composite_calls", "poll_interval")},
+        "elapsed_seconds": elapsed,
+        "requests": total,
+        "requests_per_second": total / elapsed if elapsed else 0,
+        "flows_per_second": args.flows / elapsed if elapsed else 0,
+        "failed_flows": recorder.failed_flows,
+        "job_completion_p50_seconds": percentile(job_seconds, 50),
+        "routes": routes,
+        "memory": None,
+    }
+    if rss_before is not None and rss_samples:
+        result["memory"] = {
+            "rss_before_kb": rss_before,
+            "rss_after_kb": rss_samples[-1],
+            "rss_peak_kb": max(rss_samples),
+            "rss_growth_kb": rss_samples[-1] - rss_before,
+        }
+    return result
+
+
+def print_report(result):
+    print(f"requests: {result['requests']}  elapsed: {result['elapsed_seconds']:.2f}s  "
+          f"throughput: {result['requests_per_second']:.1f} req/s ({result['flows_per_second']:.2f} flows/s)  "
+          f"failed flows: {result['failed_flows']}")
+    print(f"{'route':<22} {'count':>7} {'errors':>7} {'mean':>9} {'p50':>9} {'p95':>9} {'p99':>9} {'max':>9}  (ms)")
+    for route, stats in result["routes"].items():
+        print(f"{route:<22} {stats['count']:>7} {stats['errors']:>7} {stats['mean_ms']:>9.2f} {stats['p50_ms']:>9.2f} "
+              f"{stats['p95_ms']:>9.2f} {stats['p99_ms']:>9.2f} {stats['max_ms']:>9.2f}")
+    memory = result["memory"]
+    if memory:
+        print(f"server RSS: before {memory['rss_before_kb'] / 1024:.1f} MB / after {memory['rss_after_kb'] / 1024:.1f} MB / "
+              f"peak {memory['rss_peak_kb'] / 1024:.1f} MB / growth {memory['rss_growth_kb'] / 1024:+.1f} MB")
+
+
+def change(current, baseline):
+    if current is None or not baseline:
+        return '-'
+    return f"{(current - baseline) / baseline:+.1%}"
+
+
+# 比較対象の結果 (JSON) との差分を出力する
+def print_comparison(result, baseline):
+    print(f"\ncompare with: {baseline.get('label') or ''} ({baseline.get('timestamp')})")
+    print(f"throughput: {baseline['requests_per_second']:.1f} -> {result['requests_per_second']:.1f} req/s "
+          f"({change(result['requests_per_second'], baseline['requests_per_second'])})")
+    print(f"{'route':<22} " + ' '.join(f"{f'p{pct} base':>10} {f'p{pct} now':>10} {'diff':>8}" for pct in PERCENTILES))
+    for route, stats in result["routes"].items():
+        base = baseline["routes"].get(route)
+        if base is None:
+            continue
+        columns = []
+        for pct in PERCENTILES:
+            key = f"p{pct}_ms"
+            columns.append(f"{base[key]:>10.2f} {stats[key]:>10.2f} {change(stats[key], base[key]):>8}")
+        print(f"{route:<22} " + ' '.join(columns))
+    if result["memory"] and baseline.get("memory"):
+        print(f"RSS growth: {baseline['memory']['rss_growth_kb'] / 1024:+.1f} MB -> {result['memory']['rss_growth_kb'] / 1024:+.1f} MB")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Bulk API 2.0 スタブの負荷試験')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=8888)
+    parser.add_argument('--concurrency', type=int, default=8, help='並列実行数 (接続数)')
+    parser.add_argument('--flows', type=int, default=60, help='実行する一連の処理の合計数 (オブジェクトを順に割り当てる)')
+    parser.add_argument('--rows', type=int, default=1000, help='アップロードするCSVの件数')
+    parser.add_argument('--objects', nargs='+', default=list(INTERFACE_MAPPING), choices=list(INTERFACE_MAPPING))
+    parser.add_argument('--composite-calls', type=int, default=1, help='一連の処理ごとの Composite API の呼び出し回数')
+    parser.add_argument('--poll-interval', type=float, default=0.2, help='ジョブ詳細のポーリング間隔 (秒)')
+    parser.add_argument('--poll-timeout', type=float, default=120, help='JobComplete を待つ最大秒数')
+    parser.add_argument('--timeout', type=float, default=30, help='1リクエストのタイムアウト (秒)')
+    parser.add_argument('--server-pid', type=int, help='メモリ使用量を計測するサーバーのプロセスID')
+    parser.add_argument('--label', default='', help='結果に記録するラベル (バージョン名など)')
+    parser.add_argument('--output', help='結果を保存するJSONファイル')
+    parser.add_argument('--compare', help='比較対象の結果JSONファイル')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    uploads = {object_name: build_upload_csv(object_name, args.rows) for object_name in args.objects}
+    recorder = Recorder()
+
+    rss_before = read_rss_kb(args.server_pid) if args.server_pid else None
+    sampler = RssSampler(args.server_pid, 0.5) if rss_before is not None else None
+    if sampler:
+        sampler.start()
+
+    counter, counter_lock = [0], threading.Lock()
+    threads = [threading.Thread(target=worker, args=(args, recorder, uploads, args.objects, counter, counter_lock))
+               for _ in range(args.concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    if sampler:
+        sampler.stop()
+
+    result = summarize(args, recorder, elapsed, rss_before, sampler.samples if sampler else [])
+    print_report(result)
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            print_comparison(result, json.load(f))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"\nsaved: {args.output}")
+
+
+if __name__ == '__main__':
+    main()
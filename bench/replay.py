@@ -0,0 +1,271 @@
+# ----------------------------------------------------
+# キャプチャしたトラフィック (stub_api.py --capture) を再送するツール
+# ----------------------------------------------------
+# キャプチャの時刻 (ts) に従って、等倍 / N倍速 / 最大速度 (--speed 0) でリクエストを再送する
+# - ジョブ作成から始まる一連のリクエスト (同じ Job ID を参照するもの) を1つの流れとして順に送り、
+#   再送時に発行された Job ID に置き換える
+# - 流れの同時実行数は、キャプチャ時に同時に進行していた流れの最大数 (--concurrency で変更可)
+# - ボディがハッシュ値のみ記録されている場合は、同じサイズ・行数のダミーのボディを送る
+# ルートごとのレイテンシとキャプチャ時とのステータスの差分を出力し、結果をJSONに保存して比較できる
+#
+# 実行方法 (リポジトリのルートで):
+#   python3 stub_api.py 8888 --capture stub_capture.jsonl   # 本番相当のトラフィックを流してキャプチャ
+#   python3 stub_api.py 8888 &                               # 再送先のサーバー
+#   python bench/replay.py stub_capture.jsonl --port 8888 --speed 2 --server-pid $! --output replay.json
+#   python bench/replay.py stub_capture.jsonl --port 8888 --speed 0 --compare replay.json
+import argparse
+import base64
+import datetime
+import json
+import threading
+import time
+from collections import defaultdict
+
+from load_bulk_api import (
+    PERCENTILES, LoadClient, Recorder, RssSampler, percentile, print_comparison, read_rss_kb,
+)
+
+# 再送時に付け直す (キャプチャの値を使わない) ヘッダー
+DROP_HEADERS = {'Host', 'Content-Length', 'Transfer-Encoding', 'Connection'}
+
+
+def load_capture(path, limit=None):
+    records = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                records.append(json.loads(line))
+    records.sort(key=lambda record: record['ts'])
+    return records[:limit] if limit else records
+
+
+# ジョブ作成とその Job ID を参照するリクエストを1つの流れにまとめる。Job ID を参照しないリクエストはそれぞれ単独の流れ
+def build_flows(records):
+    flows = []
+    job_flows = {}
+    for record in records:
+        job_id = record.get('jobId')
+        if job_id:
+            job_flows[job_id] = flow = [record]
+            flows.append(flow)
+            continue
+        # Job ID はパスの区切り (/jobs/ingest/<Job ID>/batches など) に現れるので、各区切りを直接引く
+        segments = record['path'].partition('?')[0].split('/')
+        flow = next((job_flows[segment] for segment in segments if segment in job_flows), None)
+        if flow is None:
+            flows.append([record])
+        else:
+            flow.append(record)
+    return flows
+
+
+# キャプチャ時に同時に進行していた流れの最大数
+def peak_concurrency(flows):
+    events = []
+    for flow in flows:
+        events.append((flow[0]['ts'], 1))
+        events.append((max(record['ts'] + record.get('dur', 0) for record in flow), -1))
+    current = peak = 0
+    for _, delta in sorted(events):
+        current += delta
+        peak = max(peak, current)
+    return max(peak, 1)
+
+
+# キャプチャしたボディを復元する。ハッシュ値のみの場合は同じサイズ・行数のダミーを作る
+def request_body(record):
+    if 'body' in record:
+        return record['body'].encode('utf-8'), False
+    if 'bodyBase64' in record:
+        return base64.b64decode(record['bodyBase64']), False
+    size = record.get('bodySize', 0)
+    if not size:
+        return None, False
+    lines = max(1, record.get('bodyLines', 0))
+    width = max(1, size // lines)
+    body = (b'x' * (width - 1) + b'\n') * lines
+    return body + b'x' * max(0, size - len(body)), True
+
+
+def request_headers(record, args, synthetic):
+    headers = {name: value for name, value in record.get('headers', {}).items() if name not in DROP_HEADERS}
+    if args.auth != 'keep' and 'Authorization' in headers:
+        headers['Authorization'] = args.auth
+    if synthetic:
+        # ダミーのボディは圧縮していない
+        headers.pop('Content-Encoding', None)
+    return headers
+
+
+class ReplayStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.lags = []
+        self.status_mismatches = defaultdict(int)
+        self.synthetic_bodies = 0
+
+
+def run_flow(client, flow, args, start, stats):
+    job_ids = {}
+    for record in flow:
+        path = record['path']
+        for old_id, new_id in job_ids.items():
+            path = path.replace(old_id, new_id)
+        body, synthetic = request_body(record)
+        headers = request_headers(record, args, synthetic)
+
+        lag = 0.0
+        if args.speed:
+            delay = start + record['ts'] / args.speed - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                lag = -delay
+        route = record.get('route') or f"{record['method']} (no route)"
+        status, data = client.request(route, record['method'], path, body, headers)
+
+        with stats.lock:
+            stats.lags.append(lag)
+            stats.synthetic_bodies += synthetic
+            if status != record.get('status'):
+                stats.status_mismatches[route] += 1
+        if record.get('jobId') and status == 200:
+            job_ids[record['jobId']] = json.loads(data)['id']
+
+
+def worker(args, flows, counter, counter_lock, recorder, stats, start):
+    client = LoadClient(args.host, args.port, args.timeout, recorder)
+    try:
+        while True:
+            with counter_lock:
+                index = counter[0]
+                if index >= len(flows):
+                    return
+                counter[0] += 1
+            run_flow(client, flows[index], args, start, stats)
+    finally:
+        client.close()
+
+
+def summarize(args, recorder, stats, flows, concurrency, elapsed, rss_before, rss_samples):
+    routes = {}
+    total = 0
+    for route, values in sorted(recorder.latencies.items()):
+        values.sort()
+        total += len(values)
+        routes[route] = {
+            "count": len(values),
+            "errors": recorder.errors[route],
+            "status_mismatches": stats.status_mismatches[route],
+            "mean_ms": sum(values) / len(values) * 1e3,
+            "max_ms": values[-1] * 1e3,
+            "bytes_in": recorder.bytes_in[route],
+            "bytes_out": recorder.bytes_out[route],
+        }
+        for pct in PERCENTILES:
+            routes[route][f"p{pct}_ms"] = percentile(values, pct) * 1e3
+
+    lags = sorted(stats.lags)
+    result = {
+        "timestamp": datetime.datetime.now().isoformat(timespec='seconds'),
+        "label": args.label,
+        "config": {"capture": args.capture, "speed": args.speed, "concurrency": concurrency, "auth": args.auth},
+        "elapsed_seconds": elapsed,
+        "requests": total,
+        "requests_per_second": total / elapsed if elapsed else 0,
+        "flows": len(flows),
+        "status_mismatches": sum(stats.status_mismatches.values()),
+        "synthetic_bodies": stats.synthetic_bodies,
+        "schedule_lag_p99_ms": percentile(lags, 99) * 1e3 if lags else None,
+        "routes": routes,
+        "memory": None,
+    }
+    if rss_before is not None and rss_samples:
+        result["memory"] = {
+            "rss_before_kb": rss_before,
+            "rss_after_kb": rss_samples[-1],
+            "rss_peak_kb": max(rss_samples),
+            "rss_growth_kb": rss_samples[-1] - rss_before,
+        }
+    return result
+
+
+def print_report(result):
+    print(f"requests: {result['requests']}  flows: {result['flows']}  elapsed: {result['elapsed_seconds']:.2f}s  "
+          f"throughput: {result['requests_per_second']:.1f} req/s  speed: {result['config']['speed'] or 'max'}  "
+          f"concurrency: {result['config']['concurrency']}")
+    print(f"status mismatches: {result['status_mismatches']}  synthetic bodies: {result['synthetic_bodies']}  "
+          f"schedule lag p99: {result['schedule_lag_p99_ms'] or 0:.1f} ms")
+    print(f"{'route':<26} {'count':>7} {'errors':>7} {'diff':>6} {'mean':>9} {'p50':>9} {'p95':>9} {'p99':>9} {'max':>9}  (ms)")
+    for route, stats in result["routes"].items():
+        print(f"{route:<26} {stats['count']:>7} {stats['errors']:>7} {stats['status_mismatches']:>6} {stats['mean_ms']:>9.2f} "
+              f"{stats['p50_ms']:>9.2f} {stats['p95_ms']:>9.2f} {stats['p99_ms']:>9.2f} {stats['max_ms']:>9.2f}")
+    memory = result["memory"]
+    if memory:
+        print(f"server RSS: before {memory['rss_before_kb'] / 1024:.1f} MB / after {memory['rss_after_kb'] / 1024:.1f} MB / "
+              f"peak {memory['rss_peak_kb'] / 1024:.1f} MB / growth {memory['rss_growth_kb'] / 1024:+.1f} MB")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='キャプチャしたトラフィックの再送')
+    parser.add_argument('capture', help='stub_api.py --capture で出力したファイル')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=8888)
+    parser.add_argument('--speed', type=float, default=1.0, help='再送速度の倍率 (0 はキャプチャの時刻を無視して最大速度)')
+    parser.add_argument('--concurrency', type=int, help='流れの同時実行数 (既定値: キャプチャ時の最大同時実行数)')
+    parser.add_argument('--auth', default='Bearer dummy_token_abc',
+                        help="Authorization ヘッダーの置き換え値 ('keep' でキャプチャの値をそのまま送る)")
+    parser.add_argument('--limit', type=int, help='先頭から再送するリクエスト数')
+    parser.add_argument('--timeout', type=float, default=30, help='1リクエストのタイムアウト (秒)')
+    parser.add_argument('--server-pid', type=int, help='メモリ使用量を計測するサーバーのプロセスID')
+    parser.add_argument('--label', default='', help='結果に記録するラベル (バージョン名など)')
+    parser.add_argument('--output', help='結果を保存するJSONファイル')
+    parser.add_argument('--compare', help='比較対象の結果JSONファイル')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    records = load_capture(args.capture, args.limit)
+    if not records:
+        print(f"no requests in {args.capture}")
+        return
+    # 最初のリクエストの時刻を 0 とする
+    origin = records[0]['ts']
+    for record in records:
+        record['ts'] -= origin
+    flows = build_flows(records)
+    concurrency = args.concurrency or peak_concurrency(flows)
+
+    recorder = Recorder()
+    stats = ReplayStats()
+    rss_before = read_rss_kb(args.server_pid) if args.server_pid else None
+    sampler = RssSampler(args.server_pid, 0.5) if rss_before is not None else None
+    if sampler:
+        sampler.start()
+
+    counter, counter_lock = [0], threading.Lock()
+    start = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(args, flows, counter, counter_lock, recorder, stats, start))
+               for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    if sampler:
+        sampler.stop()
+
+    result = summarize(args, recorder, stats, flows, concurrency, elapsed, rss_before, sampler.samples if sampler else [])
+    print_report(result)
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            print_comparison(result, json.load(f))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"\nsaved: {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+# ----------------------------------------------------
+# 事前エンコード済みレスポンスのベンチマーク
+# ----------------------------------------------------
+# Composite / sObject Collections / OAuth の固定レスポンスについて、リクエストごとに jsonify する場合と
+# 起動時にエンコードした bytes を返す場合の1レスポンスあたりのCPU時間を比較する
+#
+# 実行方法 (リポジトリのルートで):
+#   python bench/response_cache.py [繰り返し回数]
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import stub_api  # noqa: E402
+from flask import Response, jsonify  # noqa: E402
+
+
+def measure(func, iterations):
+    start = time.process_time()
+    for _ in range(iterations):
+        func()
+    return (time.process_time() - start) / iterations * 1e6
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    app = stub_api.app
+    print(f"{'response':<40} {'jsonify (us)':>14} {'cached (us)':>14} {'saved':>8}")
+    with app.test_request_context():
+        for key, body in stub_api.STATIC_RESPONSE_BODIES.items():
+            cached = stub_api.RESPONSE_CACHE[key]
+            if key[0] == 'composite':
+                # Composite はサブ要求1件の compositeResponse として比較する
+                def build_cached(key=key, now=None):
+                    entry = stub_api.composite_entry(key, 'Lead')
+                    return Response(stub_api.encode_composite_response([entry]), mimetype='application/json')
+                def build_jsonify(body=body, now=None):
+                    return jsonify({"compositeResponse": [dict(body, referenceId='Lead')]})
+            elif key[0] == 'sobjects':
+                # sObject Collections はレコード1件の結果配列として比較する (成功時は id を埋め込む)
+                fields = [field for field, value in body.items() if value == stub_api.RESPONSE_PLACEHOLDER]
+                def build_cached(cached=cached, now=None):
+                    entry = cached[0] + b'001GC00000000001AAA' + cached[1] if isinstance(cached, tuple) else cached
+                    return Response(b'[' + entry + b']\n', mimetype='application/json')
+                def build_jsonify(body=body, fields=fields, now=None):
+                    return jsonify([dict(body, **dict.fromkeys(fields, '001GC00000000001AAA'))])
+            elif isinstance(cached, tuple):
+                # OAuth のトークン応答: 埋め込み位置 (access_token / issued_at) にはエンコード後の順に同じ値を入れる
+                fields = sorted(field for field, value in body.items() if value == stub_api.RESPONSE_PLACEHOLDER)
+                def build_cached(key=key, fields=fields, now=None):
+                    value = now or str(int(time.time()))
+                    return stub_api.spliced_json_response(key, *[value] * len(fields))
+                def build_jsonify(body=body, fields=fields, now=None):
+                    return jsonify(dict(body, **dict.fromkeys(fields, now or str(int(time.time())))))
+            # レスポンス本文が jsonify と一致することを確認する
+            assert build_cached(now='1700000000').get_data() == build_jsonify(now='1700000000').get_data(), key
+            jsonify_us = measure(build_jsonify, iterations)
+            cached_us = measure(build_cached, iterations)
+            label = '/'.join(key)
+            print(f"{label:<40} {jsonify_us:>14.2f} {cached_us:>14.2f} {1 - cached_us / jsonify_us:>8.0%}")
+
+
+if __name__ == '__main__':
+    main()
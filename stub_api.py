@@ -1,9 +1,41 @@
-from flask import Flask, request, jsonify, abort, Response
-import datetime, uuid
+from flask import Flask, request, jsonify, abort, Response, g, has_request_context, send_file
+from werkzeug.exceptions import HTTPException
+from werkzeug.serving import BaseWSGIServer
+import argparse
+import atexit
+import base64
+import datetime
+import bisect
+import cProfile
+import functools
+import hashlib
+import hmac
+import codecs
+import contextlib
+import csv
+import io
+import json
+import sqlite3
+import zlib
+import itertools
 import logging
-from logging.handlers import RotatingFileHandler
+import math
+import queue
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+import heapq
 import os
+import pstats
+import random
+import re
+import secrets
+import signal
 import sys
+import tempfile
+import threading
+import time
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
 
 # --- 1. インターフェースマッピングの定義 (CSVより抽出) ---
 # object値に紐づくIDと名称を正確に反映
@@ -26,33 +58,299 @@ CSV_FILE_MAP = {
     "Examination__c": "examination",
 }
 
-# CSVデータを格納するグローバル辞書
-LOADED_CSV_DATA = {
-    "success": {},
-    "fail": {},
-    "unproc": {}
-}
-
-# ジョブ状態を保存するストア
-JOB_STORE = {}
+# 結果タイプ (CSVファイル名のサフィックス)
+RESULT_TYPES = ("success", "fail", "unproc")
+# 結果CSVのファイルを配置するディレクトリ
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+# Composite / OAuth の分岐と応答を定義するシナリオファイル (起動時に読み込む)
+SCENARIOS_FILE = os.environ.get('STUB_SCENARIOS_FILE', os.path.join(DATA_DIR, 'scenarios.json'))
 
 # ベースパスを定義
 BASE_PATH = '/services/data/v62.0/jobs/ingest'
+# Bulk API 2.0 クエリジョブのパスを定義
+QUERY_BASE_PATH = '/services/data/v62.0/jobs/query'
 # Composite API のパスを定義
 COMPOSITE_PATH = '/services/data/v62.0/composite' 
+# sObject Collections API のパスを定義
+SOBJECT_COLLECTIONS_PATH = '/services/data/v62.0/composite/sobjects'
 # OAuth Token API のパスを定義 (新規)
 OAUTH_TOKEN_PATH = '/services/oauth2/token'
+# スタブ独自の管理用APIのパスを定義
+STUB_ADMIN_PATH = '/stub'
+# メトリクス (Prometheus テキスト形式) のパスを定義
+METRICS_PATH = '/metrics'
+
+# ジョブの処理時間シミュレーション (オブジェクト名ごと。未定義のオブジェクトは "default" を使用)
+# queue: UploadComplete -> InProgress までの待ち時間 / processing: InProgress -> JobComplete までの処理時間
+# dist: fixed (seconds) / uniform (min, max) / lognormal (median, sigma)
+# per_row を指定すると、アップロード件数 x per_row 秒を加算する
+# 環境変数 STUB_JOB_LATENCY_PROFILES (JSON) で上書きできる
+JOB_LATENCY_PROFILES = {
+    "default": {
+        "queue": {"dist": "fixed", "seconds": 1.0},
+        "processing": {"dist": "lognormal", "median": 3.0, "sigma": 0.5, "per_row": 0.0001},
+    },
+}
+JOB_LATENCY_PROFILES.update(json.loads(os.environ.get('STUB_JOB_LATENCY_PROFILES', '{}')))
+
+# ジョブ状態の遷移順
+JOB_STATE_ORDER = {"Open": 0, "UploadComplete": 1, "InProgress": 2, "JobComplete": 3}
+
+# アップロードされたCSVを UploadComplete 後に検証し、行ごとに成功 / 失敗の結果CSVに振り分ける (0 の場合は従来どおり全件成功)
+VALIDATE_UPLOADS = os.environ.get('STUB_VALIDATE_UPLOADS', '1') != '0'
+# オブジェクト -> 項目 -> 検証ルール。項目は data/*_success.csv のヘッダー (sf__ で始まる列を除く) に追加される
+# ルール: type (string / integer / double / boolean / date / datetime / email / id), required, maxLength, values (選択リスト), pattern (正規表現)
+# 例: {"Product2": {"Name": {"required": true, "maxLength": 80}, "ModelYear__c": {"type": "integer"}}}
+VALIDATION_RULES = json.loads(os.environ.get('STUB_VALIDATION_RULES', '{}'))
+# 検証を行うスレッド数 (ワーカープロセスごと)
+VALIDATION_WORKERS = int(os.environ.get('STUB_VALIDATION_WORKERS', 2))
+# 検証で一度に読み込んで列ごとに検査する行数
+VALIDATION_BATCH_ROWS = 10000
+
+# 結果CSVのファイルの変更を確認する間隔 (秒)。0 の場合は起動時に読み込んだ内容のまま変更を反映しない
+FIXTURE_WATCH_INTERVAL = float(os.environ.get('STUB_FIXTURE_WATCH_INTERVAL', 2))
+# 結果CSV生成用のテンプレートとしてファイルの先頭から読み込む最大行数 (大きなファイルを全件メモリに載せないように)
+RESULT_TEMPLATE_MAX_ROWS = 1000
+
+# クエリジョブの結果件数 (作成時に stubResultRows の指定がない場合。SOQL の LIMIT があればその件数が上限)
+QUERY_DEFAULT_RESULT_ROWS = int(os.environ.get('STUB_QUERY_RESULT_ROWS', 1000))
+
+# CSVアップロードをストリームで読み込む際のチャンクサイズ (bytes)
+UPLOAD_CHUNK_SIZE = 64 * 1024
+# ログに出力するCSVプレビューの行数
+CSV_PREVIEW_LINES = 3
+# 1回のアップロードで受け付けるCSVの最大サイズ (bytes, gzip の場合は解凍後)。超える場合は 413 (LIMIT_EXCEEDED)
+UPLOAD_MAX_BYTES = int(os.environ.get('STUB_UPLOAD_MAX_BYTES', 150 * 1024 * 1024))
+# アップロードされたCSVを保存するディレクトリ (ジョブごとに1ファイル。ジョブの削除時に削除する)
+UPLOAD_SPOOL_DIR = os.environ.get('STUB_UPLOAD_SPOOL_DIR', os.path.join(tempfile.gettempdir(), 'stub_api_uploads'))
+# このサイズ以下のアップロードはファイルに書かずにメモリに保持する (bytes)
+# sqlite のジョブストアでは、他のワーカープロセスからも読めるよう常にファイルに書く
+UPLOAD_SPOOL_MEMORY_BYTES = int(os.environ.get('STUB_UPLOAD_SPOOL_MEMORY_BYTES', 1024 * 1024))
+# メモリに保持するアップロードの合計の上限 (bytes)。超える分はサイズによらずファイルに書く
+UPLOAD_SPOOL_MEMORY_TOTAL_BYTES = int(os.environ.get('STUB_UPLOAD_SPOOL_MEMORY_TOTAL_BYTES', 256 * 1024 * 1024))
+
+# 結果CSVをストリーム出力する際の1チャンクあたりの行数
+RESULT_STREAM_BATCH_ROWS = 1000
+# 結果CSVのファイルをページ単位で返す際の読み込みサイズ (bytes)
+RESULT_FILE_CHUNK_SIZE = 64 * 1024
+# 結果CSVのファイルごとに保持する 行番号 -> バイト位置 の索引の最大件数
+RESULT_ROW_INDEX_MAX_ENTRIES = 100000
+# 結果CSVを gzip 圧縮して返す際の圧縮レベル (1: 高速 - 9: 高圧縮)
+GZIP_COMPRESS_LEVEL = int(os.environ.get('STUB_GZIP_LEVEL', 6))
+# 静的CSVの gzip 圧縮済みファイルを保存するディレクトリ
+GZIP_CACHE_DIR = os.environ.get('STUB_GZIP_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'stub_api_gzip'))
+
+# ルート (エンドポイント名) ごとのログレベル。例: {"get_job_details": "WARNING"}
+ROUTE_LOG_LEVELS = json.loads(os.environ.get('STUB_ROUTE_LOG_LEVELS', '{}'))
+# ルートごとのログのサンプリング間隔 (N件のリクエストに1件だけ INFO/DEBUG を出力。WARNING 以上は常に出力)
+# 既定では高頻度のポーリング (GET ジョブ詳細) を 10件に1件にする
+LOG_SAMPLE_RATES = {"get_job_details": 10}
+LOG_SAMPLE_RATES.update(json.loads(os.environ.get('STUB_LOG_SAMPLE_RATES', '{}')))
+# ログに出力するリクエストボディの最大文字数
+LOG_BODY_MAX_CHARS = int(os.environ.get('STUB_LOG_BODY_MAX_CHARS', 1024))
+# ログ書き込みキューの最大件数 (溢れた場合は破棄して件数を記録する)
+LOG_QUEUE_MAX_RECORDS = int(os.environ.get('STUB_LOG_QUEUE_MAX_RECORDS', 100000))
+
+# ジョブストアの保存先 ('memory': プロセス内 / 'sqlite': 複数ワーカープロセスで共有)
+JOB_STORE_BACKEND = os.environ.get('STUB_JOB_STORE_BACKEND', 'memory')
+# sqlite 使用時のDBファイルのパス
+JOB_STORE_DB_PATH = os.environ.get('STUB_JOB_STORE_DB', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'stub_jobs.db'))
+# ジョブストアの最大保持件数 (超過分は最も長くアクセスされていないジョブから削除)
+JOB_STORE_MAX_JOBS = int(os.environ.get('STUB_JOB_STORE_MAX_JOBS', 100000))
+# 状態ごとのジョブ保持期間 (秒)。その状態に遷移してから経過した時間で判定する。None は無期限
+JOB_STATE_TTL_SECONDS = {
+    "Open": 24 * 3600,
+    "UploadComplete": 24 * 3600,
+    "InProgress": 24 * 3600,
+    "JobComplete": int(os.environ.get('STUB_JOB_COMPLETE_TTL', 3600)),
+}
+# ジョブストアが副索引を持つ項目 (ジョブ一覧の絞り込みに使用)。sqlite ではそれぞれ jobs テーブルの列になる
+JOB_INDEX_FIELDS = ("job_type", "state", "object", "interface_id")
+# ジョブ一覧 (GET /jobs/ingest) の1ページあたりの件数
+JOB_LIST_PAGE_SIZE = int(os.environ.get('STUB_JOB_LIST_PAGE_SIZE', 1000))
+# Job ID の連番をジョブストアから一度に予約する件数 (予約した範囲はプロセス内で順に払い出す)
+JOB_ID_BLOCK_SIZE = int(os.environ.get('STUB_JOB_ID_BLOCK_SIZE', 1000))
+# 期限切れジョブを削除するバックグラウンド処理の実行間隔 (秒)
+JOB_STORE_REAP_INTERVAL = float(os.environ.get('STUB_JOB_STORE_REAP_INTERVAL', 30))
 
-# ジョブ処理完了までのGETポーリング回数 (3回目でJobComplete)
-MAX_GET_COUNT = 3
+# API制限のエミュレーション
+# トークン x ルート (関数名) ごとのトークンバケット (rate: 1秒あたりの補充数, burst: 最大トークン数)
+# "default" は個別の設定がないルートに適用する。設定がないルートは無制限
+# 例: {"default": {"rate": 50, "burst": 100}, "get_job_details": {"rate": 5, "burst": 10}}
+API_RATE_LIMITS = json.loads(os.environ.get('STUB_API_RATE_LIMITS', '{}'))
+# 1日 (UTC) あたりのAPIリクエスト数の上限 (Sforce-Limit-Info ヘッダーの上限値)。0 の場合は数えない
+DAILY_API_REQUEST_LIMIT = int(os.environ.get('STUB_DAILY_API_REQUEST_LIMIT', 1000000))
+# 同時に処理中にできるジョブ数の上限。0 の場合は無制限
+MAX_ACTIVE_JOBS = int(os.environ.get('STUB_MAX_ACTIVE_JOBS', 0))
+# 処理中とみなすジョブの状態
+ACTIVE_JOB_STATES = ("Open", "UploadComplete", "InProgress")
+# トークンバケットのロックの分割数 (異なるトークン/ルートのリクエスト同士が同じロックを待たないように)
+RATE_LIMIT_LOCK_STRIPES = 64
+
+# OAuth セッション
+# OAuth で発行するアクセストークンの有効期間 (秒)
+OAUTH_TOKEN_TTL_SECONDS = int(os.environ.get('STUB_OAUTH_TOKEN_TTL', 7200))
+# プロセス内で保持するセッション数の上限 (超過分は発行の古いものから破棄。破棄後も署名で検証できる)
+OAUTH_MAX_SESSIONS = int(os.environ.get('STUB_OAUTH_MAX_SESSIONS', 100000))
+# アクセストークンの署名鍵 (複数ワーカーで起動し fork 前に読み込まない場合は、全ワーカーで同じ値を指定する)
+OAUTH_TOKEN_SECRET = os.environ.get('STUB_OAUTH_SECRET', '').encode('utf-8') or secrets.token_bytes(32)
+# 発行せずに常に有効とするアクセストークン (カンマ区切り。既存のテストスクリプト用)
+OAUTH_STATIC_TOKENS = [t for t in os.environ.get('STUB_OAUTH_STATIC_TOKENS', 'dummy_token_abc').split(',') if t]
+# アクセストークンを検証するか (0 の場合は Bearer で始まれば受け付ける)
+OAUTH_VALIDATE_TOKENS = os.environ.get('STUB_OAUTH_VALIDATE_TOKENS', '1') != '0'
+# アクセストークンの先頭の組織ID
+OAUTH_ORG_ID = '00DGC0000058Kad'
+
+# トラフィックのキャプチャ (bench/replay.py で再送できる JSONL)
+# 出力先ファイル。空の場合はキャプチャしない (起動オプション --capture でも指定できる)
+CAPTURE_FILE = os.environ.get('STUB_CAPTURE_FILE', '')
+# --capture をファイル名なしで指定した場合の出力先
+CAPTURE_DEFAULT_FILE = 'stub_capture.jsonl'
+# リクエストボディの記録方法 ('full': CAPTURE_BODY_MAX_BYTES 以下はボディ、超える場合はハッシュ値 / 'digest': 常にハッシュ値)
+CAPTURE_BODIES = os.environ.get('STUB_CAPTURE_BODIES', 'full')
+CAPTURE_BODY_MAX_BYTES = int(os.environ.get('STUB_CAPTURE_BODY_MAX_BYTES', 64 * 1024))
+# 書き込みキューの最大件数 (溢れた場合は破棄して件数を記録する)
+CAPTURE_QUEUE_MAX_RECORDS = int(os.environ.get('STUB_CAPTURE_QUEUE_MAX_RECORDS', 100000))
+
+# スタブ管理用API (/stub/profile) の認証トークン (X-Stub-Admin-Token ヘッダー)。空の場合は管理用APIを無効にする
+ADMIN_TOKEN = os.environ.get('STUB_ADMIN_TOKEN', '')
+# リクエスト処理のプロファイリング結果 (ルートごとの .pstats) の出力先
+PROFILE_DIR = os.environ.get('STUB_PROFILE_DIR', os.path.join(tempfile.gettempdir(), 'stub_api_profiles'))
+# プロファイリングの既定の間隔 (N件に1件) と期間 (秒)、期間の上限 (秒)
+PROFILE_DEFAULT_SAMPLE_RATE = 10
+PROFILE_DEFAULT_SECONDS = 60
+PROFILE_MAX_SECONDS = int(os.environ.get('STUB_PROFILE_MAX_SECONDS', 3600))
+
+# レイテンシのヒストグラムのバケット上限 (秒)
+METRICS_LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# 事前エンコード済みレスポンスで、リクエストごとに値を埋め込む位置を示す文字列
+RESPONSE_PLACEHOLDER = '\x00STUB_PLACEHOLDER\x00'
+
+# Composite API の1リクエストあたりの最大サブ要求数
+COMPOSITE_MAX_SUBREQUESTS = 25
+# サブ要求の url / body 内の参照 (@{referenceId.field} / @{referenceId.records[0].Id})
+COMPOSITE_REFERENCE_PATTERN = re.compile(r'@\{([A-Za-z][A-Za-z0-9_]*)((?:\.[A-Za-z0-9_]+|\[\d+\])*)\}')
+COMPOSITE_REFERENCE_PATH_PATTERN = re.compile(r'\.([A-Za-z0-9_]+)|\[(\d+)\]')
+
+# sObject Collections の1リクエストあたりの最大レコード数
+SOBJECT_COLLECTIONS_MAX_RECORDS = 200
+
+# クエリジョブで受け付ける SOQL (SELECT 項目リスト FROM オブジェクト [WHERE / ORDER BY などは無視] [LIMIT n])
+SOQL_QUERY_PATTERN = re.compile(r'\s*SELECT\s+(?P<fields>.+?)\s+FROM\s+(?P<object>\w+)(?P<clauses>\s.*)?', re.IGNORECASE | re.DOTALL)
+SOQL_FIELD_PATTERN = re.compile(r'[A-Za-z_][\w.]*')
+SOQL_LIMIT_PATTERN = re.compile(r'\bLIMIT\s+(\d+)\s*$', re.IGNORECASE)
+# 新規作成レコードのIDに使用するオブジェクトごとのキープレフィックス (未定義のオブジェクトは "default" を使用)
+SOBJECT_KEY_PREFIXES = {"Lead": "00Q", "Account": "001", "Contact": "003", "default": "a00"}
+# Salesforce ID の形式 (15桁 / 18桁の英数字)
+SF_ID_PATTERN = re.compile(r'[A-Za-z0-9]{15}(?:[A-Za-z0-9]{3})?')
+# アップロードの検証ルールの type ごとの値の形式 (空文字は required でのみ検査する)
+VALIDATION_TYPE_PATTERNS = {
+    "integer": r'[-+]?\d+',
+    "double": r'[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?',
+    "boolean": r'(?i:true|false|1|0)',
+    "date": r'\d{4}-\d{2}-\d{2}',
+    "datetime": r'\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}(?:\.\d{1,3})?(?:Z|[+-]\d{2}:?\d{2})?',
+    "email": r'[^@\s]+@[^@\s]+\.[^@\s]+',
+    "id": SF_ID_PATTERN.pattern,
+}
+
+# Salesforce ID 生成用の文字セット
+BASE62_ALPHABET = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz'
+SF_ID_SUFFIX_ALPHABET = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ012345'
 
 
 app = Flask(__name__)
 
 # --- 2. ロギング設定 ---
+# リクエスト処理スレッドはログレコードをキューに積むだけにし、整形とファイル/標準出力への書き込みは
+# 専用の書き込みスレッド (QueueListener) で行う
+class AsyncQueueHandler(QueueHandler):
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    # 標準の QueueHandler は呼び出し側でメッセージを整形するため、整形せずにそのまま渡す
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+# ルートごとのログレベルとサンプリングを適用するフィルタ (リクエスト処理スレッドで実行される)
+class RouteLogFilter(logging.Filter):
+    def __init__(self):
+        super().__init__()
+        self.levels = {route: logging.getLevelName(level) if isinstance(level, str) else level
+                       for route, level in ROUTE_LOG_LEVELS.items()}
+        self.sample_counters = {route: itertools.count() for route in LOG_SAMPLE_RATES}
+
+    def filter(self, record):
+        if not has_request_context():
+            return True
+        endpoint = request.endpoint
+        level = self.levels.get(endpoint)
+        if level is not None and record.levelno < level:
+            return False
+
+        rate = LOG_SAMPLE_RATES.get(endpoint)
+        if rate and rate > 1 and record.levelno < logging.WARNING:
+            # 同じリクエストのログはまとめて出力/破棄する
+            sampled = g.get('_log_sampled')
+            if sampled is None:
+                sampled = next(self.sample_counters[endpoint]) % rate == 0
+                g._log_sampled = sampled
+            return sampled
+        return True
+
+
+# 大きな値 (リクエストボディなど) を書き込みスレッドで文字列化し、上限文字数で切り詰める
+class TruncatedLogValue:
+    __slots__ = ('value', 'limit')
+
+    def __init__(self, value, limit):
+        self.value = value
+        self.limit = limit
+
+    def __str__(self):
+        text = str(self.value)
+        if len(text) > self.limit:
+            return f"{text[:self.limit]}...(truncated, {len(text)} chars)"
+        return text
+
+def truncate_for_log(value, limit=None):
+    return TruncatedLogValue(value, LOG_BODY_MAX_CHARS if limit is None else limit)
+
+
+_log_handlers = []
+_log_queue_handler = None
+_log_listener = None
+
+def _start_log_listener():
+    global _log_listener
+    log_queue = queue.Queue(LOG_QUEUE_MAX_RECORDS)
+    _log_queue_handler.queue = log_queue
+    _log_listener = QueueListener(log_queue, *_log_handlers, respect_handler_level=True)
+    _log_listener.start()
+
+def _restart_log_listener_after_fork():
+    # 書き込みスレッドは fork 後の子プロセスに引き継がれないため、新しいキューで作り直す
+    if _log_queue_handler is not None:
+        _start_log_listener()
+
+def _stop_log_listener():
+    if _log_listener is not None:
+        _log_listener.stop()
+
 def setup_logging():
+    global _log_queue_handler
+
     # 既存のハンドラをクリア (Flaskのデフォルトハンドラを上書きするため)
-    for handler in app.logger.handlers:
+    for handler in list(app.logger.handlers):
         app.logger.removeHandler(handler)
         
     # Job IDなどの情報を含めるためのカスタムフォーマット
@@ -64,13 +362,21 @@ def setup_logging():
     # ファイルハンドラ (ローテート設定)
     file_handler = RotatingFileHandler('stub_api.log', maxBytes=1024 * 1024 * 5, backupCount=5)
     file_handler.setFormatter(log_formatter)
-    app.logger.addHandler(file_handler)
 
     # コンソールハンドラ (シンプルに出力)
     # コンソール用は job_info を含めず、シンプルなフォーマットにする
     stream_handler = logging.StreamHandler(sys.stdout)
     stream_handler.setFormatter(logging.Formatter('[%(asctime)s] %(levelname)s: %(message)s', datefmt='%Y-%m-%d %H:%M:%S'))
-    app.logger.addHandler(stream_handler)
+
+    # 上記2つのハンドラは書き込みスレッドから呼び出す
+    _log_handlers[:] = [file_handler, stream_handler]
+    _log_queue_handler = AsyncQueueHandler(None)
+    _log_queue_handler.addFilter(RouteLogFilter())
+    app.logger.addHandler(_log_queue_handler)
+    _start_log_listener()
+    os.register_at_fork(after_in_child=_restart_log_listener_after_fork)
+    # 終了時にキューに残ったログを書き出す
+    atexit.register(_stop_log_listener)
     
     app.logger.setLevel(logging.DEBUG)
     
@@ -78,30 +384,1976 @@ def setup_logging():
     app.logger.info("Logging initialized.", extra={'job_info': 'BOOT'})
 
 # --- 3. CSVファイルのロード ---
-def load_csv_data():
-    data_dir = os.path.join(os.path.dirname(__file__), 'data')
-    
-    # 6つのオブジェクト x 3つの結果タイプ = 18ファイルをロード
-    for object_name, file_prefix in CSV_FILE_MAP.items():
-        for result_type in ["success", "fail", "unproc"]:
-            filename = f"{file_prefix}_{result_type}.csv"
-            filepath = os.path.join(data_dir, filename)
-            
-            log_extra = {'job_info': 'LOAD'}
+# 結果CSVのファイル (6つのオブジェクト x 3つの結果タイプ = 18ファイル) のメタ情報と生成用テンプレートを保持する
+# ファイルの内容はメモリに読み込まず、静的CSVの返却時はファイルをそのまま送信する (send_file)
+# ファイルの更新 (mtime / サイズの変化) は監視スレッドが検知し、エントリごと差し替える
+class FixtureRegistry:
+    def __init__(self, data_dir):
+        self.data_dir = data_dir
+        self._fixtures = {}  # (result_type, object_name) -> {"path", "mtime_ns", "size", "template"}
 
-            if os.path.exists(filepath):
+    def path_for(self, result_type, object_name):
+        return os.path.join(self.data_dir, f"{CSV_FILE_MAP[object_name]}_{result_type}.csv")
+
+    # ファイルが存在しない (または空の) 場合は None
+    def get(self, result_type, object_name):
+        return self._fixtures.get((result_type, object_name))
+
+    # 全ファイルの mtime / サイズを確認し、変化したものだけ読み込み直す。読み込み直したファイル数を返す
+    def refresh(self, initial=False):
+        log_extra = {'job_info': 'LOAD'}
+        changed = 0
+        for object_name in CSV_FILE_MAP:
+            for result_type in RESULT_TYPES:
+                key = (result_type, object_name)
+                path = self.path_for(result_type, object_name)
+                current = self._fixtures.get(key)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    if current is not None or initial:
+                        app.logger.warning("CSV file not found: %s. Setting empty data.", path, extra=log_extra)
+                        self._fixtures.pop(key, None)
+                        changed += 1
+                    continue
+                if current is not None and (current["mtime_ns"], current["size"]) == (stat.st_mtime_ns, stat.st_size):
+                    continue
                 try:
-                    with open(filepath, 'r', encoding='utf-8') as f:
-                        content = f.read()
-                    LOADED_CSV_DATA[result_type][object_name] = content
-                    app.logger.debug(f"Loaded {result_type} data for {object_name} from {filename}", extra=log_extra)
+                    with open(path, 'r', encoding='utf-8', newline='') as f:
+                        template = build_result_template(f)
                 except Exception as e:
-                    app.logger.error(f"Failed to read CSV file {filepath}: {e}", extra=log_extra)
-                    LOADED_CSV_DATA[result_type][object_name] = ""
+                    app.logger.error("Failed to read CSV file %s: %s", path, e, extra=log_extra)
+                    continue
+                # エントリは丸ごと差し替える (リクエスト処理スレッドは常に更新前か更新後の一方を参照する)
+                if stat.st_size:
+                    self._fixtures[key] = {"path": path, "mtime_ns": stat.st_mtime_ns, "size": stat.st_size, "template": template}
+                else:
+                    self._fixtures.pop(key, None)
+                changed += 1
+                if not initial:
+                    app.logger.info("Reloaded %s data for %s from %s", result_type, object_name, os.path.basename(path), extra=log_extra)
+        return changed
+
+FIXTURES = FixtureRegistry(DATA_DIR)
+
+def load_csv_data():
+    FIXTURES.refresh(initial=True)
+    app.logger.info("CSV loading complete. Total objects loaded: %s", len(CSV_FILE_MAP), extra={'job_info': 'BOOT'})
+
+# 結果CSVのファイルの変更を定期的に確認するバックグラウンドスレッドを起動する
+def start_fixture_watcher():
+    if FIXTURE_WATCH_INTERVAL <= 0:
+        return None
+
+    def watch_loop():
+        while True:
+            time.sleep(FIXTURE_WATCH_INTERVAL)
+            try:
+                FIXTURES.refresh()
+            except Exception as e:
+                app.logger.error("Fixture reload failed: %s", e, extra={'job_info': 'LOAD'})
+
+    thread = threading.Thread(target=watch_loop, name='fixture-watcher', daemon=True)
+    thread.start()
+    return thread
+
+# CSVファイルから結果CSV生成用のテンプレートを作成する
+# ヘッダー行はファイルの表記 (引用符の有無) をそのまま使い、データ行 (先頭から最大 RESULT_TEMPLATE_MAX_ROWS 行) は生成時に循環して使う
+def build_result_template(f):
+    header = f.readline()
+    first_line = f.readline()
+    if not header or not first_line:
+        return None
+    rows = list(itertools.islice(csv.reader(itertools.chain([first_line], f)), RESULT_TEMPLATE_MAX_ROWS))
+    if not rows:
+        return None
+
+    columns = next(csv.reader([header]))
+    id_col = columns.index('sf__Id') if 'sf__Id' in columns else None
+    return {
+        "header": header.rstrip('\r\n'),
+        "rows": rows,
+        "quoting": csv.QUOTE_ALL if first_line.startswith('"') else csv.QUOTE_MINIMAL,
+        "id_col": id_col,
+    }
+
+
+# --- 4. ジョブストア ---
+# ジョブストアの共通インターフェース
+# ハンドラは get / put / update のみを使い、保存先 (プロセス内メモリ / SQLite) を意識しない
+class JobStore:
+    # ジョブを削除 (LRU / TTL) した後に job_id を渡して呼び出す関数 (ジョブに紐づくファイルの削除などに使う)
+    removal_listeners = ()
+
+    def add_removal_listener(self, listener):
+        self.removal_listeners = (*self.removal_listeners, listener)
+
+    # ストアのロック (トランザクション) の外で呼ぶ
+    def _notify_removed(self, job_ids):
+        for job_id in job_ids:
+            for listener in self.removal_listeners:
+                listener(job_id)
+
+    def get(self, job_id, default=None):
+        raise NotImplementedError
+
+    def put(self, job_id, job_data):
+        raise NotImplementedError
+
+    # job_data を取得して mutate(job_data) で更新し、保存するまでを不可分に行う
+    # ジョブが存在しない場合は None、存在すれば更新後の job_data を返す
+    def update(self, job_id, mutate):
+        raise NotImplementedError
+
+    def reap(self):
+        raise NotImplementedError
+
+    def stats(self):
+        raise NotImplementedError
+
+    # 保持している (期限切れでない) 全ジョブの job_data のリスト (メトリクスの集計用)
+    def snapshot(self):
+        raise NotImplementedError
+
+    # 指定した状態のジョブ数
+    def count_states(self, states):
+        raise NotImplementedError
+
+    # filters ({JOB_INDEX_FIELDS の項目: 値}) に一致するジョブを作成順に最大 limit 件返す
+    # 戻り値は (job_data のリスト, 続きを取得する際に after に渡す値 (続きがなければ None))
+    def list_jobs(self, filters, after, limit):
+        raise NotImplementedError
+
+    # Job ID の連番を count 件予約し、先頭の値を返す (予約した範囲は他のプロセス・スレッドに払い出さない)
+    def reserve_job_ids(self, count):
+        raise NotImplementedError
+
+    def __len__(self):
+        raise NotImplementedError
+
+    def __contains__(self, job_id):
+        return self.get(job_id) is not None
+
+    def __getitem__(self, job_id):
+        job_data = self.get(job_id)
+        if job_data is None:
+            raise KeyError(job_id)
+        return job_data
+
+    def __setitem__(self, job_id, job_data):
+        self.put(job_id, job_data)
+
+
+# Job ID の連番の初期値 (起動時刻のマイクロ秒)。再起動しても以前に払い出した ID より大きくなる
+def initial_job_id_sequence():
+    return time.time_ns() // 1000
+
+
+# ジョブの副索引の値 (JOB_INDEX_FIELDS の順)。job_type のないジョブはインジェストジョブとして扱う
+def job_index_values(job_data):
+    return tuple(job_data.get(field, 'V2Ingest' if field == 'job_type' else None) for field in JOB_INDEX_FIELDS)
+
+# 作成順の連番の集合 (ジョブ一覧の副索引)
+# 連番を JOB_SEQ_BUCKET_SIZE 件ごとのバケット (連番をキーとする dict) に分けて持ち、追加・削除は O(1)
+# バケット番号の昇順のリストを更新するのはバケットの作成時と空になった時のみ (要素数は ジョブ数 / JOB_SEQ_BUCKET_SIZE)
+# after より後の連番は、バケット番号を二分探索してそのバケットから昇順に取り出す
+JOB_SEQ_BUCKET_BITS = 10
+JOB_SEQ_BUCKET_SIZE = 1 << JOB_SEQ_BUCKET_BITS
+
+class JobSeqIndex:
+    __slots__ = ('_buckets', '_keys', '_size')
+
+    def __init__(self):
+        self._buckets = {}  # バケット番号 -> {連番: None}
+        self._keys = []     # バケット番号 (昇順)
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def add(self, seq):
+        key = seq >> JOB_SEQ_BUCKET_BITS
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = {}
+            # 新しい連番のバケットは通常は末尾に追加される
+            bisect.insort(self._keys, key)
+        bucket[seq] = None
+        self._size += 1
+
+    def discard(self, seq):
+        key = seq >> JOB_SEQ_BUCKET_BITS
+        bucket = self._buckets.get(key)
+        if bucket is None or seq not in bucket:
+            return
+        del bucket[seq]
+        self._size -= 1
+        if not bucket:
+            del self._buckets[key]
+            del self._keys[bisect.bisect_left(self._keys, key)]
+
+    # after より大きい連番を昇順に返す (走査中に集合を変更しないこと)
+    def iter_after(self, after):
+        keys = self._keys
+        for i in range(bisect.bisect_left(keys, after >> JOB_SEQ_BUCKET_BITS), len(keys)):
+            for seq in sorted(self._buckets[keys[i]]):
+                if seq > after:
+                    yield seq
+
+EMPTY_JOB_SEQ_INDEX = JobSeqIndex()
+
+
+# プロセス内メモリのジョブストア (シングルプロセス用)
+# 最大件数 (LRU) と状態ごとの保持期間 (TTL) を持つ
+# 状態ごとのTTLは一定なので、状態ごとのキューは遷移順 = 期限順に並び、先頭から O(1) で削除できる
+# ジョブ一覧用に、作成順の連番を 全ジョブ / 副索引の値ごと に JobSeqIndex で持つ (削除・状態の変更は O(1)、続きのページは連番から再開する)
+class MemoryJobStore(JobStore):
+    def __init__(self, max_jobs, state_ttls):
+        self.max_jobs = max_jobs
+        self.state_ttls = state_ttls
+        self._lock = threading.Lock()
+        self._jobs = OrderedDict()  # job_id -> job_data (アクセス順)
+        self._job_states = {}       # job_id -> TTLキュー上の状態
+        self._expiry_queues = {}    # state -> OrderedDict(job_id -> 期限)
+        self.evictions = Counter()  # 削除理由 ('lru' / 'ttl') ごとの件数
+        self._state_counts = Counter()  # 状態ごとのジョブ数
+        self._sequence = itertools.count(1)
+        self._job_seqs = {}         # job_id -> 作成順の連番
+        self._seq_jobs = {}         # 作成順の連番 -> job_id
+        self._all_seqs = JobSeqIndex()  # 全ジョブの連番
+        self._indexes = {field: {} for field in JOB_INDEX_FIELDS}  # 項目 -> 値 -> JobSeqIndex
+        self._index_values = {}     # job_id -> 副索引の値
+        self._next_job_id = initial_job_id_sequence()
+        self._removed = []          # 削除して未通知の job_id
+
+    def get(self, job_id, default=None):
+        with self._lock:
+            job_data = self._get_locked(job_id)
+        self._flush_removed()
+        return default if job_data is None else job_data
+
+    def put(self, job_id, job_data):
+        with self._lock:
+            self._put_locked(job_id, job_data)
+        self._flush_removed()
+
+    def update(self, job_id, mutate):
+        with self._lock:
+            job_data = self._get_locked(job_id)
+            if job_data is not None:
+                mutate(job_data)
+                self._put_locked(job_id, job_data)
+        self._flush_removed()
+        return job_data
+
+    def _flush_removed(self):
+        if self._removed:
+            with self._lock:
+                removed, self._removed = self._removed, []
+            self._notify_removed(removed)
+
+    def __len__(self):
+        return len(self._jobs)
+
+    def reserve_job_ids(self, count):
+        with self._lock:
+            start = self._next_job_id
+            self._next_job_id += count
+        return start
+
+    def _get_locked(self, job_id):
+        job_data = self._jobs.get(job_id)
+        if job_data is None:
+            return None
+        # バックグラウンド削除を待たずに期限切れを判定する
+        expires_at = self._expiry_queues.get(self._job_states[job_id], {}).get(job_id)
+        if expires_at is not None and expires_at <= time.monotonic():
+            self._evict(job_id, 'ttl')
+            return None
+        self._jobs.move_to_end(job_id)
+        return job_data
+
+    def _put_locked(self, job_id, job_data):
+        self._jobs[job_id] = job_data
+        self._jobs.move_to_end(job_id)
+
+        # 状態が変わった場合のみ、新しい状態のTTLキューの末尾に付け替える
+        state = job_data.get('state')
+        old_state = self._job_states.get(job_id)
+        if job_id not in self._job_states or old_state != state:
+            if job_id in self._job_states:
+                self._expiry_queues.get(old_state, {}).pop(job_id, None)
+                self._state_counts[old_state] -= 1
+            self._job_states[job_id] = state
+            self._state_counts[state] += 1
+            ttl = self.state_ttls.get(state)
+            if ttl is not None:
+                self._expiry_queues.setdefault(state, OrderedDict())[job_id] = time.monotonic() + ttl
+
+        # 副索引は値が変わった項目だけ付け替える
+        values = job_index_values(job_data)
+        old_values = self._index_values.get(job_id)
+        if old_values != values:
+            if old_values is None:
+                seq = next(self._sequence)
+                self._job_seqs[job_id] = seq
+                self._seq_jobs[seq] = job_id
+                self._all_seqs.add(seq)
+            self._reindex(job_id, old_values, values)
+            self._index_values[job_id] = values
+
+        while len(self._jobs) > self.max_jobs:
+            oldest_job_id = next(iter(self._jobs))
+            self._evict(oldest_job_id, 'lru')
+
+    def _reindex(self, job_id, old_values, values):
+        seq = self._job_seqs[job_id]
+        for i, field in enumerate(JOB_INDEX_FIELDS):
+            old_value = old_values[i] if old_values is not None else None
+            value = values[i] if values is not None else None
+            if old_values is not None and values is not None and old_value == value:
+                continue
+            index = self._indexes[field]
+            if old_values is not None:
+                index[old_value].discard(seq)
+                if not index[old_value]:
+                    del index[old_value]
+            if values is not None:
+                if value not in index:
+                    index[value] = JobSeqIndex()
+                index[value].add(seq)
+
+    def _evict(self, job_id, reason):
+        self._jobs.pop(job_id, None)
+        state = self._job_states.pop(job_id, None)
+        self._expiry_queues.get(state, {}).pop(job_id, None)
+        self._state_counts[state] -= 1
+        self._reindex(job_id, self._index_values.pop(job_id), None)
+        seq = self._job_seqs.pop(job_id)
+        del self._seq_jobs[seq]
+        self._all_seqs.discard(seq)
+        self.evictions[reason] += 1
+        if self.removal_listeners:
+            self._removed.append(job_id)
+
+    # 期限切れのジョブを削除し、削除件数を返す
+    def reap(self):
+        now = time.monotonic()
+        reaped = 0
+        with self._lock:
+            for queue in self._expiry_queues.values():
+                while queue:
+                    job_id, expires_at = next(iter(queue.items()))
+                    if expires_at > now:
+                        break
+                    self._evict(job_id, 'ttl')
+                    reaped += 1
+        self._flush_removed()
+        return reaped
+
+    def stats(self):
+        with self._lock:
+            return {
+                "backend": "memory",
+                "size": len(self._jobs),
+                "maxJobs": self.max_jobs,
+                "stateTtlSeconds": self.state_ttls,
+                "evictions": {"lru": self.evictions['lru'], "ttl": self.evictions['ttl']},
+            }
+
+    # 期限切れで未削除のジョブも含む (期限切れは最大で削除処理の間隔分だけ残る)
+    def count_states(self, states):
+        return sum(self._state_counts[state] for state in states)
+
+    def snapshot(self):
+        now = time.monotonic()
+        with self._lock:
+            return [job_data for job_id, job_data in self._jobs.items()
+                    if self._expiry_queues.get(self._job_states[job_id], {}).get(job_id, now + 1) > now]
+
+    # 最も件数の少ない副索引を after の連番の次から走査し、残りの条件は副索引の値で確認する
+    def list_jobs(self, filters, after, limit):
+        positions = [JOB_INDEX_FIELDS.index(field) for field in filters]
+        expected = tuple(filters.values())
+        now = time.monotonic()
+        jobs = []
+        last_seq = None
+        with self._lock:
+            seqs = min((self._indexes[field].get(value, EMPTY_JOB_SEQ_INDEX) for field, value in filters.items()),
+                       key=len, default=self._all_seqs)
+            for seq in seqs.iter_after(after):
+                job_id = self._seq_jobs[seq]
+                values = self._index_values[job_id]
+                if tuple(values[p] for p in positions) != expected:
+                    continue
+                if self._expiry_queues.get(self._job_states[job_id], {}).get(job_id, now + 1) <= now:
+                    continue
+                if len(jobs) == limit:
+                    return jobs, last_seq
+                jobs.append(self._jobs[job_id])
+                last_seq = seq
+        return jobs, None
+
+
+# SQLite (WALモード) のジョブストア (gunicorn などのマルチプロセス用)
+# 全ワーカーが同じDBファイルを共有し、更新は BEGIN IMMEDIATE のトランザクションで不可分に行う
+# LRU の順序は最終更新時刻で判定する (読み取りのたびに書き込みが発生しないように)
+class SqliteJobStore(JobStore):
+    def __init__(self, db_path, max_jobs, state_ttls):
+        self.db_path = db_path
+        self.max_jobs = max_jobs
+        self.state_ttls = state_ttls
+        self._local = threading.local()
+        with self._transaction() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                " job_id TEXT PRIMARY KEY, state TEXT, data TEXT NOT NULL,"
+                " updated_at REAL NOT NULL, expires_at REAL)"
+            )
+            # 副索引の列 (以前のバージョンで作成したDBには列を追加し、既存のジョブの値を埋める)
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(jobs)")}
+            for field in JOB_INDEX_FIELDS:
+                if field not in columns:
+                    conn.execute(f"ALTER TABLE jobs ADD COLUMN {field} TEXT")
+                    default = "'V2Ingest'" if field == 'job_type' else 'NULL'
+                    conn.execute(f"UPDATE jobs SET {field} = COALESCE(json_extract(data, '$.{field}'), {default})")
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_updated_at ON jobs (updated_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_expires_at ON jobs (expires_at)")
+            # 副索引は rowid (作成順) を含むため、「値 = ? AND rowid > ? ORDER BY rowid」は索引の範囲走査になる
+            for field in JOB_INDEX_FIELDS:
+                conn.execute(f"CREATE INDEX IF NOT EXISTS jobs_{field} ON jobs ({field})")
+            # 副索引の値ごとの件数 (ジョブ一覧で走査する索引の選択に使う)。一括削除にも追従するようトリガーで更新する
+            has_counts = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'job_index_counts'").fetchone()
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS job_index_counts ("
+                " field TEXT NOT NULL, value TEXT NOT NULL, count INTEGER NOT NULL, PRIMARY KEY (field, value))"
+            )
+            for field in JOB_INDEX_FIELDS:
+                increment = (
+                    f"INSERT INTO job_index_counts (field, value, count) VALUES ('{field}', COALESCE(NEW.{field}, ''), 1)"
+                    " ON CONFLICT (field, value) DO UPDATE SET count = count + 1;"
+                )
+                decrement = f"UPDATE job_index_counts SET count = count - 1 WHERE field = '{field}' AND value = COALESCE(OLD.{field}, '');"
+                conn.execute(f"CREATE TRIGGER IF NOT EXISTS jobs_{field}_insert AFTER INSERT ON jobs BEGIN {increment} END")
+                conn.execute(f"CREATE TRIGGER IF NOT EXISTS jobs_{field}_delete AFTER DELETE ON jobs BEGIN {decrement} END")
+                conn.execute(
+                    f"CREATE TRIGGER IF NOT EXISTS jobs_{field}_update AFTER UPDATE OF {field} ON jobs"
+                    f" WHEN OLD.{field} IS NOT NEW.{field} BEGIN {decrement} {increment} END"
+                )
+                if not has_counts:
+                    conn.execute(
+                        f"INSERT INTO job_index_counts (field, value, count)"
+                        f" SELECT '{field}', COALESCE({field}, ''), COUNT(*) FROM jobs GROUP BY COALESCE({field}, '')"
+                    )
+            # 件数と削除件数はワーカー間で共有するためメタテーブルで管理する
+            conn.execute("CREATE TABLE IF NOT EXISTS job_store_meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+            for key in ('size', 'evictions_lru', 'evictions_ttl'):
+                conn.execute("INSERT OR IGNORE INTO job_store_meta (key, value) VALUES (?, 0)", (key,))
+            # Job ID の連番 (全ワーカーで共有し、DBファイルを使い続ける限り再起動後も続きから払い出す)
+            conn.execute("INSERT OR IGNORE INTO job_store_meta (key, value) VALUES ('next_job_id', ?)", (initial_job_id_sequence(),))
+
+    # スレッド (および fork 後のプロセス) ごとに接続を持つ
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def _add_meta(self, conn, key, delta):
+        conn.execute("UPDATE job_store_meta SET value = value + ? WHERE key = ?", (delta, key))
+
+    def get(self, job_id, default=None):
+        row = self._connection().execute(
+            "SELECT data, expires_at FROM jobs WHERE job_id = ?", (job_id,)
+        ).fetchone()
+        if row is None:
+            return default
+        # 期限切れはバックグラウンド削除を待たずに存在しないものとして扱う
+        if row[1] is not None and row[1] <= time.time():
+            return default
+        return json.loads(row[0])
+
+    def put(self, job_id, job_data):
+        with self._transaction() as conn:
+            evicted = self._put_locked(conn, job_id, job_data)
+        self._notify_removed(evicted)
+
+    def update(self, job_id, mutate):
+        with self._transaction() as conn:
+            row = conn.execute(
+                "SELECT data, expires_at FROM jobs WHERE job_id = ?", (job_id,)
+            ).fetchone()
+            if row is None or (row[1] is not None and row[1] <= time.time()):
+                return None
+            job_data = json.loads(row[0])
+            mutate(job_data)
+            evicted = self._put_locked(conn, job_id, job_data)
+        self._notify_removed(evicted)
+        return job_data
+
+    # LRU で削除したジョブの job_id のリストを返す
+    def _put_locked(self, conn, job_id, job_data):
+        now = time.time()
+        state = job_data.get('state')
+        row = conn.execute("SELECT state, expires_at FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        if row is not None and row[0] == state:
+            # 同じ状態のままなら期限は変えない
+            expires_at = row[1]
+        else:
+            ttl = self.state_ttls.get(state)
+            expires_at = None if ttl is None else now + ttl
+        # 既存の行は UPDATE して rowid (ジョブ一覧の並び順) を変えない
+        conn.execute(
+            f"INSERT INTO jobs (job_id, {', '.join(JOB_INDEX_FIELDS)}, data, updated_at, expires_at)"
+            f" VALUES (?, {', '.join('?' * len(JOB_INDEX_FIELDS))}, ?, ?, ?)"
+            f" ON CONFLICT (job_id) DO UPDATE SET {''.join(f'{field} = excluded.{field}, ' for field in JOB_INDEX_FIELDS)}"
+            " data = excluded.data, updated_at = excluded.updated_at, expires_at = excluded.expires_at",
+            (job_id, *job_index_values(job_data), json.dumps(job_data, ensure_ascii=False), now, expires_at),
+        )
+        evicted = []
+        if row is None:
+            self._add_meta(conn, 'size', 1)
+            size = conn.execute("SELECT value FROM job_store_meta WHERE key = 'size'").fetchone()[0]
+            if size > self.max_jobs:
+                evicted = [row[0] for row in conn.execute(
+                    "DELETE FROM jobs WHERE job_id IN (SELECT job_id FROM jobs ORDER BY updated_at LIMIT ?) RETURNING job_id",
+                    (size - self.max_jobs,),
+                ).fetchall()]
+                self._add_meta(conn, 'size', -len(evicted))
+                self._add_meta(conn, 'evictions_lru', len(evicted))
+        return evicted
+
+    def __len__(self):
+        return self._connection().execute("SELECT value FROM job_store_meta WHERE key = 'size'").fetchone()[0]
+
+    def reserve_job_ids(self, count):
+        with self._transaction() as conn:
+            return conn.execute(
+                "UPDATE job_store_meta SET value = value + ? WHERE key = 'next_job_id' RETURNING value - ?", (count, count)
+            ).fetchall()[0][0]
+
+    def reap(self):
+        with self._transaction() as conn:
+            reaped = [row[0] for row in conn.execute(
+                "DELETE FROM jobs WHERE expires_at <= ? RETURNING job_id", (time.time(),)
+            ).fetchall()]
+            if reaped:
+                self._add_meta(conn, 'size', -len(reaped))
+                self._add_meta(conn, 'evictions_ttl', len(reaped))
+        self._notify_removed(reaped)
+        return len(reaped)
+
+    def stats(self):
+        meta = dict(self._connection().execute("SELECT key, value FROM job_store_meta").fetchall())
+        return {
+            "backend": "sqlite",
+            "size": meta['size'],
+            "maxJobs": self.max_jobs,
+            "stateTtlSeconds": self.state_ttls,
+            "evictions": {"lru": meta['evictions_lru'], "ttl": meta['evictions_ttl']},
+        }
+
+    def snapshot(self):
+        rows = self._connection().execute(
+            "SELECT data FROM jobs WHERE expires_at IS NULL OR expires_at > ?", (time.time(),)
+        ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def count_states(self, states):
+        placeholders = ','.join('?' * len(states))
+        return self._connection().execute(
+            f"SELECT COUNT(*) FROM jobs WHERE state IN ({placeholders}) AND (expires_at IS NULL OR expires_at > ?)",
+            (*states, time.time()),
+        ).fetchone()[0]
+
+    # 値の件数が最も少ない副索引を INDEXED BY で指定して走査し、残りの条件は索引を使わずに (+列) 確認する
+    # (ANALYZE の統計は値ごとの平均件数のため、状態のように値ごとの件数の偏りが大きい列では索引の選択を誤る)
+    def list_jobs(self, filters, after, limit):
+        conn = self._connection()
+        indexed_by = ''
+        conditions = ''
+        if filters:
+            counts = {
+                field: (conn.execute(
+                    "SELECT count FROM job_index_counts WHERE field = ? AND value = ?", (field, value)
+                ).fetchone() or (0,))[0]
+                for field, value in filters.items()
+            }
+            best = min(counts, key=counts.get)
+            indexed_by = f" INDEXED BY jobs_{best}"
+            conditions = ''.join(f" AND {'' if field == best else '+'}{field} = ?" for field in filters)
+        rows = conn.execute(
+            f"SELECT rowid, data FROM jobs{indexed_by} WHERE rowid > ?{conditions} AND (expires_at IS NULL OR expires_at > ?)"
+            " ORDER BY rowid LIMIT ?",
+            (after, *filters.values(), time.time(), limit + 1),
+        ).fetchall()
+        jobs = [json.loads(row[1]) for row in rows[:limit]]
+        return jobs, rows[limit - 1][0] if len(rows) > limit else None
+
+
+# 環境変数 STUB_JOB_STORE_BACKEND に従ってジョブストアを作成する
+def create_job_store():
+    if JOB_STORE_BACKEND == 'sqlite':
+        return SqliteJobStore(JOB_STORE_DB_PATH, JOB_STORE_MAX_JOBS, JOB_STATE_TTL_SECONDS)
+    if JOB_STORE_BACKEND == 'memory':
+        return MemoryJobStore(JOB_STORE_MAX_JOBS, JOB_STATE_TTL_SECONDS)
+    raise ValueError(f"Unknown job store backend: {JOB_STORE_BACKEND}")
+
+
+# ジョブ状態を保存するストア
+JOB_STORE = create_job_store()
+
+# --- 5. ジョブ状態の遷移スケジューラ ---
+# UploadComplete になった時点で InProgress / JobComplete への遷移時刻を決めてジョブに記録する
+# GET は記録された時刻と現在時刻から状態を求めるだけで、ポーリング回数に依存しない
+def sample_latency(spec, rng, row_count):
+    dist = spec.get("dist", "fixed")
+    if dist == "fixed":
+        seconds = spec.get("seconds", 0.0)
+    elif dist == "uniform":
+        seconds = rng.uniform(spec.get("min", 0.0), spec.get("max", 0.0))
+    elif dist == "lognormal":
+        seconds = rng.lognormvariate(math.log(spec.get("median", 1.0)), spec.get("sigma", 0.0))
+    else:
+        raise ValueError(f"Unknown latency distribution: {dist}")
+    return seconds + spec.get("per_row", 0.0) * row_count
+
+# ジョブの状態遷移時刻 (epoch秒) を決める。同じジョブIDなら常に同じ処理時間になる
+def build_state_schedule(job_data, start_time):
+    profile = JOB_LATENCY_PROFILES.get(job_data["object"], JOB_LATENCY_PROFILES["default"])
+    rng = random.Random(job_data["id"])
+    row_count = job_data.get("upload_rows", job_data.get("query_rows", 0))
+    in_progress_at = start_time + sample_latency(profile["queue"], rng, 0)
+    complete_at = in_progress_at + sample_latency(profile["processing"], rng, row_count)
+    return {"InProgress": in_progress_at, "JobComplete": complete_at}
+
+# 現在時刻におけるジョブの状態を返す (ジョブ情報は変更しない)
+def resolve_job_state(job_data, now=None):
+    state = job_data["state"]
+    schedule = job_data.get("state_schedule")
+    if not schedule:
+        return state
+    now = time.time() if now is None else now
+    for next_state in ("JobComplete", "InProgress"):
+        # アップロードの検証中は JobComplete にしない
+        if next_state == "JobComplete" and job_data.get('validation') == 'pending':
+            continue
+        if schedule[next_state] <= now:
+            if JOB_STATE_ORDER[next_state] > JOB_STATE_ORDER.get(state, 0):
+                return next_state
+            break
+    return state
+
+
+# ジョブストア上の状態を state まで進める (既に同じか先の状態なら変更しない)
+def advance_job_state(job_id, state):
+    def advance(job):
+        if state == 'JobComplete' and job.get('validation') == 'pending':
+            return
+        if JOB_STATE_ORDER[state] > JOB_STATE_ORDER.get(job['state'], 0):
+            job['state'] = state
+    JOB_STORE.update(job_id, advance)
+
+
+# 遷移時刻になったジョブの状態をジョブストアに反映するタイマーヒープ
+# GET は resolve_job_state で状態を求めるため、ここでの反映が遅れても応答は変わらない
+# (ジョブストアの状態別TTLなどを正しく動かすための反映)
+class JobStateScheduler:
+    def __init__(self):
+        self._heap = []  # (遷移時刻, 連番, job_id, 遷移先の状態)
+        self._counter = 0
+        self._cond = threading.Condition()
+
+    def schedule(self, job_id, state_schedule):
+        with self._cond:
+            for state, due in state_schedule.items():
+                self._counter += 1
+                heapq.heappush(self._heap, (due, self._counter, job_id, state))
+            self._cond.notify()
+
+    def __len__(self):
+        return len(self._heap)
+
+    def run(self):
+        while True:
+            with self._cond:
+                while not self._heap or self._heap[0][0] > time.time():
+                    timeout = self._heap[0][0] - time.time() if self._heap else None
+                    self._cond.wait(timeout)
+                due, _, job_id, state = heapq.heappop(self._heap)
+            advance_job_state(job_id, state)
+
+    def start(self):
+        thread = threading.Thread(target=self.run, name='job-state-scheduler', daemon=True)
+        thread.start()
+        return thread
+
+
+JOB_SCHEDULER = JobStateScheduler()
+
+
+# 期限切れジョブを定期的に削除するバックグラウンドスレッドを起動する
+def start_job_store_reaper():
+    def reaper_loop():
+        while True:
+            time.sleep(JOB_STORE_REAP_INTERVAL)
+            reaped = JOB_STORE.reap()
+            if reaped:
+                app.logger.info("Job store reaper evicted %s expired jobs. Size: %s", reaped, len(JOB_STORE), extra={'job_info': 'REAPER'})
+            pruned = API_RATE_LIMITER.prune()
+            if pruned:
+                app.logger.info("Rate limiter pruned %s idle buckets.", pruned, extra={'job_info': 'REAPER'})
+
+    thread = threading.Thread(target=reaper_loop, name='job-store-reaper', daemon=True)
+    thread.start()
+    return thread
+
+
+# --- 6. 事前エンコード済みレスポンス ---
+# Composite / OAuth の固定レスポンス ((エンドポイント, 分岐, 結果) ごと。シナリオファイルの応答も追加される)
+# 起動時に一度だけJSONエンコードし、リクエストごとには bytes をそのまま返す
+STATIC_RESPONSE_BODIES = {
+    # Composite はサブ要求1件分の応答 (compositeResponse の要素)。referenceId はリクエストの値を埋め込む
+    # サブ要求のAPIごとの応答は SCENARIOS_FILE から追加する
+    # Composite: allOrNone で他のサブ要求が失敗したためロールバックされたサブ要求
+    ('composite', 'rollback', 'error'): {
+        "body": [
+            {
+                "message": "The transaction was rolled back since another operation in the same transaction failed.",
+                "errorCode": "PROCESSING_HALTED"
+            }
+        ],
+        "httpHeaders": {},
+        "httpStatusCode": 400,
+        "referenceId": RESPONSE_PLACEHOLDER
+    },
+    # sObject Collections はレコード1件分の結果 (結果配列の要素)。id はレコードごとに埋め込む
+    # 作成 (POST) / 更新 (PATCH) - 正常系
+    ('sobjects', 'save', 'success'): {
+        "id": RESPONSE_PLACEHOLDER,
+        "success": True,
+        "errors": []
+    },
+    # 外部IDによるアップサート (PATCH /{sobject}/{外部ID項目}) - 正常系
+    ('sobjects', 'upsert', 'success'): {
+        "id": RESPONSE_PLACEHOLDER,
+        "success": True,
+        "errors": [],
+        "created": True
+    },
+    # 異常系 (X-API-Key が正常系以外の場合。Composite の IF-630001 と同じエラー)
+    ('sobjects', 'save', 'error'): {
+        "success": False,
+        "errors": [
+            {
+                "statusCode": "MALFORMED_ID",
+                "message": "malformed id XXXXXXXXXXXXXXX.",
+                "fields": []
+            }
+        ]
+    },
+    # attributes.type が未指定 (またはアップサート先のオブジェクトと不一致) のレコード
+    ('sobjects', 'invalid_type', 'error'): {
+        "success": False,
+        "errors": [
+            {
+                "statusCode": "INVALID_TYPE",
+                "message": "Must send a concrete entity type.",
+                "fields": []
+            }
+        ]
+    },
+    # 更新 (PATCH) で id が未指定のレコード
+    ('sobjects', 'missing_id', 'error'): {
+        "success": False,
+        "errors": [
+            {
+                "statusCode": "MISSING_ARGUMENT",
+                "message": "Id not specified in an update call",
+                "fields": []
+            }
+        ]
+    },
+    # allOrNone で他のレコードが失敗したためロールバックされたレコード
+    ('sobjects', 'rollback', 'error'): {
+        "success": False,
+        "errors": [
+            {
+                "statusCode": "ALL_OR_NONE_OPERATION_ROLLED_BACK",
+                "message": "Record rolled back because not all records were valid and the request was using AllOrNone header",
+                "fields": []
+            }
+        ]
+    },
+    # OAuth: 正常系 (access_token と issued_at はリクエストごとに埋め込む)
+    ('oauth', 'token', 'success'): {
+        "access_token": RESPONSE_PLACEHOLDER,
+        "signature": "O+F5lk/JVr1igcveRHFEungRl9m3scP6dbYKwltuPL0=",
+        "scope": "api",
+        "instance_url": "https://dev-202407111759-dev-ed.develop.my.salesforce.com",
+        "id": "https://login.salesforce.com/id/00DGC0000058KAD2AE/005GC00000KhBwYYAU",
+        "token_type": "Bearer",
+        "issued_at": RESPONSE_PLACEHOLDER
+    },
+    # OAuth: 必須パラメータ不足
+    ('oauth', 'token', 'invalid_request'): {
+        "error": "invalid_grant",
+        "error_description": "missing or invalid credentials"
+    },
+}
+
+# エンコード済みレスポンス: 固定値は bytes、埋め込み値があるものは埋め込み位置で分割した bytes のタプル
+RESPONSE_CACHE = {}
+# 配列の要素として組み立てる (レスポンス全体ではない) エンドポイント
+RESPONSE_FRAGMENT_ENDPOINTS = ('composite', 'sobjects')
+
+# jsonify と同じ形式 (キー順・区切り文字) でエンコードする
+def encode_json(obj):
+    return app.json.dumps(obj, separators=(',', ':')).encode('utf-8')
+
+def build_response_cache():
+    placeholder = encode_json(RESPONSE_PLACEHOLDER)
+    for key, body in STATIC_RESPONSE_BODIES.items():
+        encoded = encode_json(body)
+        # 配列の要素はレスポンス全体ではないので、末尾改行 (jsonify と同じ) は付けない
+        if key[0] not in RESPONSE_FRAGMENT_ENDPOINTS:
+            encoded += b'\n'
+        if placeholder in encoded:
+            parts = encoded.split(placeholder)
+            RESPONSE_CACHE[key] = (parts[0] + b'"', *(b'"' + part + b'"' for part in parts[1:-1]), b'"' + parts[-1])
+        else:
+            RESPONSE_CACHE[key] = encoded
+
+def cached_json_response(key, status=200):
+    return Response(RESPONSE_CACHE[key], status=status, mimetype='application/json')
+
+# テンプレートの埋め込み位置に文字列値 (JSONエスケープ不要な値) を挿入して返す
+# 埋め込み位置が複数ある場合は、エンコード後の順 (キーの昇順) に値を渡す
+def spliced_json_response(key, *values, status=200):
+    parts = RESPONSE_CACHE[key]
+    body = [parts[0]]
+    for value, part in zip(values, parts[1:]):
+        body.append(value.encode('utf-8'))
+        body.append(part)
+    return Response(b''.join(body), status=status, mimetype='application/json')
+
+# Composite のサブ要求1件分の応答 (bytes) に referenceId を埋め込む
+def composite_entry(key, reference_id):
+    before, after = RESPONSE_CACHE[key]
+    return before + json.dumps(reference_id)[1:-1].encode('utf-8') + after
+
+# サブ要求の応答 (bytes) を並べて compositeResponse 全体を組み立てる
+def encode_composite_response(entries):
+    return b'{"compositeResponse":[' + b','.join(entries) + b']}\n'
+
+
+# --- 7. メトリクス ---
+# リクエスト処理スレッドごとに集計用の領域 (シャード) を持ち、記録時はロックを取らずに自スレッドのシャードだけを更新する
+# ロックを取るのはシャードの作成時と /metrics の集計時のみ。集計時に他スレッドが更新中の値は次回の集計に反映される
+class MetricsShard:
+    __slots__ = ('requests', 'uploads', 'sessions', 'thread')
+
+    def __init__(self, thread):
+        self.requests = {}  # (route, method, status) -> [件数, 受信bytes, 送信bytes, 合計秒数, バケットごとの件数...]
+        self.uploads = {}   # object -> [件数, bytes]
+        self.sessions = {}  # (event, client_id) -> 件数 (event: issued / used / expired / invalid)
+        self.thread = thread
+
+    # 他のシャードの値を加算する (終了したスレッドのシャードの統合と集計に使用)
+    def merge(self, other):
+        for key, values in list(other.requests.items()):
+            entry = self.requests.get(key)
+            if entry is None:
+                self.requests[key] = list(values)
+            else:
+                for i, value in enumerate(values):
+                    entry[i] += value
+        for key, values in list(other.uploads.items()):
+            entry = self.uploads.setdefault(key, [0, 0])
+            entry[0] += values[0]
+            entry[1] += values[1]
+        for key, count in list(other.sessions.items()):
+            self.sessions[key] = self.sessions.get(key, 0) + count
+
+
+class Metrics:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._shards = []
+        # 終了したスレッドのシャードを統合したもの (リクエストごとにスレッドを作るサーバーでもシャードが増え続けないように)
+        self._retired = MetricsShard(None)
+
+    def _shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = MetricsShard(threading.current_thread())
+            with self._lock:
+                alive = []
+                for other in self._shards:
+                    if other.thread.is_alive():
+                        alive.append(other)
+                    else:
+                        self._retired.merge(other)
+                alive.append(shard)
+                self._shards = alive
+            self._local.shard = shard
+        return shard
+
+    def observe_request(self, key, seconds, bytes_in, bytes_out):
+        requests = self._shard().requests
+        entry = requests.get(key)
+        if entry is None:
+            entry = requests[key] = [0, 0, 0, 0.0] + [0] * (len(self.buckets) + 1)
+        entry[0] += 1
+        entry[1] += bytes_in
+        entry[2] += bytes_out
+        entry[3] += seconds
+        entry[4 + bisect.bisect_left(self.buckets, seconds)] += 1
+
+    # ストリーム返却のレスポンスは、送信が終わった時点 (close) で送信bytesとレイテンシを記録する
+    def observe_stream(self, key, start, bytes_in, iterable):
+        sent = 0
+        try:
+            for chunk in iterable:
+                sent += len(chunk)
+                yield chunk
+        finally:
+            self.observe_request(key, time.perf_counter() - start, bytes_in, sent)
+
+    def add_upload(self, object_name, rows, size):
+        uploads = self._shard().uploads
+        entry = uploads.get(object_name)
+        if entry is None:
+            entry = uploads[object_name] = [0, 0]
+        entry[0] += rows
+        entry[1] += size
+
+    # シナリオに定義されていない client_id は任意の値を取れるため、ラベルの種類が増え続けないよう "other" にまとめる
+    def add_session_event(self, event, client_id):
+        if client_id not in ('static', '') and (client_id == SCENARIO_WILDCARD or client_id not in OAUTH_CLIENT_OUTCOMES):
+            client_id = 'other'
+        sessions = self._shard().sessions
+        key = (event, client_id)
+        sessions[key] = sessions.get(key, 0) + 1
+
+    # 全シャードを合算したスナップショット
+    def collect(self):
+        total = MetricsShard(None)
+        with self._lock:
+            total.merge(self._retired)
+            for shard in self._shards:
+                total.merge(shard)
+        return total
+
+METRICS = Metrics(METRICS_LATENCY_BUCKETS)
+
+# ルートのハンドラを計測用の関数で包む (init_app で全ルートに適用する)
+def instrument_view(endpoint, view):
+    @functools.wraps(view)
+    def instrumented_view(*args, **kwargs):
+        start = time.perf_counter()
+        bytes_in = request.content_length or 0
+        try:
+            response = app.make_response(view(*args, **kwargs))
+        except HTTPException as e:
+            METRICS.observe_request((endpoint, request.method, e.code), time.perf_counter() - start, bytes_in, 0)
+            raise
+        except Exception:
+            METRICS.observe_request((endpoint, request.method, 500), time.perf_counter() - start, bytes_in, 0)
+            raise
+        key = (endpoint, request.method, response.status_code)
+        # ファイルの送信 (direct_passthrough) は wsgi.file_wrapper を使えるよう包まず、Content-Length を送信bytesとする
+        if response.is_streamed and not response.direct_passthrough:
+            response.response = METRICS.observe_stream(key, start, bytes_in, response.response)
+        else:
+            bytes_out = 0 if response.status_code == 304 or request.method == 'HEAD' else response.content_length or 0
+            METRICS.observe_request(key, time.perf_counter() - start, bytes_in, bytes_out)
+        return response
+    instrumented_view.stub_instrumented = True
+    return instrumented_view
+
+def instrument_view_functions():
+    for endpoint, view in list(app.view_functions.items()):
+        if not getattr(view, 'stub_instrumented', False):
+            app.view_functions[endpoint] = instrument_view(endpoint, view)
+
+def escape_metric_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_metric_labels(labels):
+    return '{' + ','.join(f'{name}="{escape_metric_label(value)}"' for name, value in labels) + '}'
+
+# Prometheus テキスト形式 (version 0.0.4) で全メトリクスを出力する
+def render_metrics():
+    snapshot = METRICS.collect()
+    lines = []
+
+    def family(name, metric_type, help_text):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {metric_type}")
+
+    requests = sorted(snapshot.requests.items(), key=lambda item: (item[0][0], item[0][1], item[0][2]))
+    label_sets = [(format_metric_labels((("route", route), ("method", method), ("status", status))), values)
+                  for (route, method, status), values in requests]
+
+    family("stub_http_requests_total", "counter", "Total HTTP requests by route, method and status.")
+    lines.extend(f"stub_http_requests_total{labels} {values[0]}" for labels, values in label_sets)
+    family("stub_http_request_bytes_total", "counter", "Total request body bytes received.")
+    lines.extend(f"stub_http_request_bytes_total{labels} {values[1]}" for labels, values in label_sets)
+    family("stub_http_response_bytes_total", "counter", "Total response body bytes sent.")
+    lines.extend(f"stub_http_response_bytes_total{labels} {values[2]}" for labels, values in label_sets)
+
+    family("stub_http_request_duration_seconds", "histogram", "Request latency including streamed response bodies.")
+    for (route, method, status), values in requests:
+        cumulative = 0
+        for bound, count in zip(METRICS.buckets + ('+Inf',), values[4:]):
+            cumulative += count
+            labels = format_metric_labels((("route", route), ("method", method), ("status", status), ("le", bound)))
+            lines.append(f"stub_http_request_duration_seconds_bucket{labels} {cumulative}")
+        labels = format_metric_labels((("route", route), ("method", method), ("status", status)))
+        lines.append(f"stub_http_request_duration_seconds_sum{labels} {values[3]:.6f}")
+        lines.append(f"stub_http_request_duration_seconds_count{labels} {values[0]}")
+
+    family("stub_upload_rows_total", "counter", "Total CSV records uploaded by object.")
+    lines.extend(f"stub_upload_rows_total{format_metric_labels((('object', name),))} {values[0]}"
+                 for name, values in sorted(snapshot.uploads.items()))
+    family("stub_upload_bytes_total", "counter", "Total CSV bytes uploaded by object.")
+    lines.extend(f"stub_upload_bytes_total{format_metric_labels((('object', name),))} {values[1]}"
+                 for name, values in sorted(snapshot.uploads.items()))
+
+    # ジョブ数は集計時点の状態 (経過時間から求めた状態) ごとに数える
+    now = time.time()
+    job_counts = Counter((resolve_job_state(job_data, now), job_data.get('object', '')) for job_data in JOB_STORE.snapshot())
+    family("stub_job_store_jobs", "gauge", "Jobs currently held in the job store by state and object.")
+    lines.extend(f"stub_job_store_jobs{format_metric_labels((('state', state), ('object', name)))} {count}"
+                 for (state, name), count in sorted(job_counts.items()))
+    store_stats = JOB_STORE.stats()
+    family("stub_job_store_size", "gauge", "Jobs currently held in the job store.")
+    lines.append(f"stub_job_store_size {store_stats['size']}")
+    family("stub_job_store_evictions_total", "counter", "Jobs evicted from the job store by reason.")
+    lines.extend(f"stub_job_store_evictions_total{format_metric_labels((('reason', reason),))} {count}"
+                 for reason, count in sorted(store_stats['evictions'].items()))
+
+    # クライアントごとのトークン発行数と使用回数 (使用回数 / 発行数 が小さいほどトークンを使い回していない)
+    session_events = sorted(snapshot.sessions.items())
+    family("stub_oauth_tokens_issued_total", "counter", "Access tokens issued by client_id.")
+    lines.extend(f"stub_oauth_tokens_issued_total{format_metric_labels((('client_id', client_id),))} {count}"
+                 for (event, client_id), count in session_events if event == 'issued')
+    family("stub_oauth_token_uses_total", "counter", "API requests authenticated with a valid access token by client_id.")
+    lines.extend(f"stub_oauth_token_uses_total{format_metric_labels((('client_id', client_id),))} {count}"
+                 for (event, client_id), count in session_events if event == 'used')
+    family("stub_oauth_token_rejections_total", "counter", "API requests rejected with INVALID_SESSION_ID by reason and client_id.")
+    lines.extend(f"stub_oauth_token_rejections_total{format_metric_labels((('reason', event), ('client_id', client_id)))} {count}"
+                 for (event, client_id), count in session_events if event in ('expired', 'invalid'))
+    family("stub_oauth_sessions", "gauge", "Sessions held in this process's session registry.")
+    lines.append(f"stub_oauth_sessions {len(OAUTH_SESSIONS)}")
+
+    family("stub_upload_spool_memory_bytes", "gauge", "Uploaded CSV bytes held in memory instead of spool files.")
+    lines.append(f"stub_upload_spool_memory_bytes {UPLOAD_SPOOL.memory_size}")
+
+    family("stub_log_records_dropped_total", "counter", "Log records dropped because the log queue was full.")
+    lines.append(f"stub_log_records_dropped_total {_log_queue_handler.dropped if _log_queue_handler else 0}")
+    if CAPTURE is not None:
+        family("stub_capture_records_dropped_total", "counter", "Captured requests dropped because the capture queue was full.")
+        lines.append(f"stub_capture_records_dropped_total {CAPTURE.dropped}")
+    return '\n'.join(lines) + '\n'
+
+
+# --- 8. API制限のエミュレーション ---
+# トークンバケットによるリクエスト数の制限 (トークン x ルートごと)
+# バケットは参照時に経過時間分を補充するだけなので O(1)。ロックはキーのハッシュで分割し、別のバケット同士では競合しない
+class TokenBucketLimiter:
+    def __init__(self, limits, stripes):
+        self.limits = limits
+        self._locks = [threading.Lock() for _ in range(stripes)]
+        self._buckets = {}  # (token, route) -> [残りトークン数, 最終補充時刻]
+
+    # 1トークン消費できれば 0、できなければ次のトークンが補充されるまでの秒数を返す
+    def acquire(self, token, route):
+        limit = self.limits.get(route) or self.limits.get("default")
+        if not limit:
+            return 0.0
+        key = (token, route)
+        now = time.monotonic()
+        with self._locks[hash(key) % len(self._locks)]:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [float(limit["burst"]), now]
             else:
-                app.logger.warning(f"CSV file not found: {filepath}. Setting empty data.", extra=log_extra)
-                LOADED_CSV_DATA[result_type][object_name] = ""
-    app.logger.info(f"CSV loading complete. Total objects loaded: {len(CSV_FILE_MAP)}", extra={'job_info': 'BOOT'})
+                bucket[0] = min(float(limit["burst"]), bucket[0] + (now - bucket[1]) * limit["rate"])
+                bucket[1] = now
+            if bucket[0] >= 1:
+                bucket[0] -= 1
+                return 0.0
+            return (1 - bucket[0]) / limit["rate"]
+
+    # 満タンまで補充済みのバケツを削除し、削除した件数を返す (作り直しても同じ状態になるため)
+    # キーはセッショントークンごとに増えるので、リーパーから定期的に呼んで上限なく増えないようにする
+    def prune(self):
+        now = time.monotonic()
+        pruned = 0
+        for key in list(self._buckets):
+            limit = self.limits.get(key[1]) or self.limits.get("default")
+            with self._locks[hash(key) % len(self._locks)]:
+                bucket = self._buckets.get(key)
+                if bucket is not None and (not limit or bucket[0] + (now - bucket[1]) * limit["rate"] >= limit["burst"]):
+                    del self._buckets[key]
+                    pruned += 1
+        return pruned
+
+
+# 1日 (UTC) あたりのAPIリクエスト数 (プロセスごと)
+# itertools.count の next() は不可分なので、ロックを取るのは日付が変わったときだけ
+class DailyApiCounter:
+    def __init__(self, limit):
+        self.limit = limit
+        self._lock = threading.Lock()
+        self._day = None
+        self._counter = None
+
+    # 今回のリクエストを数え、当日の累計を返す
+    def increment(self):
+        day = int(time.time() // 86400)
+        if day != self._day:
+            with self._lock:
+                if day != self._day:
+                    self._counter = itertools.count(1)
+                    self._day = day
+        return next(self._counter)
+
+API_RATE_LIMITER = TokenBucketLimiter(API_RATE_LIMITS, RATE_LIMIT_LOCK_STRIPES)
+DAILY_API_COUNTER = DailyApiCounter(DAILY_API_REQUEST_LIMIT)
+
+# APIリクエストを数えて制限を確認する。制限を超えた場合は 429 のレスポンスを返す
+def check_api_limits(token, log_extra):
+    if DAILY_API_COUNTER.limit:
+        usage = DAILY_API_COUNTER.increment()
+        g.api_usage = usage
+        if usage > DAILY_API_COUNTER.limit:
+            app.logger.warning("REQ: %s %s | ERROR: Daily API request limit exceeded: %s/%s", request.method, request.path, usage, DAILY_API_COUNTER.limit, extra=log_extra)
+            return jsonify({"message": "TotalRequests Limit exceeded.", "errorCode": "REQUEST_LIMIT_EXCEEDED"}), 429
+
+    retry_after = API_RATE_LIMITER.acquire(token, request.endpoint)
+    if retry_after:
+        app.logger.warning("REQ: %s %s | ERROR: Rate limit exceeded. Retry after %.3f seconds.", request.method, request.path, retry_after, extra=log_extra)
+        response = jsonify({"message": "Request rate limit exceeded.", "errorCode": "REQUEST_LIMIT_EXCEEDED"})
+        response.headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+        return response, 429
+    return None
+
+@app.after_request
+def add_limit_info_header(response):
+    usage = g.get('api_usage')
+    if usage is not None:
+        response.headers['Sforce-Limit-Info'] = f"api-usage={usage}/{DAILY_API_COUNTER.limit}"
+    return response
+
+
+# --- 9. OAuth セッション ---
+# 発行したアクセストークン -> (client_id, 有効期限) をプロセス内のハッシュ表で保持し、検証は辞書の参照1回で行う
+# 有効期間は一定なので発行順 = 期限順になり、期限切れは発行時に先頭から取り除く (参照時に期限切れなら個別に取り除く)
+# トークンには発行時刻と client_id を含めて署名するため、他のワーカープロセスが発行したトークンや
+# 上限を超えて破棄したトークンも署名で検証できる (検証できたものは自プロセスの表に追加する)
+class OAuthSessionRegistry:
+    def __init__(self, ttl, max_sessions, secret, static_tokens):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.secret = secret
+        self.static_tokens = frozenset(static_tokens)
+        self._lock = threading.Lock()
+        self._sessions = OrderedDict()  # token -> (client_id, 有効期限)
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def _sign(self, payload):
+        digest = hmac.new(self.secret, payload.encode('ascii'), hashlib.sha256).digest()[:18]
+        return base64.urlsafe_b64encode(digest).decode('ascii')
+
+    # 新しいアクセストークンを発行し、(トークン, 発行時刻 (epoch秒)) を返す
+    def issue(self, client_id):
+        issued_at = int(time.time())
+        raw = f"{issued_at}.{secrets.token_hex(8)}.{client_id}".encode('utf-8')
+        payload = base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+        token = f"{OAUTH_ORG_ID}!{payload}.{self._sign(payload)}"
+        with self._lock:
+            self._remember(token, client_id, issued_at + self.ttl)
+            # 先頭 (発行の古いもの) から期限切れを取り除く
+            now = time.time()
+            while self._sessions:
+                oldest = next(iter(self._sessions.values()))
+                if oldest[1] > now:
+                    break
+                self._sessions.popitem(last=False)
+        return token, issued_at
+
+    def _remember(self, token, client_id, expires_at):
+        self._sessions[token] = (client_id, expires_at)
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+
+    # 署名からセッションを復元する。署名が一致しなければ None
+    def _verify(self, token):
+        org_id, _, rest = token.partition('!')
+        payload, _, signature = rest.rpartition('.')
+        if org_id != OAUTH_ORG_ID or not payload or not hmac.compare_digest(signature, self._sign(payload)):
+            return None
+        try:
+            issued_at, _, client_id = base64.urlsafe_b64decode(payload + '=' * (-len(payload) % 4)).decode('utf-8').split('.', 2)
+            return client_id, int(issued_at) + self.ttl
+        except ValueError:
+            return None
+
+    # アクセストークンを検証し、(client_id, 結果) を返す。結果は valid / expired / invalid
+    def validate(self, token):
+        if token in self.static_tokens:
+            return 'static', 'valid'
+        session = self._sessions.get(token)
+        if session is None:
+            session = self._verify(token)
+            if session is None:
+                return '', 'invalid'
+            if session[1] > time.time():
+                with self._lock:
+                    self._remember(token, *session)
+        client_id, expires_at = session
+        if expires_at <= time.time():
+            with self._lock:
+                self._sessions.pop(token, None)
+            return client_id, 'expired'
+        return client_id, 'valid'
+
+OAUTH_SESSIONS = OAuthSessionRegistry(OAUTH_TOKEN_TTL_SECONDS, OAUTH_MAX_SESSIONS, OAUTH_TOKEN_SECRET, OAUTH_STATIC_TOKENS)
+
+# クライアントごとのトークン発行数・使用回数と拒否件数 (メトリクスから集計)
+def session_stats():
+    clients = {}
+    rejections = {}
+    for (event, client_id), count in METRICS.collect().sessions.items():
+        if event in ('issued', 'used'):
+            clients.setdefault(client_id, {"issued": 0, "used": 0})[event] = count
+        else:
+            rejections.setdefault(event, {})[client_id] = count
+    for counts in clients.values():
+        counts["usesPerToken"] = round(counts["used"] / counts["issued"], 2) if counts["issued"] else None
+    return {
+        "activeSessions": len(OAUTH_SESSIONS),
+        "ttlSeconds": OAUTH_SESSIONS.ttl,
+        "clients": clients,
+        "rejections": rejections,
+    }
+
+
+# --- 10. トラフィックのキャプチャ ---
+# 受信したリクエストを1行1件の JSON で追記する (bench/replay.py で時間を伸縮して再送できる)
+# リクエスト処理スレッドは記録する値をキューに積むだけにし、JSON への変換と書き込みは専用の書き込みスレッドで行う
+# 書き込みはまとめた行を1回の write (O_APPEND) で行うため、複数ワーカープロセスが同じファイルに追記しても行が混ざらない
+
+# wsgi.input を包み、ハンドラが読んだボディのハッシュ値・サイズ・行数を求める (上限以下ならボディも保持する)
+class CaptureInput:
+    def __init__(self, stream, keep_bytes):
+        self.stream = stream
+        self.keep_bytes = keep_bytes
+        self.digest = hashlib.blake2b(digest_size=16)
+        self.size = 0
+        self.lines = 0
+        self.kept = []
+
+    def _seen(self, data):
+        if data:
+            self.digest.update(data)
+            self.size += len(data)
+            self.lines += data.count(b'\n')
+            if self.size <= self.keep_bytes:
+                self.kept.append(data)
+            elif self.kept:
+                self.kept = []
+        return data
+
+    def read(self, *args):
+        return self._seen(self.stream.read(*args))
+
+    # werkzeug の LimitedStream は readinto で読み込む
+    def readinto(self, buffer):
+        size = self.stream.readinto(buffer)
+        if size:
+            self._seen(bytes(memoryview(buffer)[:size]))
+        return size
+
+    def readline(self, *args):
+        return self._seen(self.stream.readline(*args))
+
+    def readlines(self, *args):
+        return [self._seen(line) for line in self.stream.readlines(*args)]
+
+    def __iter__(self):
+        return iter(self.readline, b'')
+
+    def body(self):
+        return b''.join(self.kept) if self.size <= self.keep_bytes else None
+
+
+class TrafficCapture:
+    def __init__(self, path, bodies, body_max_bytes, queue_max):
+        self.path = path
+        self.keep_bytes = body_max_bytes if bodies == 'full' else 0
+        self.queue_max = queue_max
+        self.started_at = time.time()
+        self.dropped = 0
+        self._queue = None
+        self._thread = None
+
+    # 書き込みスレッドを起動する (fork 後のワーカープロセスごとに呼ぶ)
+    def start(self):
+        self._queue = queue.Queue(self.queue_max)
+        fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        self._thread = threading.Thread(target=self._run, args=(self._queue, fd), name='traffic-capture', daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join(5)
+
+    def record(self, entry):
+        try:
+            self._queue.put_nowait(entry)
+        except (queue.Full, AttributeError):
+            self.dropped += 1
+
+    def _run(self, entries, fd):
+        while True:
+            batch = [entries.get()]
+            # キューに溜まっている分はまとめて1回で書き込む
+            while len(batch) < 1000:
+                try:
+                    batch.append(entries.get_nowait())
+                except queue.Empty:
+                    break
+            stop = None in batch
+            lines = [self.encode(entry) for entry in batch if entry is not None]
+            if lines:
+                os.write(fd, b''.join(lines))
+            if stop:
+                os.close(fd)
+                return
+
+    @staticmethod
+    def encode(entry):
+        environ, body = entry.pop('environ'), entry.pop('input')
+        headers = {}
+        for key, value in environ.items():
+            if key.startswith('HTTP_'):
+                headers[key[5:].replace('_', '-').title()] = value
+            elif key in ('CONTENT_TYPE', 'CONTENT_LENGTH') and value:
+                headers[key.replace('_', '-').title()] = value
+        entry['headers'] = headers
+        if body.size:
+            entry['bodySize'] = body.size
+            entry['bodyLines'] = body.lines
+            entry['bodyDigest'] = body.digest.hexdigest()
+            data = body.body()
+            if data is not None:
+                try:
+                    entry['body'] = data.decode('utf-8')
+                except UnicodeDecodeError:
+                    entry['bodyBase64'] = base64.b64encode(data).decode('ascii')
+        return json.dumps(entry, ensure_ascii=False, separators=(',', ':')).encode('utf-8') + b'\n'
+
+
+# リクエストボディを CaptureInput で包み、レスポンスのステータスが決まった時点で1件記録する WSGI ミドルウェア
+# (レスポンスボディは包まないため、ストリーム返却や wsgi.file_wrapper による送信には影響しない)
+class CaptureMiddleware:
+    def __init__(self, wsgi_app, capture):
+        self.wsgi_app = wsgi_app
+        self.capture = capture
+
+    def __call__(self, environ, start_response):
+        arrived_at = time.time()
+        body = environ['wsgi.input'] = CaptureInput(environ['wsgi.input'], self.capture.keep_bytes)
+
+        def capture_start_response(status, headers, exc_info=None):
+            path = environ.get('PATH_INFO', '')
+            if environ.get('QUERY_STRING'):
+                path += '?' + environ['QUERY_STRING']
+            # HTTP_* などの値のみ複製し、ヘッダー名の整形は書き込みスレッドで行う
+            entry = {
+                "ts": round(arrived_at - self.capture.started_at, 6),
+                "dur": round(time.time() - arrived_at, 6),
+                "method": environ.get('REQUEST_METHOD'),
+                "path": path,
+                "route": environ.get('stub.capture.route'),
+                "status": int(status[:3]),
+                "environ": {key: value for key, value in environ.items()
+                            if key.startswith('HTTP_') or key in ('CONTENT_TYPE', 'CONTENT_LENGTH')},
+                "input": body,
+            }
+            if environ.get('stub.capture.job_id'):
+                entry["jobId"] = environ['stub.capture.job_id']
+            self.capture.record(entry)
+            return start_response(status, headers, exc_info)
+
+        return self.wsgi_app(environ, capture_start_response)
+
+CAPTURE = None
+
+# キャプチャ有効時のみ登録する after_request: ルート名と、ジョブ作成時の Job ID (再送時の置き換え用) を記録する
+def note_capture_context(response):
+    request.environ['stub.capture.route'] = request.endpoint
+    if request.endpoint in ('create_job', 'create_query_job') and response.status_code == 200:
+        request.environ['stub.capture.job_id'] = response.get_json().get('id')
+    return response
+
+def install_traffic_capture():
+    global CAPTURE
+    if CAPTURE_FILE and CAPTURE is None:
+        CAPTURE = TrafficCapture(CAPTURE_FILE, CAPTURE_BODIES, CAPTURE_BODY_MAX_BYTES, CAPTURE_QUEUE_MAX_RECORDS)
+        app.after_request(note_capture_context)
+        app.wsgi_app = CaptureMiddleware(app.wsgi_app, CAPTURE)
+        app.logger.info("Traffic capture enabled: %s (bodies: %s)", CAPTURE_FILE, CAPTURE_BODIES, extra={'job_info': 'BOOT'})
+
+
+# --- 11. アップロードされたCSVの検証 ---
+# UploadComplete 後にバックグラウンドで、アップロードされたCSVをオブジェクトのスキーマ (data/*_success.csv のヘッダー) と
+# VALIDATION_RULES で検証し、成功行 / 失敗行 (sf__Error 付き) をジョブごとの結果CSVファイルに書き出す
+# VALIDATION_BATCH_ROWS 行ずつ読み込んで列に転置し、列ごとに検査する
+# (正規表現の照合や長さの確認は列全体に map で行い、行ごとのループは失敗した行の特定にのみ使う)
+# 検証が終わるまでは、遷移時刻を過ぎても JobComplete にしない
+
+# 結果CSVのファイルの列名 (sf__ で始まる列を含む)
+def fixture_columns(fixture):
+    if fixture["template"]:
+        header = fixture["template"]["header"]
+    else:
+        with open(fixture["path"], 'r', encoding='utf-8', newline='') as f:
+            header = f.readline()
+    return next(csv.reader([header]), [])
+
+# 成功CSVのテンプレートの sf__Id 列のキープレフィックス (生成CSVと同じ値)。テンプレートに ID がなければオブジェクトの既定値
+def success_id_prefix(object_name):
+    fixture = FIXTURES.get('success', object_name)
+    template = fixture["template"] if fixture else None
+    if template and template["id_col"] is not None:
+        id_col = template["id_col"]
+        for row in template["rows"]:
+            if id_col < len(row) and row[id_col]:
+                return row[id_col][:3]
+    return SOBJECT_KEY_PREFIXES.get(object_name, SOBJECT_KEY_PREFIXES["default"])
+
+# 小文字の項目名 -> (項目名, 検証ルール)。ジョブの操作に応じて外部ID / Id 項目を必須にする
+def job_validation_schema(job_data):
+    object_name = job_data["object"]
+    fixture = FIXTURES.get('success', object_name)
+    columns = fixture_columns(fixture) if fixture else []
+    schema = {column.lower(): (column, {}) for column in columns if not column.startswith('sf__')}
+    for field, rule in VALIDATION_RULES.get(object_name, {}).items():
+        schema[field.lower()] = (field, rule)
+
+    operation = job_data.get('operation', 'upsert')
+    external_id_field = job_data.get('externalIdFieldName') or ''
+    if operation == 'upsert' and external_id_field.lower() in schema:
+        field, rule = schema[external_id_field.lower()]
+        schema[field.lower()] = (field, dict(rule, required=True, missingError=f"MISSING_ARGUMENT:{field} not specified:--"))
+    elif operation in ('update', 'delete', 'hardDelete'):
+        schema['id'] = ('Id', {"type": "id", "required": True, "missingError": f"MISSING_ARGUMENT:Id not specified in an {operation} call:--"})
+    return schema
+
+# 列の値のリストを検査して (行位置, sf__Error) を返す関数を作る。すべての値が正しければ空を返す
+# joinable: 改行に一致しない形式 (type の形式) の場合は、列を改行で連結して1回の照合で全体を確認する
+def pattern_column_check(pattern, error, joinable=False):
+    regex = re.compile(f"(?:{pattern})?")
+    column_regex = re.compile(f"(?:{pattern})?(?:\\n(?:{pattern})?)*") if joinable else None
+    def check(values):
+        if column_regex is not None:
+            joined = '\n'.join(values)
+            # 改行を含む値がなければ、連結した文字列の照合結果が列全体の結果になる
+            if joined.count('\n') == len(values) - 1 and column_regex.fullmatch(joined):
+                return ()
+        matches = list(map(regex.fullmatch, values))
+        if None not in matches:
+            return ()
+        return [(i, error.format(value=values[i])) for i, match in enumerate(matches) if match is None]
+    return check
+
+def build_column_checks(field, rule):
+    checks = []
+    if rule.get('required'):
+        missing_error = rule.get('missingError') or f"REQUIRED_FIELD_MISSING:Required fields are missing: [{field}]:{field} --"
+        def check_required(values):
+            if '' not in values:
+                return ()
+            return [(i, missing_error) for i, value in enumerate(values) if not value]
+        checks.append(check_required)
+
+    field_type = rule.get('type', 'string')
+    if field_type != 'string' and field_type not in VALIDATION_TYPE_PATTERNS:
+        raise ValueError(f"Unknown validation type for {field}: {field_type}")
+    # 空文字は型・形式の検査の対象外 (必須かどうかは required で検査する)
+    if field_type in VALIDATION_TYPE_PATTERNS:
+        checks.append(pattern_column_check(
+            VALIDATION_TYPE_PATTERNS[field_type],
+            f"INVALID_TYPE_ON_FIELD_IN_RECORD:{field}: value not of required type: {{value}}:{field} --", joinable=True))
+    if rule.get('pattern'):
+        checks.append(pattern_column_check(
+            rule['pattern'],
+            f"FIELD_CUSTOM_VALIDATION_EXCEPTION:{field}: value does not match the required format: {{value}}:{field} --"))
+
+    if 'maxLength' in rule:
+        max_length = rule['maxLength']
+        def check_length(values):
+            if max(map(len, values), default=0) <= max_length:
+                return ()
+            return [(i, f"STRING_TOO_LONG:{field}: data value too large: {value} (max length={max_length}):{field} --")
+                    for i, value in enumerate(values) if len(value) > max_length]
+        checks.append(check_length)
+
+    if 'values' in rule:
+        allowed = set(rule['values']) | {''}
+        def check_values(values):
+            if allowed.issuperset(values):
+                return ()
+            return [(i, f"INVALID_OR_NULL_FOR_RESTRICTED_PICKLIST:{field}: bad value for restricted picklist field: {value}:{field} --")
+                    for i, value in enumerate(values) if value not in allowed]
+        checks.append(check_values)
+    return checks
+
+# アップロードのヘッダーに対する検証。(全行に適用するエラー または None, [(列位置, 検査関数)]) を返す
+def compile_upload_validation(job_data, header):
+    schema = job_validation_schema(job_data)
+    if not schema:
+        return None, []
+    columns = [column.lower() for column in header]
+    unknown = [column for column in header if column.lower() not in schema]
+    if unknown:
+        return f"INVALID_FIELD:Field name not found : {unknown[0]}:--", []
+    for key, (field, rule) in schema.items():
+        if rule.get('required') and key not in columns:
+            return rule.get('missingError') or f"REQUIRED_FIELD_MISSING:Required fields are missing: [{field}]:{field} --", []
+    checks = []
+    for i, column in enumerate(columns):
+        field, rule = schema[column]
+        checks.extend((i, check) for check in build_column_checks(field, rule))
+    return None, checks
+
+# 1バッチ分の行を検証し、行位置 -> sf__Error (最初に見つかったエラー) を返す
+# 列数が合わない行は失敗とし、列への転置のために空文字で埋める / 切り詰める
+def validate_row_batch(rows, width, header_error, checks):
+    if header_error is not None:
+        return dict.fromkeys(range(len(rows)), header_error)
+    errors = {}
+    if set(map(len, rows)) != {width}:
+        for i, row in enumerate(rows):
+            if len(row) != width:
+                errors[i] = f"INVALID_FIELD:Record has {len(row)} values but the header has {width} columns:--"
+                rows[i] = (row + [''] * width)[:width]
+    columns = list(zip(*rows)) if width else []
+    for column, check in checks:
+        for i, error in check(columns[column]):
+            errors.setdefault(i, error)
+    return errors
+
+# 検証して結果CSVファイルを書き出し、{"success": 件数, "fail": 件数} を返す。アップロードが保存されていなければ None
+def validate_upload(job_id, job_data):
+    source = UPLOAD_SPOOL.open(job_id)
+    if source is None:
+        return None
+    operation = job_data.get('operation', 'upsert')
+    created = 'false' if operation in ('update', 'delete', 'hardDelete') else 'true'
+    # sf__Id は生成CSVと同様に Job ID と行番号から決める
+    id_head = success_id_prefix(job_data["object"]) + 'GC'
+    id_head_suffix = to_sf_id18(id_head + '0' * 10)[15]
+    seed = zlib.crc32(job_id.encode('utf-8')) * 10 ** 8
+    counts = {"success": 0, "fail": 0}
+
+    with io.TextIOWrapper(source, encoding='utf-8-sig', errors='replace', newline='') as text, \
+            UPLOAD_SPOOL.result_writer(job_id, 'success') as success_file, \
+            UPLOAD_SPOOL.result_writer(job_id, 'fail') as fail_file:
+        reader = csv.reader(text)
+        header = next(reader, [])
+        header_error, checks = compile_upload_validation(job_data, header)
+        success_writer = csv.writer(success_file, quoting=csv.QUOTE_ALL, lineterminator='\n')
+        fail_writer = csv.writer(fail_file, quoting=csv.QUOTE_ALL, lineterminator='\n')
+        success_writer.writerow(['sf__Id', 'sf__Created', *header])
+        fail_writer.writerow(['sf__Id', 'sf__Error', *header])
+
+        row_number = 0
+        while True:
+            rows = list(itertools.islice(reader, VALIDATION_BATCH_ROWS))
+            if not rows:
+                break
+            # 空行は無視する
+            if [] in rows:
+                rows = [row for row in rows if row]
+                if not rows:
+                    continue
+            errors = validate_row_batch(rows, len(header), header_error, checks)
+            ids = [id_head + body + id_head_suffix + suffix for body, suffix in iter_sf_id_bodies(seed + row_number, len(rows))]
+            row_number += len(rows)
+            if not errors:
+                success_writer.writerows(zip(ids, itertools.repeat(created), *zip(*rows)))
+                counts["success"] += len(rows)
+                continue
+            if len(errors) < len(rows):
+                passed = [i not in errors for i in range(len(rows))]
+                success_writer.writerows(zip(itertools.compress(ids, passed), itertools.repeat(created),
+                                             *(itertools.compress(column, passed) for column in zip(*rows))))
+            fail_writer.writerows(['', errors[i], *rows[i]] for i in sorted(errors))
+            counts["success"] += len(rows) - len(errors)
+            counts["fail"] += len(errors)
+    return counts
+
+# 検証の結果をジョブに記録し、遷移時刻を過ぎていれば JobComplete にする
+def run_upload_validation(job_id):
+    job_data = JOB_STORE.get(job_id)
+    if job_data is None:
+        return
+    log_extra = {'job_info': f"{job_data['interface_id']}:{job_data['interface_name']}"}
+    start = time.perf_counter()
+    try:
+        counts = validate_upload(job_id, job_data)
+    except Exception as e:
+        # 検証できない場合は従来どおり全件成功として扱う
+        app.logger.error("Upload validation failed for Job ID: %s: %s", job_id, e, extra=log_extra)
+        counts = None
+
+    def finish(job):
+        job['validation'] = counts
+        state = resolve_job_state(job)
+        if JOB_STATE_ORDER[state] > JOB_STATE_ORDER.get(job['state'], 0):
+            job['state'] = state
+    if JOB_STORE.update(job_id, finish) is not None and counts is not None:
+        app.logger.info("Validated upload for Job ID: %s | Success: %s | Failed: %s | %.3fs",
+                        job_id, counts["success"], counts["fail"], time.perf_counter() - start, extra=log_extra)
+
+VALIDATION_EXECUTOR = None
+
+# 検証用のスレッドプール (スレッドは fork 後に引き継がれないため、ワーカープロセスごとに作成する)
+def start_upload_validator():
+    global VALIDATION_EXECUTOR
+    if VALIDATE_UPLOADS and VALIDATION_EXECUTOR is None:
+        VALIDATION_EXECUTOR = ThreadPoolExecutor(VALIDATION_WORKERS, thread_name_prefix='upload-validator')
+
+def submit_upload_validation(job_id):
+    if VALIDATION_EXECUTOR is None:
+        run_upload_validation(job_id)
+    else:
+        VALIDATION_EXECUTOR.submit(run_upload_validation, job_id)
+
+
+
+# --- 12. リクエスト処理のプロファイリング ---
+# /stub/profile で開始すると、期間中だけ app.view_functions の各ルートを計測用の関数に差し替え、
+# ルートごとに N件に1件のリクエストを cProfile で計測して pstats に集計する。終了時 (期間の経過 / 停止要求) に元の関数に戻し、
+# ルートごとの .pstats ファイルを PROFILE_DIR に書き出す。停止中はルートを差し替えないため、処理の追加はない
+# ハンドラ内の check_auth_and_log、JSONの解析 (get_json)、ログ出力 (Logger._log) は、ルートの処理時間に占める割合を集計する
+PROFILE_COMPONENTS = {
+    # 名前 -> (ファイル名に含まれる文字列, 関数名)
+    "check_auth_and_log": ('stub_api', 'check_auth_and_log'),
+    "json": ('', 'get_json'),
+    "logging": ('logging', '_log'),
+}
+# プロファイリングしないルート (制御用のAPI自身)
+PROFILE_EXCLUDED_ENDPOINTS = ('static', 'control_profiling')
+
+class ProfileSession:
+    def __init__(self, sample_rate, seconds, endpoints):
+        self.started_at = time.time()
+        self.id = f"{time.strftime('%Y%m%d-%H%M%S', time.localtime(self.started_at))}-{os.getpid()}"
+        self.sample_rate = sample_rate
+        self.seconds = seconds
+        self.endpoints = endpoints
+        self.directory = os.path.join(PROFILE_DIR, self.id)
+        self.stopped_at = None
+        self.files = {}
+        self.stats = {}          # ルート -> pstats.Stats
+        self.sampled = Counter()
+        self.originals = {}      # ルート -> 差し替え前の関数
+        self.timer = None
+        self._lock = threading.Lock()
+
+    def wrap(self, endpoint, view):
+        counter = itertools.count()
+        rate = self.sample_rate
+
+        @functools.wraps(view)
+        def profiled_view(*args, **kwargs):
+            if next(counter) % rate:
+                return view(*args, **kwargs)
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError:
+                # 他のプロファイラが有効な場合 (Python 3.12 以降は同時に1つのみ) は計測しない
+                return view(*args, **kwargs)
+            try:
+                return view(*args, **kwargs)
+            finally:
+                profiler.disable()
+                self.add(endpoint, profiler)
+        return profiled_view
+
+    # 集計はリクエスト処理スレッドで行い、ロックは結合時のみ取る
+    def add(self, endpoint, profiler):
+        stats = pstats.Stats(profiler)
+        with self._lock:
+            if endpoint in self.stats:
+                self.stats[endpoint].add(stats)
+            else:
+                self.stats[endpoint] = stats
+            self.sampled[endpoint] += 1
+
+    def install(self):
+        for endpoint in self.endpoints:
+            self.originals[endpoint] = view = app.view_functions[endpoint]
+            app.view_functions[endpoint] = self.wrap(endpoint, view)
+
+    def uninstall(self):
+        for endpoint, view in self.originals.items():
+            app.view_functions[endpoint] = view
+
+    def dump(self):
+        os.makedirs(self.directory, exist_ok=True)
+        with self._lock:
+            for endpoint, stats in self.stats.items():
+                path = os.path.join(self.directory, f"{endpoint}.pstats")
+                stats.dump_stats(path)
+                self.files[endpoint] = path
+
+    def summary(self):
+        now = self.stopped_at or time.time()
+        routes = {}
+        with self._lock:
+            for endpoint, stats in sorted(self.stats.items()):
+                shares = dict.fromkeys(PROFILE_COMPONENTS, 0.0)
+                for (filename, _, function), (_, _, _, cumulative, _) in stats.stats.items():
+                    for name, (file_part, function_name) in PROFILE_COMPONENTS.items():
+                        if function == function_name and file_part in filename:
+                            shares[name] += cumulative
+                routes[endpoint] = {
+                    "sampled": self.sampled[endpoint],
+                    "totalSeconds": round(stats.total_tt, 6),
+                    "meanMilliseconds": round(stats.total_tt / self.sampled[endpoint] * 1000, 3),
+                    "shares": {name: round(seconds / stats.total_tt, 4) if stats.total_tt else 0.0 for name, seconds in shares.items()},
+                    "file": self.files.get(endpoint),
+                }
+        return {
+            "id": self.id,
+            "state": "Stopped" if self.stopped_at else "Running",
+            "pid": os.getpid(),
+            "sampleRate": self.sample_rate,
+            "seconds": self.seconds,
+            "elapsedSeconds": round(now - self.started_at, 3),
+            "directory": self.directory,
+            "routes": routes,
+        }
+
+PROFILE_LOCK = threading.Lock()
+PROFILE_SESSION = None       # 実行中のセッション
+PROFILE_LAST_SESSION = None  # 直近に終了したセッション
+
+def start_profiling(sample_rate, seconds, endpoints):
+    global PROFILE_SESSION
+    with PROFILE_LOCK:
+        if PROFILE_SESSION is not None:
+            return None
+        session = PROFILE_SESSION = ProfileSession(sample_rate, seconds, endpoints)
+        session.install()
+        session.timer = threading.Timer(seconds, stop_profiling, args=(session,))
+        session.timer.daemon = True
+        session.timer.start()
+    app.logger.info("Profiling started: %s | 1 in %s requests for %ss | Routes: %s", session.id, sample_rate, seconds,
+                    ','.join(endpoints), extra={'job_info': 'PROFILE'})
+    return session
+
+# session を指定した場合は、そのセッションが実行中の場合のみ停止する (期間の経過による停止)
+def stop_profiling(session=None):
+    global PROFILE_SESSION, PROFILE_LAST_SESSION
+    with PROFILE_LOCK:
+        if PROFILE_SESSION is None or (session is not None and PROFILE_SESSION is not session):
+            return None
+        session = PROFILE_SESSION
+        session.uninstall()
+        session.timer.cancel()
+        PROFILE_SESSION = None
+    # 停止時に処理中だったリクエストの計測結果は、ファイルには含まれない (GET の集計には含まれる)
+    session.stopped_at = time.time()
+    session.dump()
+    PROFILE_LAST_SESSION = session
+    app.logger.info("Profiling stopped: %s | Sampled: %s | Written to %s", session.id, sum(session.sampled.values()),
+                    session.directory, extra={'job_info': 'PROFILE'})
+    return session
+
+
+# --- ヘルパー関数: シナリオ定義 (SCENARIOS_FILE) ---
+# Composite のサブ要求の分岐 (メソッドとボディの項目)、X-API-Key ごとの結果、OAuth の client_id ごとの結果を起動時に読み込み、
+# ハッシュ表 (dict) の索引に変換する。リクエストごとの判定は索引の参照のみで、シナリオの数によらない
+# 応答ボディは STATIC_RESPONSE_BODIES に追加し、他の固定レスポンスと同様に起動時にエンコードする
+# "*" は、定義されていない X-API-Key / client_id に適用する結果
+SCENARIO_WILDCARD = '*'
+
+COMPOSITE_APIS = {}           # サブ要求のAPI -> {"label": ログ用名称, "referenceId": 未指定時の既定値}
+COMPOSITE_DISPATCH = {}       # (メソッド, ボディの判定項目の frozenset) -> API。bodyFields のないシナリオは (メソッド, None)
+COMPOSITE_SHAPE_FIELDS = {}   # メソッド -> そのメソッドのシナリオが判定に使う項目の frozenset
+COMPOSITE_KEY_OUTCOMES = {}   # X-API-Key -> 結果 (シナリオの応答の名前)
+OAUTH_CLIENT_OUTCOMES = {}    # client_id -> 結果 ('success' はアクセストークンを発行)
+OAUTH_RESPONSE_STATUS = {}    # OAuth の結果 -> HTTPステータス
+
+def load_scenarios(path):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+# 定義の誤り (分岐の重複・応答の不足) は起動時に ValueError にする
+def compile_scenarios(scenarios):
+    composite = scenarios["composite"]
+    COMPOSITE_KEY_OUTCOMES.update(composite["apiKeys"])
+    if SCENARIO_WILDCARD not in COMPOSITE_KEY_OUTCOMES:
+        raise ValueError(f"composite.apiKeys must define '{SCENARIO_WILDCARD}'")
+    outcomes = set(COMPOSITE_KEY_OUTCOMES.values())
+    for api, scenario in composite["apis"].items():
+        method = scenario["method"].upper()
+        fields = frozenset(scenario["bodyFields"]) if scenario.get("bodyFields") else None
+        if (method, fields) in COMPOSITE_DISPATCH:
+            raise ValueError(f"Composite scenarios {COMPOSITE_DISPATCH[(method, fields)]} and {api} match the same {method} requests")
+        missing = outcomes - scenario["responses"].keys()
+        if missing:
+            raise ValueError(f"Composite scenario {api} has no response for: {', '.join(sorted(missing))}")
+        COMPOSITE_DISPATCH[(method, fields)] = api
+        COMPOSITE_SHAPE_FIELDS[method] = COMPOSITE_SHAPE_FIELDS.get(method, frozenset()) | (fields or frozenset())
+        COMPOSITE_APIS[api] = {"label": scenario.get("label", api), "referenceId": scenario.get("referenceId", api)}
+        for outcome, entry in scenario["responses"].items():
+            STATIC_RESPONSE_BODIES[('composite', api, outcome)] = dict(entry, referenceId=RESPONSE_PLACEHOLDER)
+
+    oauth = scenarios["oauth"]
+    OAUTH_CLIENT_OUTCOMES.update(oauth["clients"])
+    if SCENARIO_WILDCARD not in OAUTH_CLIENT_OUTCOMES:
+        raise ValueError(f"oauth.clients must define '{SCENARIO_WILDCARD}'")
+    for outcome, response in oauth.get("responses", {}).items():
+        STATIC_RESPONSE_BODIES[('oauth', 'token', outcome)] = response["body"]
+        OAUTH_RESPONSE_STATUS[outcome] = response.get("status", 400)
+    missing = set(OAUTH_CLIENT_OUTCOMES.values()) - OAUTH_RESPONSE_STATUS.keys() - {'success'}
+    if missing:
+        raise ValueError(f"OAuth scenarios have no response for: {', '.join(sorted(missing))}")
+
+compile_scenarios(load_scenarios(SCENARIOS_FILE))
+
+def composite_key_outcome(api_key):
+    return COMPOSITE_KEY_OUTCOMES.get(api_key) or COMPOSITE_KEY_OUTCOMES[SCENARIO_WILDCARD]
+
+def oauth_client_outcome(client_id):
+    return OAUTH_CLIENT_OUTCOMES.get(client_id) or OAUTH_CLIENT_OUTCOMES[SCENARIO_WILDCARD]
+
+
+# --- ヘルパー関数: Composite API のサブ要求処理 ---
+# メソッドとボディからサブ要求のAPIを判定する (該当するシナリオがなければ None)
+# ボディに含まれる判定項目の組がちょうど一致するシナリオ、なければ bodyFields のないシナリオを選ぶ
+def select_composite_api(method, body):
+    fields = COMPOSITE_SHAPE_FIELDS.get(method)
+    if fields is None:
+        return None
+    # ボディのキーを走査して判定項目を取り出す (判定項目の総数には依存しない)
+    shape = fields.intersection(body) if fields and isinstance(body, dict) else None
+    return COMPOSITE_DISPATCH.get((method, shape or None)) or COMPOSITE_DISPATCH.get((method, None))
+
+class CompositeReferenceError(Exception):
+    pass
+
+# @{referenceId.path} を、先行するサブ要求の応答ボディから解決する
+def resolve_composite_reference(match, results):
+    reference_id, path = match.group(1), match.group(2)
+    if reference_id not in results:
+        raise CompositeReferenceError(match.group(0)[2:-1], reference_id)
+    value = results[reference_id]
+    for key, index in COMPOSITE_REFERENCE_PATH_PATTERN.findall(path):
+        try:
+            value = value[int(index)] if index else value[key]
+        except (KeyError, IndexError, TypeError):
+            raise CompositeReferenceError(match.group(0)[2:-1], reference_id)
+    return value
+
+# url / body に含まれる参照をすべて解決した値を返す (参照を含まない値はそのまま返す)
+def resolve_composite_references(value, results):
+    if isinstance(value, str):
+        if '@{' not in value:
+            return value
+        # 値全体が参照の場合は参照先の型 (数値・真偽値など) を保つ
+        match = COMPOSITE_REFERENCE_PATTERN.fullmatch(value)
+        if match:
+            return resolve_composite_reference(match, results)
+        return COMPOSITE_REFERENCE_PATTERN.sub(lambda m: str(resolve_composite_reference(m, results)), value)
+    if isinstance(value, dict):
+        return {key: resolve_composite_references(item, results) for key, item in value.items()}
+    if isinstance(value, list):
+        return [resolve_composite_references(item, results) for item in value]
+    return value
+
+def composite_reference_error_entry(error, reference_id):
+    expression, target = error.args
+    return encode_json({
+        "body": [
+            {
+                "message": f"Invalid reference specified. No value for {expression} found in {target}. "
+                           "Provided referenceId ids must start with a letter and be alphanumeric "
+                           "and the referenced subrequest must have completed successfully.",
+                "errorCode": "PROCESSING_HALTED"
+            }
+        ],
+        "httpHeaders": {},
+        "httpStatusCode": 400,
+        "referenceId": reference_id
+    })
+
+# サブ要求を順に処理し、compositeResponse の要素 (bytes) のリストと失敗の有無を返す
+# all_or_none の場合は最初の失敗で処理を止め、他のサブ要求はすべてロールバック扱いにする
+def process_composite_subrequests(sub_requests, outcome, all_or_none):
+    entries = []
+    results = {}      # referenceId -> 成功したサブ要求の応答ボディ
+    succeeded = []    # 成功したサブ要求の (entries 上の位置, referenceId)
+    failed = False
+
+    for sub_request, api, reference_id in sub_requests:
+        if failed and all_or_none:
+            entries.append(composite_entry(('composite', 'rollback', 'error'), reference_id))
+            continue
+        try:
+            resolve_composite_references(sub_request.get('url', ''), results)
+            resolve_composite_references(sub_request.get('body'), results)
+        except CompositeReferenceError as e:
+            entries.append(composite_reference_error_entry(e, reference_id))
+            failed = True
+            continue
+
+        key = ('composite', api, outcome)
+        entries.append(composite_entry(key, reference_id))
+        if STATIC_RESPONSE_BODIES[key]["httpStatusCode"] < 400:
+            results[reference_id] = STATIC_RESPONSE_BODIES[key]["body"]
+            succeeded.append((len(entries) - 1, reference_id))
+        else:
+            failed = True
+
+    if failed and all_or_none:
+        for position, reference_id in succeeded:
+            entries[position] = composite_entry(('composite', 'rollback', 'error'), reference_id)
+    return entries, failed
+
+build_response_cache()
 
 
 # --- ヘルパー関数: 共通認証チェックとロギング ---
@@ -116,8 +2368,22 @@ def check_auth_and_log(expected_content_type_prefix=None, skip_auth=False):
         is_auth_valid = auth_header.startswith('Bearer ')
 
         if not is_auth_valid:
-            app.logger.error(f"REQ: {request.method} {request.path} | ERROR: Invalid Authorization Header.", extra=log_extra)
+            app.logger.error("REQ: %s %s | ERROR: Invalid Authorization Header.", request.method, request.path, extra=log_extra)
             return jsonify({"message": "Invalid headers or authentication failed.", "errorCode": "INVALID_SESSION_ID"}), 401
+
+        # アクセストークンの検証 (未発行・署名不一致・期限切れは 401)
+        token = auth_header[len('Bearer '):]
+        if OAUTH_VALIDATE_TOKENS:
+            client_id, result = OAUTH_SESSIONS.validate(token)
+            METRICS.add_session_event('used' if result == 'valid' else result, client_id)
+            if result != 'valid':
+                app.logger.error("REQ: %s %s | ERROR: Session %s. client_id: %s", request.method, request.path, result, client_id or '-', extra=log_extra)
+                return jsonify({"message": "Session expired or invalid", "errorCode": "INVALID_SESSION_ID"}), 401
+
+        # API制限 (1日あたりのリクエスト数 / トークンバケット)
+        limit_check = check_api_limits(token, log_extra)
+        if limit_check:
+            return limit_check
     
     # 2. Content-Type ヘッダーチェック
     content_type = request.headers.get('Content-Type', '')
@@ -126,21 +2392,824 @@ def check_auth_and_log(expected_content_type_prefix=None, skip_auth=False):
         is_ct_valid = content_type.lower().startswith(expected_content_type_prefix)
     
     if not is_ct_valid:
-        app.logger.error(f"REQ: {request.method} {request.path} | ERROR: Invalid Content-Type. Expected: {expected_content_type_prefix}", extra=log_extra)
+        app.logger.error("REQ: %s %s | ERROR: Invalid Content-Type. Expected: %s", request.method, request.path, expected_content_type_prefix, extra=log_extra)
         # Content-Typeが不正な場合は415を返すのが一般的
         return jsonify({"message": f"Content-Type must be {expected_content_type_prefix}.", "errorCode": "UNSUPPORTED_MEDIA_TYPE"}), 415
 
-    return None # 認証成功
+    return None # 認証成功
+
+# --- ヘルパー関数: CSVストリームの集計 ---
+# アップロードされたCSVをチャンク単位で受け取り、全体をメモリに載せずに
+# バイト数・レコード数 (引用符内の改行は数えない)・プレビューを集計する
+class CsvStreamStats:
+    def __init__(self, sink=None, max_bytes=None):
+        self.sink = sink         # 受け取ったCSVをそのまま書き込む先 (write(chunk) を持つオブジェクト)
+        self.max_bytes = max_bytes
+        self.decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        self.total_bytes = 0     # CSVのサイズ (gzip の場合は解凍後)
+        self.wire_bytes = 0      # 受信したサイズ (gzip の場合は圧縮されたサイズ)
+        self.newline_count = 0   # 引用符の外にある改行の数
+        self.in_quotes = False   # チャンク境界をまたいで引用符の内側にいるか
+        self.has_pending_row = False  # 最後の改行以降に未確定の行があるか
+        self.preview = None
+
+    def feed(self, chunk):
+        self.total_bytes += len(chunk)
+        if self.max_bytes is not None and self.total_bytes > self.max_bytes:
+            raise UploadLimitError(self.max_bytes)
+        if self.sink is not None:
+            self.sink.write(chunk)
+        self._count(self.decoder.decode(chunk))
+
+    def finish(self):
+        self._count(self.decoder.decode(b'', final=True))
+        if self.preview is None:
+            self.preview = ''
+
+    def _count(self, text):
+        if not text:
+            return
+
+        # プレビューは最初のチャンクから取得する
+        if self.preview is None:
+            self.preview = '\\n'.join(text.split('\n', CSV_PREVIEW_LINES)[:CSV_PREVIEW_LINES])
+
+        if '"' not in text:
+            if not self.in_quotes:
+                self.newline_count += text.count('\n')
+        else:
+            # '"' で分割すると、引用符の外側と内側のセグメントが交互に並ぶ
+            # (エスケープされた "" は状態が2回反転するだけなので結果に影響しない)
+            for i, segment in enumerate(text.split('"')):
+                if i:
+                    self.in_quotes = not self.in_quotes
+                if not self.in_quotes:
+                    self.newline_count += segment.count('\n')
+
+        self.has_pending_row = self.in_quotes or not text.endswith('\n')
+
+    @property
+    def record_count(self):
+        # ヘッダー行を除いたデータ行数
+        rows = self.newline_count + (1 if self.has_pending_row else 0)
+        return max(rows - 1, 0)
+
+
+class UploadLimitError(Exception):
+    def __init__(self, max_bytes):
+        super().__init__(f"Upload exceeds the maximum size of {max_bytes} bytes")
+        self.max_bytes = max_bytes
+
+
+# Content-Encoding: gzip の場合はチャンクごとに解凍しながら集計する (不正な gzip は zlib.error)
+# max_bytes を超えた時点で残りを読まずに UploadLimitError を送出する
+def consume_csv_stream(stream, content_encoding=None, sink=None, max_bytes=None):
+    stats = CsvStreamStats(sink, max_bytes)
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS) if content_encoding == 'gzip' else None
+    while True:
+        chunk = stream.read(UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            break
+        stats.wire_bytes += len(chunk)
+        if decompressor is None:
+            stats.feed(chunk)
+        else:
+            decompressor = feed_gzip_chunk(decompressor, chunk, stats)
+    if decompressor is not None and not decompressor.eof:
+        raise zlib.error("Incomplete gzip stream")
+    stats.finish()
+    return stats
+
+# 解凍後のデータは UPLOAD_CHUNK_SIZE ずつ取り出し、圧縮率の高いデータでもメモリに展開しきらないようにする
+# 複数メンバーの gzip (gzip ファイルを連結したもの) は、メンバーごとに解凍器を作り直して続ける
+def feed_gzip_chunk(decompressor, data, stats):
+    while data:
+        stats.feed(decompressor.decompress(data, UPLOAD_CHUNK_SIZE))
+        if decompressor.eof and decompressor.unused_data:
+            data = decompressor.unused_data
+            decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        else:
+            data = decompressor.unconsumed_tail
+    return decompressor
+
+# --- ヘルパー関数: アップロードされたCSVの保存 ---
+# ジョブごとに、アップロードされたCSV (gzip の場合は解凍後) を保存する
+# memory_bytes 以下はメモリに保持し、超えた時点で一時ファイルに書き出す
+# ファイルは書き込み完了後に <job_id>.csv へ置き換えるため、書き込み途中の内容は読み出されない
+class UploadSpool:
+    def __init__(self, spool_dir, memory_bytes, memory_total_bytes):
+        self.spool_dir = spool_dir
+        self.memory_bytes = memory_bytes
+        self.memory_total_bytes = memory_total_bytes
+        self._lock = threading.Lock()
+        self._memory = {}  # job_id -> CSV (bytes)
+        self.memory_size = 0
+
+    def path_for(self, job_id):
+        return os.path.join(self.spool_dir, f"{job_id}.csv")
+
+    # 検証結果の CSV (result_type: 'success' / 'fail')
+    def result_path(self, job_id, result_type):
+        return os.path.join(self.spool_dir, f"{job_id}.{result_type}.csv")
+
+    # 結果CSVを書き込むテキストファイル。正常に閉じた場合のみ result_path に置き換える
+    @contextlib.contextmanager
+    def result_writer(self, job_id, result_type):
+        os.makedirs(self.spool_dir, exist_ok=True)
+        path = self.result_path(job_id, result_type)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.part"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8', newline='') as f:
+                yield f
+        except BaseException:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(tmp_path)
+            raise
+        os.replace(tmp_path, path)
+
+    def writer(self, job_id):
+        # メモリに保持した内容はこのプロセスからしか読めないため、プロセス内のジョブストアの場合のみ使う
+        memory_bytes = self.memory_bytes if isinstance(JOB_STORE, MemoryJobStore) else -1
+        return UploadSpoolWriter(self, job_id, memory_bytes)
+
+    def _store(self, job_id, data=None, tmp_path=None):
+        if tmp_path is not None:
+            os.replace(tmp_path, self.path_for(job_id))
+        spill = None
+        with self._lock:
+            old = self._memory.pop(job_id, None)
+            self.memory_size -= len(old) if old is not None else 0
+            if data is not None:
+                # メモリの合計が上限を超える場合はファイルに書く
+                if self.memory_size + len(data) <= self.memory_total_bytes:
+                    self._memory[job_id] = data
+                    self.memory_size += len(data)
+                else:
+                    spill = data
+        if spill is not None:
+            os.makedirs(self.spool_dir, exist_ok=True)
+            tmp_path = f"{self.path_for(job_id)}.{os.getpid()}.{threading.get_ident()}.part"
+            with open(tmp_path, 'wb') as f:
+                f.write(spill)
+            os.replace(tmp_path, self.path_for(job_id))
+        elif data is not None:
+            # 以前のアップロードがファイルに保存されていれば削除する
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(self.path_for(job_id))
+
+    # 保存したCSVを読み出すファイルオブジェクト。保存されていない場合は None
+    def open(self, job_id):
+        with self._lock:
+            data = self._memory.get(job_id)
+        if data is not None:
+            return io.BytesIO(data)
+        try:
+            return open(self.path_for(job_id), 'rb')
+        except FileNotFoundError:
+            return None
+
+    def discard(self, job_id):
+        with self._lock:
+            old = self._memory.pop(job_id, None)
+            self.memory_size -= len(old) if old is not None else 0
+        for path in (self.path_for(job_id), self.result_path(job_id, 'success'), self.result_path(job_id, 'fail')):
+            RESULT_ROW_INDEXES.pop(path, None)
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(path)
+
+    # 起動時に、ジョブストアにないジョブのファイル (アップロードと検証結果) と、書き込み途中で残った古い一時ファイルを削除する
+    def sweep(self, job_exists, part_max_age=3600):
+        removed = 0
+        if not os.path.isdir(self.spool_dir):
+            return removed
+        now = time.time()
+        for entry in os.scandir(self.spool_dir):
+            stale = False
+            if entry.name.endswith('.csv'):
+                stale = not job_exists(entry.name.split('.', 1)[0])
+            else:
+                with contextlib.suppress(FileNotFoundError):
+                    stale = entry.name.endswith('.part') and entry.stat().st_mtime < now - part_max_age
+            if stale:
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(entry.path)
+                    removed += 1
+        return removed
+
+
+class UploadSpoolWriter:
+    def __init__(self, spool, job_id, memory_bytes):
+        self.spool = spool
+        self.job_id = job_id
+        self.memory_bytes = memory_bytes
+        self._chunks = []
+        self._size = 0
+        self._file = None
+        self._tmp_path = None
+
+    def write(self, chunk):
+        if self._file is not None:
+            self._file.write(chunk)
+            return
+        self._chunks.append(chunk)
+        self._size += len(chunk)
+        if self._size > self.memory_bytes:
+            self._open_file()
+
+    def _open_file(self):
+        os.makedirs(self.spool.spool_dir, exist_ok=True)
+        self._tmp_path = f"{self.spool.path_for(self.job_id)}.{os.getpid()}.{threading.get_ident()}.part"
+        self._file = open(self._tmp_path, 'wb')
+        self._file.writelines(self._chunks)
+        self._chunks = None
+
+    def commit(self):
+        if self._file is None and self.memory_bytes >= 0:
+            self.spool._store(self.job_id, data=b''.join(self._chunks))
+            return
+        if self._file is None:
+            self._open_file()
+        self._file.close()
+        self.spool._store(self.job_id, tmp_path=self._tmp_path)
+
+    def abort(self):
+        if self._file is not None:
+            self._file.close()
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(self._tmp_path)
+        self._chunks = None
+
+UPLOAD_SPOOL = UploadSpool(UPLOAD_SPOOL_DIR, UPLOAD_SPOOL_MEMORY_BYTES, UPLOAD_SPOOL_MEMORY_TOTAL_BYTES)
+
+# ジョブの削除時に保存したCSVを削除し、前回の起動時から残っているファイルを片付ける
+def install_upload_spool():
+    JOB_STORE.add_removal_listener(UPLOAD_SPOOL.discard)
+    removed = UPLOAD_SPOOL.sweep(lambda job_id: job_id in JOB_STORE)
+    if removed:
+        app.logger.info("Removed %s stale upload files from %s", removed, UPLOAD_SPOOL_DIR, extra={'job_info': 'BOOT'})
+
+# --- ヘルパー関数: Salesforce ID ---
+def to_base62(value, width):
+    chars = []
+    for _ in range(width):
+        value, rem = divmod(value, 62)
+        chars.append(BASE62_ALPHABET[rem])
+    return ''.join(reversed(chars))
+
+# 15桁IDに大文字小文字判別用の3桁サフィックスを付与して18桁IDにする
+def to_sf_id18(id15):
+    suffix = []
+    for start in (0, 5, 10):
+        bits = 0
+        for pos, ch in enumerate(id15[start:start + 5]):
+            if 'A' <= ch <= 'Z':
+                bits |= 1 << pos
+        suffix.append(SF_ID_SUFFIX_ALPHABET[bits])
+    return id15 + ''.join(suffix)
+
+# --- ヘルパー関数: 結果CSVの生成 ---
+# 結果タイプごとの出力件数を返す。件数が決まらない場合は None (静的CSVをそのまま返す)
+def get_result_row_counts(job_data):
+    if job_data.get('result_rows_override'):
+        return job_data['result_rows_override']
+    # アップロードの検証結果 (検証中は結果なし)
+    validation = job_data.get('validation')
+    if validation == 'pending':
+        return {"success": 0, "fail": 0, "unproc": 0}
+    if validation is not None:
+        return {"success": validation["success"], "fail": validation["fail"], "unproc": 0}
+    if 'upload_rows' in job_data:
+        return {"success": job_data['upload_rows'], "fail": 0, "unproc": 0}
+    return None
+
+# ジョブ作成時の stubResultRows (整数または {success, fail, unproc}) を正規化する
+def parse_result_rows_override(value):
+    if value is None:
+        return None
+    if isinstance(value, dict):
+        counts = {key: value.get(key, 0) for key in ("success", "fail", "unproc")}
+    else:
+        counts = {"success": value, "fail": 0, "unproc": 0}
+    if not all(isinstance(v, int) and not isinstance(v, bool) and v >= 0 for v in counts.values()):
+        raise ValueError(f"stubResultRows must be non-negative integers: {value}")
+    return counts
+
+# 連番IDの可変部分 (10桁) とチェックサムの後半2桁を高速に生成する
+# 下2桁のみ変化する区間では上位桁とチェックサムの計算を使い回す
+BASE62_PAIRS = [a + b for a in BASE62_ALPHABET for b in BASE62_ALPHABET]
+BASE62_PAIR_UPPER_BITS = [('A' <= a <= 'Z') | ('A' <= b <= 'Z') << 1 for a in BASE62_ALPHABET for b in BASE62_ALPHABET]
+
+def iter_sf_id_bodies(start, count):
+    value = start
+    end = start + count
+    while value < end:
+        high, low = divmod(value, len(BASE62_PAIRS))
+        high_str = to_base62(high, 8)
+        middle_suffix = to_sf_id18('00000' + high_str[:5] + '00000')[16]
+        tail_bits = sum(1 << pos for pos, ch in enumerate(high_str[5:]) if 'A' <= ch <= 'Z')
+        stop = min(len(BASE62_PAIRS), low + end - value)
+        for low in range(low, stop):
+            bits = tail_bits | BASE62_PAIR_UPPER_BITS[low] << 3
+            yield high_str + BASE62_PAIRS[low], middle_suffix + SF_ID_SUFFIX_ALPHABET[bits]
+        value += stop - (value % len(BASE62_PAIRS))
+
+# テンプレート行を循環させて start 行目から row_count 行目の手前までの結果CSVを生成するジェネレータ
+# sf__Id はジョブIDと行番号から決定的に生成するため、同じジョブなら何度取得しても (どのページから取得しても) 同じ内容になる
+def generate_result_csv(job_id, template, row_count, start=0):
+    yield template["header"].encode('utf-8')
+
+    # テンプレート行は事前に文字列化し、sf__Id の位置で前後に分割しておく
+    # ID = キープレフィックス(3) + 'GC' + 可変部分(10) + チェックサム(3)
+    buf = io.StringIO()
+    writer = csv.writer(buf, quoting=template["quoting"], lineterminator='')
+    id_col = template["id_col"]
+    rendered = []
+    for row in template["rows"]:
+        if id_col is not None and id_col < len(row) and row[id_col]:
+            head = row[id_col][:3] + 'GC'
+            row = list(row)
+            row[id_col] = '\x00'
+        else:
+            head = None
+        buf.seek(0)
+        buf.truncate()
+        writer.writerow(row)
+        before, _, after = buf.getvalue().partition('\x00')
+        if head is None:
+            rendered.append(('\n' + before, None))
+        else:
+            head_suffix = to_sf_id18(head + '0' * 10)[15]
+            rendered.append(('\n' + before + head, head_suffix + after))
+
+    seed = zlib.crc32(job_id.encode('utf-8')) * 10 ** 8
+    cycle = len(rendered)
+    for batch_start in range(start, row_count, RESULT_STREAM_BATCH_ROWS):
+        batch_size = min(RESULT_STREAM_BATCH_ROWS, row_count - batch_start)
+        bodies = iter_sf_id_bodies(seed + batch_start, batch_size)
+        lines = []
+        for i, (body, suffix) in zip(range(batch_start, batch_start + batch_size), bodies):
+            before, after = rendered[i % cycle]
+            if after is None:
+                lines.append(before)
+            else:
+                lines.append(before + body + after[:1] + suffix + after[1:])
+        yield ''.join(lines).encode('utf-8')
+
+# CSVファイルをそのまま返す (ETag / Last-Modified による条件付きGETと Range 指定に対応)
+# ファイルの読み込みと送信は WSGI サーバーに任せる (wsgi.file_wrapper があれば sendfile を使用)
+# use_gzip の場合は圧縮済みファイルを Content-Encoding: gzip で返す
+def serve_csv_file(fixture, label, log_extra, use_gzip=False):
+    try:
+        path = GZIP_FIXTURES.path_for(fixture) if use_gzip else fixture["path"]
+        response = send_file(path, mimetype='text/csv', conditional=True, etag=True, max_age=0)
+        if use_gzip:
+            response.headers['Content-Encoding'] = 'gzip'
+        return response
+    except OSError as e:
+        app.logger.error("CSV Data Missing: Could not open %s CSV file %s: %s", label, fixture["path"], e, extra=log_extra)
+        return jsonify({"message": "CSV Data not found on server.", "errorCode": "INTERNAL_SERVER_ERROR"}), 500
+
+# --- ヘルパー関数: 結果CSVの gzip 圧縮 ---
+def accepts_gzip():
+    return request.accept_encodings['gzip'] > 0
+
+# ジェネレータの出力を逐次 gzip 圧縮する
+def gzip_stream(iterable):
+    compressor = zlib.compressobj(GZIP_COMPRESS_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    try:
+        for chunk in iterable:
+            data = compressor.compress(chunk)
+            if data:
+                yield data
+        yield compressor.flush()
+    finally:
+        close = getattr(iterable, 'close', None)
+        if close is not None:
+            close()
+
+def gzip_streamed_response(response):
+    response.response = gzip_stream(response.response)
+    response.headers['Content-Encoding'] = 'gzip'
+    response.headers.pop('Content-Length', None)
+    return response
+
+
+# 静的CSVの gzip 圧縮済みファイル (ファイルのバージョンごと)
+# 初回の要求時に圧縮してディレクトリに保存し、以降は圧縮済みファイルをそのまま送信する
+# 別名で書き込んでから置き換えるため、複数のワーカープロセスが同時に作成しても壊れたファイルは見えない
+class GzipFixtureCache:
+    def __init__(self, cache_dir, level):
+        self.cache_dir = cache_dir
+        self.level = level
+        self._lock = threading.Lock()
+        self._path_locks = {}
+
+    def path_for(self, fixture):
+        name = os.path.basename(fixture["path"])
+        gz_path = os.path.join(self.cache_dir, f"{name}.{fixture['mtime_ns']}.{fixture['size']}.gz")
+        if os.path.exists(gz_path):
+            return gz_path
+        with self._lock:
+            path_lock = self._path_locks.setdefault(fixture["path"], threading.Lock())
+        with path_lock:
+            if not os.path.exists(gz_path):
+                self._build(fixture["path"], gz_path, name)
+        return gz_path
+
+    def _build(self, src_path, gz_path, name):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_path = f"{gz_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        with open(src_path, 'rb') as src, open(tmp_path, 'wb') as dst:
+            for chunk in iter(lambda: src.read(RESULT_FILE_CHUNK_SIZE), b''):
+                dst.write(compressor.compress(chunk))
+            dst.write(compressor.flush())
+        os.replace(tmp_path, gz_path)
+
+        # 同じファイルの古いバージョンの圧縮済みファイルを削除する
+        for entry in os.listdir(self.cache_dir):
+            if entry.startswith(name + '.') and entry.endswith('.gz') and os.path.join(self.cache_dir, entry) != gz_path:
+                with contextlib.suppress(OSError):
+                    os.remove(os.path.join(self.cache_dir, entry))
+
+GZIP_FIXTURES = GzipFixtureCache(GZIP_CACHE_DIR, GZIP_COMPRESS_LEVEL)
+
+
+# --- ヘルパー関数: 結果CSVのページ分割 (maxRecords / locator) ---
+class ResultPageError(Exception):
+    def __init__(self, message, error_code):
+        super().__init__(message)
+        self.error_code = error_code
+
+# ロケーターは次のページの先頭行番号を base64 にしたもの (クライアントには不透明な文字列として扱われる)
+def encode_result_locator(row):
+    return base64.urlsafe_b64encode(str(row).encode('ascii')).decode('ascii').rstrip('=')
+
+def decode_result_locator(locator):
+    try:
+        row = int(base64.urlsafe_b64decode(locator + '=' * (-len(locator) % 4)).decode('ascii'))
+    except ValueError:
+        row = 0
+    if row <= 0:
+        raise ResultPageError(f"Invalid locator: {locator}", "INVALID_QUERY_LOCATOR")
+    return row
+
+# maxRecords / locator を解釈して (開始行, 最大件数) を返す。どちらも指定がなければ None (全件を返す)
+def parse_result_page_params(args):
+    max_records = args.get('maxRecords')
+    locator = args.get('locator')
+    if max_records is None and locator is None:
+        return None
+    if max_records is not None:
+        if not max_records.isdigit() or int(max_records) <= 0:
+            raise ResultPageError("maxRecords must be a positive integer.", "INVALID_REQUEST")
+        max_records = int(max_records)
+    start_row = decode_result_locator(locator) if locator else 0
+    return start_row, max_records
+
+def result_page_headers(count, next_row):
+    return {
+        "Sforce-NumberOfRecords": str(count),
+        "Sforce-Locator": encode_result_locator(next_row) if next_row is not None else 'null',
+    }
+
+
+# 結果CSVのファイル1つ (のバージョン) についての 行番号 -> バイト位置 の疎な索引
+# 返却したページの先頭と次のページの先頭を記録し、以降のページはファイル先頭から読み直さずにシークで返す
+class FixtureRowIndex:
+    def __init__(self, path, version):
+        self.path = path
+        self.version = version
+        with open(path, 'rb') as f:
+            self.header = f.readline()
+        self._lock = threading.Lock()
+        self._rows = [0]
+        self._offsets = [len(self.header)]
+
+    # row 以前で最も近い索引の (行番号, バイト位置)
+    def nearest(self, row):
+        with self._lock:
+            i = bisect.bisect_right(self._rows, row) - 1
+            return self._rows[i], self._offsets[i]
+
+    def add(self, row, offset):
+        with self._lock:
+            i = bisect.bisect_left(self._rows, row)
+            if (i == len(self._rows) or self._rows[i] != row) and len(self._rows) < RESULT_ROW_INDEX_MAX_ENTRIES:
+                self._rows.insert(i, row)
+                self._offsets.insert(i, offset)
+
+RESULT_ROW_INDEXES = {}  # path -> FixtureRowIndex (ファイルの最新バージョンのもののみ)
+
+def get_result_row_index(fixture):
+    version = (fixture["mtime_ns"], fixture["size"])
+    index = RESULT_ROW_INDEXES.get(fixture["path"])
+    if index is None or index.version != version:
+        index = RESULT_ROW_INDEXES[fixture["path"]] = FixtureRowIndex(fixture["path"], version)
+    return index
+
+# f の現在位置から最大 count 件 (None は末尾まで) のレコードを読み進め、(読んだ件数, 終了位置) を返す
+# 引用符内の改行はレコードの区切りとしない ("" のエスケープは引用符の数の偶奇に影響しない)
+def skip_csv_records(f, count):
+    records = 0
+    in_quotes = False
+    while count is None or records < count:
+        line = f.readline()
+        if not line:
+            break
+        if line.count(b'"') % 2:
+            in_quotes = not in_quotes
+        if not in_quotes:
+            records += 1
+    return records, f.tell()
+
+def iter_file_range(path, header, start, end):
+    yield header
+    with open(path, 'rb') as f:
+        f.seek(start)
+        remaining = end - start
+        while remaining > 0:
+            chunk = f.read(min(RESULT_FILE_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+# 静的CSVのファイルから1ページ分 (ヘッダー行 + start_row 行目から最大 max_records 件) を返す
+def build_file_page_response(fixture, start_row, max_records):
+    index = get_result_row_index(fixture)
+    with open(fixture["path"], 'rb') as f:
+        row, offset = index.nearest(start_row)
+        f.seek(offset)
+        if row < start_row:
+            skipped, offset = skip_csv_records(f, start_row - row)
+            if skipped < start_row - row:
+                raise ResultPageError(f"Invalid locator: {encode_result_locator(start_row)}", "INVALID_QUERY_LOCATOR")
+            index.add(start_row, offset)
+        count, end = skip_csv_records(f, max_records)
+        at_end = end >= os.fstat(f.fileno()).st_size
+    if start_row and not count:
+        raise ResultPageError(f"Invalid locator: {encode_result_locator(start_row)}", "INVALID_QUERY_LOCATOR")
+
+    next_row = None if at_end else start_row + count
+    if next_row is not None:
+        index.add(next_row, end)
+    headers = result_page_headers(count, next_row)
+    headers["Content-Length"] = str(len(index.header) + end - offset)
+    return Response(iter_file_range(fixture["path"], index.header, offset, end), status=200, mimetype='text/csv', headers=headers)
+
+# 生成CSVの1ページ分 (行番号から直接生成するため索引は不要)
+def build_generated_page_response(job_id, template, total, start_row, max_records):
+    if start_row and start_row >= total:
+        raise ResultPageError(f"Invalid locator: {encode_result_locator(start_row)}", "INVALID_QUERY_LOCATOR")
+    end = total if max_records is None else min(total, start_row + max_records)
+    headers = result_page_headers(end - start_row, end if end < total else None)
+    return Response(generate_result_csv(job_id, template, end, start_row), status=200, mimetype='text/csv', headers=headers)
+
+
+# 検証したジョブの結果CSVファイル (静的CSVと同じ形式の dict)。ない場合は None
+def job_result_file(job_id, job_data, result_type):
+    if result_type not in ('success', 'fail') or not isinstance(job_data.get('validation'), dict):
+        return None
+    path = UPLOAD_SPOOL.result_path(job_id, result_type)
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return {"path": path, "mtime_ns": stat.st_mtime_ns, "size": stat.st_size, "template": None}
+
+# 結果取得APIの共通処理: 件数が決まっていれば生成CSVをストリームで返し、なければ静的CSVを返す
+# maxRecords / locator が指定された場合はページ単位で返す
+# Accept-Encoding で gzip が受け入れられる場合は圧縮して返す
+def build_result_response(job_id, job_data, result_type, label, log_extra):
+    return negotiate_result_encoding(build_result_body_response(job_id, job_data, result_type, label, log_extra))
+
+def negotiate_result_encoding(response):
+    if isinstance(response, Response) and response.status_code < 400:
+        response.vary.add('Accept-Encoding')
+        if response.is_streamed and not response.direct_passthrough and accepts_gzip():
+            gzip_streamed_response(response)
+    return response
+
+def build_result_body_response(job_id, job_data, result_type, label, log_extra):
+    object_name = job_data["object"]
+    # アップロードを検証したジョブは、ジョブごとの結果CSVファイルを静的CSVと同様に返す
+    result_file = job_result_file(job_id, job_data, result_type)
+    counts = None if result_file else get_result_row_counts(job_data)
+
+    fixture = result_file or FIXTURES.get(result_type, object_name)
+
+    try:
+        page = parse_result_page_params(request.args)
+        if page is not None:
+            return build_result_page_response(job_id, object_name, counts, fixture, result_type, label, page, log_extra)
+    except ResultPageError as e:
+        app.logger.error("REQ: GET %s | ERROR: %s", request.path, e, extra=log_extra)
+        return jsonify({"message": str(e), "errorCode": e.error_code}), 400
+
+    if counts is None:
+        if fixture is None:
+            app.logger.error("CSV Data Missing: Could not load %s CSV data for object: %s", label, object_name, extra=log_extra)
+            return jsonify({"message": "CSV Data not found on server.", "errorCode": "INTERNAL_SERVER_ERROR"}), 500
+        if result_file and accepts_gzip():
+            # ジョブごとのファイルは圧縮済みファイルを作らず、送信しながら圧縮する
+            return Response(iter_file_range(result_file["path"], b'', 0, result_file["size"]), status=200, mimetype='text/csv')
+        return serve_csv_file(fixture, label, log_extra, use_gzip=accepts_gzip())
+
+    template = fixture["template"] if fixture else None
+    if not template:
+        app.logger.error("CSV Data Missing: Could not load %s CSV template for object: %s", label, object_name, extra=log_extra)
+        return jsonify({"message": "CSV Data not found on server.", "errorCode": "INTERNAL_SERVER_ERROR"}), 500
+
+    row_count = counts[result_type]
+    app.logger.debug("Streaming %s synthetic %s rows for Job ID: %s", row_count, label, job_id, extra=log_extra)
+    # Content-Length を付けずジェネレータを渡すことで chunked 転送になる
+    return Response(generate_result_csv(job_id, template, row_count), status=200, mimetype='text/csv')
+
+def build_result_page_response(job_id, object_name, counts, fixture, result_type, label, page, log_extra):
+    start_row, max_records = page
+    if fixture is None or (counts is not None and not fixture["template"]):
+        app.logger.error("CSV Data Missing: Could not load %s CSV data for object: %s", label, object_name, extra=log_extra)
+        return jsonify({"message": "CSV Data not found on server.", "errorCode": "INTERNAL_SERVER_ERROR"}), 500
+
+    if counts is None:
+        response = build_file_page_response(fixture, start_row, max_records)
+    else:
+        response = build_generated_page_response(job_id, fixture["template"], counts[result_type], start_row, max_records)
+    app.logger.debug(
+        "Returning %s %s rows from row %s for Job ID: %s | Next locator: %s", response.headers["Sforce-NumberOfRecords"],
+        label, start_row, job_id, response.headers["Sforce-Locator"], extra=log_extra
+    )
+    return response
+
+# --- ヘルパー関数: クエリジョブ (SOQL の解析と結果CSVの列) ---
+class QueryJobError(Exception):
+    def __init__(self, message, error_code):
+        super().__init__(message)
+        self.error_code = error_code
+
+# SOQL を解析して (オブジェクト名, 項目リスト, LIMIT) を返す。LIMIT がなければ None
+def parse_soql_query(query):
+    match = SOQL_QUERY_PATTERN.fullmatch(query) if isinstance(query, str) else None
+    if match is None:
+        raise QueryJobError(f"Unable to parse query: {query}", "MALFORMED_QUERY")
+    fields = [field.strip() for field in match.group('fields').split(',')]
+    for field in fields:
+        if not SOQL_FIELD_PATTERN.fullmatch(field):
+            raise QueryJobError(f"Unsupported field expression in query: {field}", "MALFORMED_QUERY")
+    if len({field.lower() for field in fields}) != len(fields):
+        raise QueryJobError("duplicate field selected", "MALFORMED_QUERY")
+    limit = SOQL_LIMIT_PATTERN.search(match.group('clauses') or '')
+    return match.group('object'), fields, int(limit.group(1)) if limit else None
+
+# 結果CSVテンプレートの列 (sf__ で始まる列を除く) の 小文字の項目名 -> 列位置。Id は sf__Id の列を使う
+def query_field_positions(template):
+    columns = next(csv.reader([template["header"]]))
+    positions = {name.lower(): i for i, name in enumerate(columns) if not name.startswith('sf__')}
+    if template["id_col"] is not None:
+        positions.setdefault('id', template["id_col"])
+    return positions
+
+# 結果CSVテンプレートから SELECT した項目の列だけを取り出したテンプレートを作る (ヘッダーは SOQL の表記のまま、値はすべて引用符で囲む)
+# テンプレートにない項目 (作成後にファイルから列が削除された場合) は空文字
+def build_query_template(template, fields):
+    positions = query_field_positions(template)
+    indexes = [positions.get(field.lower()) for field in fields]
+    id_col = template["id_col"]
+    return {
+        "header": ','.join(f'"{field}"' for field in fields),
+        "rows": [[row[i] if i is not None and i < len(row) else '' for i in indexes] for row in template["rows"]],
+        "quoting": csv.QUOTE_ALL,
+        "id_col": indexes.index(id_col) if id_col is not None and id_col in indexes else None,
+    }
+
+# --- ヘルパー関数: sObject Collections のレコード処理 ---
+# 新規作成レコードの連番 (プロセス起動時刻を起点にして、再起動後も以前のIDと重複しにくくする)
+SOBJECT_RECORD_SEQUENCE = itertools.count(int(time.time() * 1000) * 1000)
+
+def new_sobject_record_id(sobject):
+    prefix = SOBJECT_KEY_PREFIXES.get(sobject, SOBJECT_KEY_PREFIXES["default"])
+    return to_sf_id18(prefix + 'GC' + to_base62(next(SOBJECT_RECORD_SEQUENCE), 10))
+
+# アップサートのIDは (オブジェクト, 外部ID項目, 値) から決定的に生成する (同じ外部IDなら常に同じID)
+def upsert_sobject_record_id(sobject, external_id_field, value):
+    digest = hashlib.blake2b(f"{sobject}.{external_id_field}={value}".encode('utf-8'), digest_size=7).digest()
+    prefix = SOBJECT_KEY_PREFIXES.get(sobject, SOBJECT_KEY_PREFIXES["default"])
+    return to_sf_id18(prefix + 'GC' + to_base62(int.from_bytes(digest, 'big'), 10))
+
+def sobject_error_entry(status_code, message, fields=()):
+    return encode_json({
+        "success": False,
+        "errors": [{"statusCode": status_code, "message": message, "fields": list(fields)}]
+    })
+
+# 全レコードを1回の走査で検証し、レコードごとの (エラー応答 bytes または None, レコードID または None) を返す
+# 作成 (create) のIDは検証後に採番するため、ここでは None を返す
+def validate_sobject_records(operation, records, sobject, external_id_field):
+    invalid_type = RESPONSE_CACHE[('sobjects', 'invalid_type', 'error')]
+    missing_id = RESPONSE_CACHE[('sobjects', 'missing_id', 'error')]
+    checked = []
+    for record in records:
+        attributes = record.get('attributes') if isinstance(record, dict) else None
+        record_type = attributes.get('type') if isinstance(attributes, dict) else None
+        if not record_type or (operation == 'upsert' and record_type != sobject):
+            checked.append((invalid_type, None))
+        elif operation == 'create':
+            checked.append((None, None))
+        elif operation == 'update':
+            record_id = record.get('id') or record.get('Id')
+            if not record_id:
+                checked.append((missing_id, None))
+            elif not isinstance(record_id, str) or not SF_ID_PATTERN.fullmatch(record_id):
+                checked.append((sobject_error_entry("MALFORMED_ID", f"malformed id {record_id}"), None))
+            else:
+                checked.append((None, to_sf_id18(record_id[:15])))
+        else:
+            value = record.get(external_id_field)
+            if value is None or value == '':
+                checked.append((sobject_error_entry("MISSING_ARGUMENT", f"{external_id_field} not specified", [external_id_field]), None))
+            else:
+                checked.append((None, upsert_sobject_record_id(sobject, external_id_field, value)))
+    return checked
+
+# レコードごとの結果 (bytes) のリストと失敗件数を返す
+# X-API-Key が正常系以外の場合は全レコードを異常系とし、allOrNone で失敗があれば他のレコードはロールバック扱いにする
+def build_sobject_results(operation, records, sobject, external_id_field, is_success_key, all_or_none):
+    checked = validate_sobject_records(operation, records, sobject, external_id_field)
+    if not is_success_key:
+        error = RESPONSE_CACHE[('sobjects', 'save', 'error')]
+        return [entry or error for entry, _ in checked], len(checked)
+
+    error_count = sum(1 for entry, _ in checked if entry is not None)
+    if error_count and all_or_none:
+        rollback = RESPONSE_CACHE[('sobjects', 'rollback', 'error')]
+        return [entry or rollback for entry, _ in checked], len(checked)
+
+    before, after = RESPONSE_CACHE[('sobjects', 'upsert' if operation == 'upsert' else 'save', 'success')]
+    entries = []
+    for (entry, record_id), record in zip(checked, records):
+        if entry is None:
+            if record_id is None:
+                record_id = new_sobject_record_id(record['attributes']['type'])
+            entry = before + record_id.encode('ascii') + after
+        entries.append(entry)
+    return entries, error_count
+
+# --- ヘルパー関数: ジョブの取得 ---
+# ジョブ種別 (V2Ingest / V2Query) が一致するジョブを返す。種別の異なるAPIからは存在しないジョブとして扱う
+def get_job(job_id, job_type='V2Ingest'):
+    job_data = JOB_STORE.get(job_id)
+    if job_data is None or job_data.get('job_type', 'V2Ingest') != job_type:
+        return None
+    return job_data
+
+# 同時に処理中にできるジョブ数の上限 (確認と作成の間に他のリクエストが作成した分は許容する)
+def check_active_job_limit(log_extra):
+    if MAX_ACTIVE_JOBS and JOB_STORE.count_states(ACTIVE_JOB_STATES) >= MAX_ACTIVE_JOBS:
+        app.logger.warning("REQ: POST %s | ERROR: Active job limit exceeded: %s", request.path, MAX_ACTIVE_JOBS, extra=log_extra)
+        return jsonify({
+            "message": f"Maximum number of active jobs exceeded: {MAX_ACTIVE_JOBS}",
+            "errorCode": "REQUEST_LIMIT_EXCEEDED"
+        }), 429
+    return None
 
 # --- ヘルパー関数: Job ID生成 ---
+# jobIdのフォーマット: インターフェースID (ハイフンなし) + Salesforce形式の18桁ID
+# 18桁ID = キープレフィックス 750 + インスタンス GC + 連番 (62進数10桁) + チェックサム3桁
+# 連番はジョブストアから JOB_ID_BLOCK_SIZE 件ずつ予約するため、ワーカープロセス間でも重複せず、プロセス内では単調増加する
+JOB_ID_KEY_PREFIX = '750GC'
+JOB_ID_KEY_PREFIX_SUFFIX = to_sf_id18(JOB_ID_KEY_PREFIX + '0' * 10)[15]
+
+# hi/lo 方式の払い出し (予約した範囲を使い切ったら reserve(block_size) で次の範囲を予約する)
+class JobIdAllocator:
+    def __init__(self, reserve, block_size):
+        self._reserve = reserve
+        self.block_size = block_size
+        self._reset()
+        # fork 前に予約した範囲を複数の子プロセスで払い出さないよう、子プロセスでは予約し直す
+        os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        self._lock = threading.Lock()
+        self._bodies = iter(())
+
+    # 18桁ID を返す
+    def next_id(self):
+        with self._lock:
+            body = next(self._bodies, None)
+            if body is None:
+                self._bodies = iter_sf_id_bodies(self._reserve(self.block_size), self.block_size)
+                body = next(self._bodies)
+        id_body, suffix = body
+        return JOB_ID_KEY_PREFIX + id_body + JOB_ID_KEY_PREFIX_SUFFIX + suffix
+
+
+# JOB_STORE は起動時に差し替わることがあるため、予約のたびに参照する
+JOB_ID_ALLOCATOR = JobIdAllocator(lambda count: JOB_STORE.reserve_job_ids(count), JOB_ID_BLOCK_SIZE)
+
 def generate_job_id(interface_id):
-    # jobIdのフォーマット: IF-XXXXXX + 750GC00000 + UUID(8文字) + ZAQ
-    # ただし、IDにはハイフンを含めない仕様が多いので、ハイフンを除去
-    prefix = interface_id.replace('-', '') 
-    
-    # UUIDをベースにしたランダム部分
-    random_part = str(uuid.uuid4())[:8].upper()
-    return f"{prefix}750GC00000{random_part}ZAQ"
+    # IDにはハイフンを含めない仕様が多いので、ハイフンを除去
+    return interface_id.replace('-', '') + JOB_ID_ALLOCATOR.next_id()
 
 
 #====================================================
@@ -156,16 +3225,27 @@ def create_job():
     try:
         req_json = request.get_json(force=True)
     except:
-        app.logger.error(f"REQ: POST {request.path} | ERROR: Invalid JSON format.", extra=log_extra)
+        app.logger.error("REQ: POST %s | ERROR: Invalid JSON format.", request.path, extra=log_extra)
         return jsonify({"message": "Invalid JSON format."}), 400
         
     object_name = req_json.get('object', 'Default__c')
+
+    # スタブ独自拡張: 結果CSVの件数指定 (例: {"success": 1000000, "fail": 10})
+    try:
+        result_rows_override = parse_result_rows_override(req_json.get('stubResultRows'))
+    except ValueError as e:
+        app.logger.error("REQ: POST %s | ERROR: %s", request.path, e, extra=log_extra)
+        return jsonify({"message": str(e), "errorCode": "INVALIDJOB"}), 400
     
     # --- object名に基づきインターフェース情報を取得 ---
     if object_name not in INTERFACE_MAPPING:
-        app.logger.error(f"REQ: POST {request.path} | ERROR: Invalid object name: {object_name}", extra=log_extra)
+        app.logger.error("REQ: POST %s | ERROR: Invalid object name: %s", request.path, object_name, extra=log_extra)
         return jsonify({"message": f"Invalid object: {object_name}.", "errorCode": "INVALID_OBJECT"}), 400
         
+    # 同時に処理中にできるジョブ数の上限
+    limit_check = check_active_job_limit(log_extra)
+    if limit_check: return limit_check
+
     interface = INTERFACE_MAPPING[object_name]
     new_job_id = generate_job_id(interface['id'])
     now_utc = datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S.000+0000")
@@ -173,18 +3253,21 @@ def create_job():
     # --- ジョブ情報をJOB_STOREに保存 ---
     job_data = {
         "id": new_job_id,
+        "job_type": "V2Ingest",
         "object": object_name,
         "interface_id": interface['id'],
         "interface_name": interface['name'],
         "state": "Open",
-        "sim_get_count": 0, # ポーリングシミュレーション用
+        "operation": req_json.get('operation', 'upsert'),
+        "created_date": now_utc,
         "externalIdFieldName": req_json.get('externalIdFieldName', 'ContractExternalId__c'),
+        "result_rows_override": result_rows_override,
     }
-    JOB_STORE[new_job_id] = job_data
+    JOB_STORE.put(new_job_id, job_data)
     
     log_info = f"{interface['id']}:{interface['name']}"
     app.logger.info(
-        f"REQ: POST {request.path} | Job ID: {new_job_id} | Object: {object_name} | JSON Body: {req_json}", 
+        "REQ: POST %s | Job ID: %s | Object: %s | JSON Body: %s", request.path, new_job_id, object_name, truncate_for_log(req_json), 
         extra={'job_info': log_info}
     )
 
@@ -216,28 +3299,71 @@ def handle_csv_batch(jobId):
     auth_check = check_auth_and_log(expected_content_type_prefix='text/csv')
     if auth_check: return auth_check
     
-    if jobId not in JOB_STORE:
+    # 存在しない (または期限切れで削除された) ジョブは 404
+    job_data = get_job(jobId)
+    if job_data is None:
         log_extra = {'job_info': 'NOT_FOUND'}
-        app.logger.error(f"RES: 404 NOT FOUND | Job ID: {jobId} ID not found.", extra=log_extra)
+        app.logger.error("RES: 404 NOT FOUND | Job ID: %s ID not found.", jobId, extra=log_extra)
         return jsonify({"message": "The requested resource does not exist", "errorCode": "NOT_FOUND"}), 404
 
-    job_data = JOB_STORE[jobId]
     job_info = f"{job_data['interface_id']}:{job_data['interface_name']}"
     log_extra = {'job_info': job_info}
 
-    csv_data = request.data.decode('utf-8')
-    csv_lines = csv_data.split('\n')
-    preview = '\\n'.join(csv_lines[:3]) 
+    # gzip 圧縮されたアップロードに対応 (それ以外の Content-Encoding は 415)
+    content_encoding = request.headers.get('Content-Encoding', '').strip().lower()
+    if content_encoding not in ('', 'identity', 'gzip'):
+        app.logger.error("REQ: PUT %s | ERROR: Unsupported Content-Encoding: %s", request.path, content_encoding, extra=log_extra)
+        return jsonify({"message": f"Unsupported Content-Encoding: {content_encoding}", "errorCode": "UNSUPPORTED_MEDIA_TYPE"}), 415
+
+    # サイズの上限 (Content-Length が上限を超える場合はボディを読まずに返す)
+    if request.content_length is not None and request.content_length > UPLOAD_MAX_BYTES:
+        app.logger.error("REQ: PUT %s | ERROR: Content-Length %s exceeds the upload limit of %s bytes.",
+                         request.path, request.content_length, UPLOAD_MAX_BYTES, extra=log_extra)
+        return upload_limit_exceeded_response()
+
+    # リクエストボディはチャンク単位で読み込み、ジョブごとのファイル (小さいものはメモリ) に保存する
+    spool_writer = UPLOAD_SPOOL.writer(jobId)
+    try:
+        stats = consume_csv_stream(request.stream, content_encoding, spool_writer, UPLOAD_MAX_BYTES)
+    except zlib.error as e:
+        spool_writer.abort()
+        app.logger.error("REQ: PUT %s | ERROR: Invalid gzip content: %s", request.path, e, extra=log_extra)
+        return jsonify({"message": "Invalid gzip content.", "errorCode": "INVALID_REQUEST"}), 400
+    except UploadLimitError as e:
+        spool_writer.abort()
+        app.logger.error("REQ: PUT %s | ERROR: %s", request.path, e, extra=log_extra)
+        return upload_limit_exceeded_response()
+    except BaseException:
+        spool_writer.abort()
+        raise
+    spool_writer.commit()
+
+    # アップロード件数をジョブに記録 (get_job_details の処理件数に使用)
+    def record_upload(job):
+        job['upload_rows'] = stats.record_count
+        job['upload_bytes'] = stats.total_bytes
+    if JOB_STORE.update(jobId, record_upload) is None:
+        # 読み込み中にジョブが削除された
+        UPLOAD_SPOOL.discard(jobId)
+    METRICS.add_upload(job_data['object'], stats.record_count, stats.total_bytes)
     
     app.logger.info(
-        f"REQ: PUT {request.path} | Job ID: {jobId} | Object: {job_data['object']} | Data Size: {len(csv_data)} bytes", 
+        "REQ: PUT %s | Job ID: %s | Object: %s | Data Size: %s bytes (received: %s bytes) | Records: %s", request.path, jobId, job_data['object'],
+        stats.total_bytes, stats.wire_bytes, stats.record_count, 
         extra=log_extra
     )
-    app.logger.debug(f"CSV Preview (first 3 lines): {preview}", extra=log_extra)
+    app.logger.debug("CSV Preview (first %s lines): %s", CSV_PREVIEW_LINES, truncate_for_log(stats.preview), extra=log_extra)
     
     # 正常応答
     return Response(status=201)
 
+# 読み込んでいないボディが残った接続は、サーバー (Werkzeug / uvicorn) が再利用せずに閉じる
+def upload_limit_exceeded_response():
+    return jsonify({
+        "message": f"Upload exceeds the maximum size of {UPLOAD_MAX_BYTES} bytes",
+        "errorCode": "LIMIT_EXCEEDED"
+    }), 413
+
 #====================================================
 # 3. PATCH: ステータス更新 /jobs/ingest/{id}
 #====================================================
@@ -247,32 +3373,44 @@ def update_job_state(jobId):
     auth_check = check_auth_and_log(expected_content_type_prefix='application/json')
     if auth_check: return auth_check
     
-    if jobId not in JOB_STORE:
+    # 存在しない (または期限切れで削除された) ジョブは 404
+    job_data = get_job(jobId)
+    if job_data is None:
         log_extra = {'job_info': 'NOT_FOUND'}
-        app.logger.error(f"RES: 404 NOT FOUND | Job ID: {jobId} ID not found.", extra=log_extra)
+        app.logger.error("RES: 404 NOT FOUND | Job ID: %s ID not found.", jobId, extra=log_extra)
         return jsonify({"message": "The requested resource does not exist", "errorCode": "NOT_FOUND"}), 404
 
-    job_data = JOB_STORE[jobId]
     job_info = f"{job_data['interface_id']}:{job_data['interface_name']}"
     log_extra = {'job_info': job_info}
 
     try:
         request_json = request.get_json(force=True)
     except:
-        app.logger.error(f"REQ: PATCH {request.path} | ERROR: Invalid JSON format.", extra=log_extra)
+        app.logger.error("REQ: PATCH %s | ERROR: Invalid JSON format.", request.path, extra=log_extra)
         return jsonify({"message": "Invalid JSON."}), 400
 
     
     if request_json.get('state') != 'UploadComplete':
-        app.logger.error(f"REQ: PATCH {request.path} | Invalid state requested: {request_json.get('state')}", extra=log_extra)
+        app.logger.error("REQ: PATCH %s | Invalid state requested: %s", request.path, request_json.get('state'), extra=log_extra)
         return jsonify({"message": "Invalid state.", "errorCode": "INVALID_STATE_VALUE"}), 400
 
-    # 状態を更新
-    job_data['state'] = 'UploadComplete'
-    JOB_STORE[jobId] = job_data
+    # 状態を更新し、InProgress / JobComplete への遷移時刻を決める
+    # アップロード済みで件数指定 (stubResultRows) がなければ、アップロードされたCSVを検証する
+    def mark_upload_complete(job):
+        job['state'] = 'UploadComplete'
+        job['state_schedule'] = build_state_schedule(job, time.time())
+        if VALIDATE_UPLOADS and 'upload_rows' in job and not job.get('result_rows_override'):
+            job['validation'] = 'pending'
+    job_data = JOB_STORE.update(jobId, mark_upload_complete)
+    if job_data is None:
+        app.logger.error("RES: 404 NOT FOUND | Job ID: %s ID not found.", jobId, extra={'job_info': 'NOT_FOUND'})
+        return jsonify({"message": "The requested resource does not exist", "errorCode": "NOT_FOUND"}), 404
+    JOB_SCHEDULER.schedule(jobId, job_data['state_schedule'])
+    if job_data.get('validation') == 'pending':
+        submit_upload_validation(jobId)
     
     app.logger.info(
-        f"REQ: PATCH {request.path} | Job ID: {jobId} | State updated to: UploadComplete | JSON Body: {request_json}", 
+        "REQ: PATCH %s | Job ID: %s | State updated to: UploadComplete | Schedule: %s | JSON Body: %s", request.path, jobId, job_data['state_schedule'], truncate_for_log(request_json), 
         extra=log_extra
     )
 
@@ -302,42 +3440,37 @@ def get_job_details(jobId):
     auth_check = check_auth_and_log()
     if auth_check: return auth_check
     
-    if jobId not in JOB_STORE:
+    # 存在しない (または期限切れで削除された) ジョブは 404
+    job_data = get_job(jobId)
+    if job_data is None:
         log_extra = {'job_info': 'NOT_FOUND'}
-        app.logger.error(f"RES: 404 NOT FOUND | Job ID: {jobId} ID not found.", extra=log_extra)
+        app.logger.error("RES: 404 NOT FOUND | Job ID: %s ID not found.", jobId, extra=log_extra)
         return jsonify({"message": "The requested resource does not exist", "errorCode": "NOT_FOUND"}), 404
     
-    job_data = JOB_STORE[jobId]
     job_info = f"{job_data['interface_id']}:{job_data['interface_name']}"
     log_extra = {'job_info': job_info}
 
-    
-    # ポーリング回数をインクリメント
-    job_data['sim_get_count'] += 1
-    
     # 状態シミュレーション: Open -> UploadComplete -> InProgress -> JobComplete
-    current_state = job_data['state']
-    
-    if current_state == "UploadComplete":
-        job_data['state'] = "InProgress"
-        
-    elif current_state == "InProgress" and job_data['sim_get_count'] >= MAX_GET_COUNT:
-        job_data['state'] = "JobComplete"
-        
-    JOB_STORE[jobId] = job_data
+    # 遷移は PATCH 時に決めた時刻で進むため、ここでは現在の状態を求めるだけ
+    # スケジューラの反映より先に遷移時刻を過ぎていた場合のみ、ジョブストア (状態の副索引) に反映する
+    state = resolve_job_state(job_data)
+    if state != job_data['state']:
+        advance_job_state(jobId, state)
         
     app.logger.info(
-        f"REQ: GET {request.path} | Job ID: {jobId} | State Check | New State: {job_data['state']} (Poll Count: {job_data['sim_get_count']})",
+        "REQ: GET %s | Job ID: %s | State Check | State: %s", request.path, jobId, state,
         extra=log_extra
     )
 
     now_utc = datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S.000+0000")
     
     # JobComplete 時の完了情報
-    if job_data['state'] == 'JobComplete':
-        processed = 2
-        failed = 1
-        total_time = 126
+    counts = get_result_row_counts(job_data) or {"success": 0, "fail": 0}
+    if state == 'JobComplete':
+        schedule = job_data.get('state_schedule')
+        processed = counts["success"] + counts["fail"]
+        failed = counts["fail"]
+        total_time = int((schedule["JobComplete"] - schedule["InProgress"]) * 1000) if schedule else 0
     else:
         processed = 0
         failed = 0
@@ -351,14 +3484,14 @@ def get_job_details(jobId):
         "createdDate": "2024-11-14T09:39:09.000+0000",
         "externalIdFieldName": job_data["externalIdFieldName"], 
         "concurrencyMode": "Parallel",
-        "state": job_data['state'], 
+        "state": state, 
         "systemModstamp": now_utc, 
         "contentType": "CSV", 
         "apiVersion": 62.0, 
         "jobType": "V2Ingest", 
         "lineEnding": "CRLF", 
         "columnDelimiter": "COMMA", 
-        "numberRecordsProcessed": processed, # 処理完了時に 2 を返す
+        "numberRecordsProcessed": processed, # 処理完了時に結果CSVの件数を返す
         "numberRecordsFailed": failed,
         "retries": 0, 
         "totalProcessingTime": total_time,
@@ -377,28 +3510,20 @@ def get_successful_results(jobId):
     auth_check = check_auth_and_log()
     if auth_check: return auth_check
     
-    if jobId not in JOB_STORE:
+    # 存在しない (または期限切れで削除された) ジョブは 404
+    job_data = get_job(jobId)
+    if job_data is None:
         log_extra = {'job_info': 'NOT_FOUND'}
-        app.logger.error(f"RES: 404 NOT FOUND | Job ID: {jobId} ID not found.", extra=log_extra)
+        app.logger.error("RES: 404 NOT FOUND | Job ID: %s ID not found.", jobId, extra=log_extra)
         return jsonify({"message": "The requested resource does not exist", "errorCode": "NOT_FOUND"}), 404
         
-    job_data = JOB_STORE[jobId]
     job_info = f"{job_data['interface_id']}:{job_data['interface_name']}"
     log_extra = {'job_info': job_info}
 
-    app.logger.info(f"REQ: GET {request.path} | Job ID: {jobId}", extra=log_extra)
-
-    # --- objectの値に基づいてCSVを切り替え (外部ファイルからロードしたデータを使用) ---
-    object_name = job_data["object"]
-    csv_data = LOADED_CSV_DATA["success"].get(object_name, "")
-    
-    if not csv_data:
-        app.logger.error(f"CSV Data Missing: Could not load successful CSV data for object: {object_name}", extra=log_extra)
-        return jsonify({"message": "CSV Data not found on server.", "errorCode": "INTERNAL_SERVER_ERROR"}), 500
+    app.logger.info("REQ: GET %s | Job ID: %s", request.path, jobId, extra=log_extra)
 
-    response = Response(csv_data, mimetype='text/csv')
-    response.status_code = 200
-    return response
+    # --- objectの値に基づいてCSVを切り替え (件数指定があれば生成、なければ外部ファイルのデータを使用) ---
+    return build_result_response(jobId, job_data, "success", "successful", log_extra)
 
 #====================================================
 # 6. GET: 失敗レコードリスト取得 /failedResults
@@ -409,28 +3534,20 @@ def get_failed_results(jobId):
     auth_check = check_auth_and_log()
     if auth_check: return auth_check
     
-    if jobId not in JOB_STORE:
+    # 存在しない (または期限切れで削除された) ジョブは 404
+    job_data = get_job(jobId)
+    if job_data is None:
         log_extra = {'job_info': 'NOT_FOUND'}
-        app.logger.error(f"RES: 404 NOT FOUND | Job ID: {jobId} ID not found.", extra=log_extra)
+        app.logger.error("RES: 404 NOT FOUND | Job ID: %s ID not found.", jobId, extra=log_extra)
         return jsonify({"message": "The requested resource does not exist", "errorCode": "NOT_FOUND"}), 404
         
-    job_data = JOB_STORE[jobId]
     job_info = f"{job_data['interface_id']}:{job_data['interface_name']}"
     log_extra = {'job_info': job_info}
     
-    app.logger.info(f"REQ: GET {request.path} | Job ID: {jobId}", extra=log_extra)
+    app.logger.info("REQ: GET %s | Job ID: %s", request.path, jobId, extra=log_extra)
 
-    # --- objectの値に基づいてCSVを切り替え (外部ファイルからロードしたデータを使用) ---
-    object_name = job_data["object"]
-    csv_data = LOADED_CSV_DATA["fail"].get(object_name, "")
-    
-    if not csv_data:
-        app.logger.error(f"CSV Data Missing: Could not load failed CSV data for object: {object_name}", extra=log_extra)
-        return jsonify({"message": "CSV Data not found on server.", "errorCode": "INTERNAL_SERVER_ERROR"}), 500
-        
-    response = Response(csv_data, mimetype='text/csv')
-    response.status_code = 200
-    return response
+    # --- objectの値に基づいてCSVを切り替え (件数指定があれば生成、なければ外部ファイルのデータを使用) ---
+    return build_result_response(jobId, job_data, "fail", "failed", log_extra)
 
 #====================================================
 # 7. GET: 未処理レコードリスト取得 /unprocessedRecords/
@@ -441,28 +3558,20 @@ def get_unprocessed_results(jobId):
     auth_check = check_auth_and_log()
     if auth_check: return auth_check
     
-    if jobId not in JOB_STORE:
+    # 存在しない (または期限切れで削除された) ジョブは 404
+    job_data = get_job(jobId)
+    if job_data is None:
         log_extra = {'job_info': 'NOT_FOUND'}
-        app.logger.error(f"RES: 404 NOT FOUND | Job ID: {jobId} ID not found.", extra=log_extra)
+        app.logger.error("RES: 404 NOT FOUND | Job ID: %s ID not found.", jobId, extra=log_extra)
         return jsonify({"message": "The requested resource does not exist", "errorCode": "NOT_FOUND"}), 404
     
-    job_data = JOB_STORE[jobId]
     job_info = f"{job_data['interface_id']}:{job_data['interface_name']}"
     log_extra = {'job_info': job_info}
     
-    app.logger.info(f"REQ: GET {request.path} | Job ID: {jobId}", extra=log_extra)
+    app.logger.info("REQ: GET %s | Job ID: %s", request.path, jobId, extra=log_extra)
 
-    # --- objectの値に基づいてCSVを切り替え (外部ファイルからロードしたデータを使用) ---
-    object_name = job_data["object"]
-    csv_data = LOADED_CSV_DATA["unproc"].get(object_name, "")
-    
-    if not csv_data:
-        app.logger.error(f"CSV Data Missing: Could not load unprocessed CSV data for object: {object_name}", extra=log_extra)
-        return jsonify({"message": "CSV Data not found on server.", "errorCode": "INTERNAL_SERVER_ERROR"}), 500
-    
-    response = Response(csv_data, mimetype='text/csv')
-    response.status_code = 200
-    return response
+    # --- objectの値に基づいてCSVを切り替え (件数指定があれば生成、なければ外部ファイルのデータを使用) ---
+    return build_result_response(jobId, job_data, "unproc", "unprocessed", log_extra)
 
 # ====================================================
 # 8. POST: Composite API (IF-360001: メール許諾情報 / IF-630001: 会員登録 / IF-630013: メール許諾詳細)
@@ -478,185 +3587,55 @@ def handle_composite_api():
     try:
         req_json = request.get_json(force=True)
     except:
-        app.logger.error(f"REQ: POST {request.path} | ERROR: Invalid JSON format.", extra={'job_info': 'Composite:JSON_ERR'})
+        app.logger.error("REQ: POST %s | ERROR: Invalid JSON format.", request.path, extra={'job_info': 'Composite:JSON_ERR'})
         return jsonify({"message": "Invalid JSON format."}), 400
 
     # 必須: compositeRequest配列と最初のサブ要求
     if not req_json.get('compositeRequest') or not isinstance(req_json['compositeRequest'], list) or not req_json['compositeRequest']:
-        app.logger.error(f"REQ: POST {request.path} | ERROR: Missing or invalid compositeRequest array.", extra={'job_info': 'Composite:REQ_ERR'})
+        app.logger.error("REQ: POST %s | ERROR: Missing or invalid compositeRequest array.", request.path, extra={'job_info': 'Composite:REQ_ERR'})
         return jsonify({"message": "Invalid composite request structure.", "errorCode": "INVALID_REQUEST"}), 400
 
-    first_sub_request = req_json['compositeRequest'][0]
-    method = first_sub_request.get('method', '').upper()
-    sub_body = first_sub_request.get('body', {})
+    sub_requests = req_json['compositeRequest']
+    if len(sub_requests) > COMPOSITE_MAX_SUBREQUESTS:
+        app.logger.error("REQ: POST %s | ERROR: Too many subrequests: %s", request.path, len(sub_requests), extra={'job_info': 'Composite:REQ_ERR'})
+        return jsonify({
+            "message": f"Exceeded max limit of subrequests allowed: {COMPOSITE_MAX_SUBREQUESTS}",
+            "errorCode": "LIMIT_EXCEEDED"
+        }), 400
     
-    # 2. X-API-Key の取得と正常/異常の判定
+    # 2. X-API-Key の取得と結果 (シナリオの応答) の判定
     api_key = request.headers.get('X-API-Key', '')
-    is_success_key = (api_key == 'dummy_key_xyz')
-    
-    # 3. メソッドに基づくロジックの分岐
+    outcome = composite_key_outcome(api_key)
     
-    if method == 'GET':
-        # --- (A) IF-360001: メール許諾情報取得 (SELECT) ---
-        log_info = "IF-360001:メール許諾情報(GET)"
-        log_extra = {'job_info': log_info}
-        
-        app.logger.info(
-            f"REQ: POST {request.path} | API Key: {api_key} | Case: {'SUCCESS' if is_success_key else 'ERROR'}", 
-            extra=log_extra
-        )
-
-        if is_success_key:
-            # 正常系レスポンス (内部 HttpStatusCode: 200)
-            composite_response = {
-                "compositeResponse": [
-                    {
-                        "body": {
-                            "totalSize": 1,
-                            "done": True,
-                            "records": [
-                                {
-                                    "attributes": {
-                                        "type": "Lead",
-                                        "url": "/services/data/v62.0/sobjects/Lead/00QGC000001rXNgo2AG"
-                                    },
-                                    "EmailPermissionFlag__c": True
-                                }
-                            ]
-                        },
-                        "httpHeaders": {},
-                        "httpStatusCode": 200, 
-                        "referenceId": "GetLead"
-                    }
-                ]
-            }
-        else:
-            # 異常系レスポンス (内部 HttpStatusCode: 400 - フィールド不正)
-            composite_response = {
-                "compositeResponse": [
-                    {
-                        "body": [
-                            {
-                                "message": "Field 'EmailPermissioFlag__c' is not supported in SOQL.",
-                                "errorCode": "INVALID_FIELD"
-                            }
-                        ],
-                        "httpHeaders": {},
-                        "httpStatusCode": 400, 
-                        "referenceId": "GetLead"
-                    }
-                ]
-            }
-        return jsonify(composite_response), 200
-        
-    elif method == 'PATCH':
-        
-        # --- PATCH内部のAPIを識別 ---
-        if 'EmailPermissionFlag__c' in sub_body:
-            # --- (B) IF-630013: メール許諾詳細情報 (PATCH) ---
-            log_info = "IF-630013:メール許諾詳細(PATCH)"
-            log_extra = {'job_info': log_info}
-
-            app.logger.info(
-                f"REQ: POST {request.path} | API Key: {api_key} | API: IF-630013 | Case: {'SUCCESS' if is_success_key else 'ERROR'}", 
-                extra=log_extra
-            )
-
-            if is_success_key:
-                # 正常系レスポンス (内部 HttpStatusCode: 200 - IF-630013の資料に基づく)
-                composite_response = {
-                    "compositeResponse": [
-                        {
-                            "body": {
-                                "id": "00QGC000001rXj7Y2AC", 
-                                "success": True,
-                                "errors": [],
-                                "created": False # 更新なので False
-                            },
-                            "httpHeaders": {
-                                "Location": "/services/data/v60.0/sobjects/Lead/00QGC000001rXj7Y2AC"
-                            },
-                            "httpStatusCode": 200, # 資料の通り 200 に修正
-                            "referenceId": "Lead"
-                        }
-                    ]
-                }
-            else:
-                # 異常系レスポンス (内部 HttpStatusCode: 400 - ID不正など)
-                composite_response = {
-                    "compositeResponse": [
-                        {
-                            "body": [
-                                {
-                                    "message": "malformed id XXXXXXXXXXXXXXX.",
-                                    "errorCode": "MALFORMED_ID"
-                                }
-                            ],
-                            "httpHeaders": {},
-                            "httpStatusCode": 400, 
-                            "referenceId": "Lead"
-                        }
-                    ]
-                }
-            return jsonify(composite_response), 200
+    # 3. メソッドに基づくロジックの分岐 (全サブ要求のAPIを先に判定し、未対応メソッドがあれば要求全体をエラーにする)
+    dispatched = []
+    for sub_request in sub_requests:
+        method = str(sub_request.get('method', '')).upper() if isinstance(sub_request, dict) else ''
+        api = select_composite_api(method, sub_request.get('body', {})) if method else None
+        if api is None:
+            # 未対応メソッド
+            log_info = f"Composite:UNKNOWN({method})"
+            app.logger.warning("REQ: POST %s | WARNING: Unsupported composite method: %s", request.path, method, extra={'job_info': log_info})
+            
+            return jsonify({
+                "message": f"Unsupported method in composite request: {method}", 
+                "errorCode": "INVALID_METHOD"
+            }), 400
+        reference_id = sub_request.get('referenceId') or COMPOSITE_APIS[api]["referenceId"]
+        dispatched.append((sub_request, api, reference_id))
 
-        else:
-            # --- (C) IF-630001: 会員登録/更新 (PATCH) ---
-            log_info = "IF-630001:会員登録(PATCH)"
-            log_extra = {'job_info': log_info}
+    # 4. サブ要求を順に処理 (レスポンスは起動時にエンコード済みのものを組み合わせる)
+    all_or_none = bool(req_json.get('allOrNone', False))
+    entries, failed = process_composite_subrequests(dispatched, outcome, all_or_none)
 
-            app.logger.info(
-                f"REQ: POST {request.path} | API Key: {api_key} | API: IF-630001 | Case: {'SUCCESS' if is_success_key else 'ERROR'}", 
-                extra=log_extra
-            )
-            
-            if is_success_key:
-                # 正常系レスポンス (内部 HttpStatusCode: 201 - IF-630001の資料に基づく)
-                composite_response = {
-                    "compositeResponse": [
-                        {
-                            "body": {
-                                "id": "00QGC000001rXNgo2AC", 
-                                "success": True,
-                                "errors": [],
-                                "created": True
-                            },
-                            "httpHeaders": {
-                                "Location": "/services/data/v62.0/sobjects/Lead/00QGC000001rXNgo2AC"
-                            },
-                            "httpStatusCode": 201, # 作成/更新成功時は 201
-                            "referenceId": "Lead"
-                        }
-                    ]
-                }
-            else:
-                # 異常系レスポンス (内部 HttpStatusCode: 400 - ID不正など)
-                composite_response = {
-                    "compositeResponse": [
-                        {
-                            "body": [
-                                {
-                                    "message": "malformed id XXXXXXXXXXXXXXX.",
-                                    "errorCode": "MALFORMED_ID"
-                                }
-                            ],
-                            "httpHeaders": {},
-                            "httpStatusCode": 400, # サブ要求は異常
-                            "referenceId": "Lead"
-                        }
-                    ]
-                }
-            return jsonify(composite_response), 200
-        
-    else:
-        # 未対応メソッド
-        log_info = f"Composite:UNKNOWN({method})"
-        app.logger.warning(f"REQ: POST {request.path} | WARNING: Unsupported composite method: {method}", extra={'job_info': log_info})
-        
-        return jsonify({
-            "message": f"Unsupported method in composite request: {method}", 
-            "errorCode": "INVALID_METHOD"
-        }), 400
+    log_extra = {'job_info': COMPOSITE_APIS[dispatched[0][1]]["label"]}
+    app.logger.info(
+        "REQ: POST %s | API Key: %s | APIs: %s | allOrNone: %s | Case: %s", request.path, api_key,
+        ','.join(api for _, api, _ in dispatched), all_or_none,
+        'ERROR' if failed else 'SUCCESS', 
+        extra=log_extra
+    )
+    return Response(encode_composite_response(entries), status=200, mimetype='application/json')
 
 # ====================================================
 # 9. POST: OAuth Token /services/oauth2/token 
@@ -680,60 +3659,581 @@ def handle_oauth_token():
     client_secret = request.form.get('client_secret')
     grant_type = request.form.get('grant_type')
 
-    # シミュレーション用クライアントID
-    SUCCESS_CLIENT_ID = 'stg'
-    
     app.logger.info(
-        f"REQ: POST {request.path} | grant_type: {grant_type} | client_id: {client_id}", 
+        "REQ: POST %s | grant_type: %s | client_id: %s", request.path, grant_type, client_id, 
         extra=log_extra
     )
 
     # 必須パラメータのチェック
     if not client_id or not client_secret or grant_type != 'client_credentials':
-        app.logger.error(f"REQ: POST {request.path} | ERROR: Missing required parameters or invalid grant_type.", extra=log_extra)
+        app.logger.error("REQ: POST %s | ERROR: Missing required parameters or invalid grant_type.", request.path, extra=log_extra)
         # 異常系レスポンス (HTTP 400)
-        return jsonify({
-            "error": "invalid_grant",
-            "error_description": "missing or invalid credentials"
-        }), 400
+        return cached_json_response(('oauth', 'token', 'invalid_request'), 400)
     
-    # 正常系/異常系のシミュレーション
-    if client_id == SUCCESS_CLIENT_ID:
+    # 正常系/異常系のシミュレーション (client_id ごとの結果はシナリオで定義)
+    outcome = oauth_client_outcome(client_id)
+    if outcome == 'success':
         # 正常系レスポンス (HTTP 200)
-        app.logger.info(f"RES: 200 OK | OAuth Token Success.", extra=log_extra)
-        now_ts = str(int(datetime.datetime.now().timestamp()))
-
-        response_body = {
-            "access_token": "00DGC0000058Kad!AQpPQcxZw45oZ0Co8P4j0kMApekIMfABJvu_y7zpvb1nxbv0P5vRM_lCsvph_FIM4neQTVQXv3TH3WvsMuk4CpWu6v8xbg",
-            "signature": "O+F5lk/JVr1igcveRHFEungRl9m3scP6dbYKwltuPL0=",
-            "scope": "api",
-            "instance_url": "https://dev-202407111759-dev-ed.develop.my.salesforce.com",
-            "id": "https://login.salesforce.com/id/00DGC0000058KAD2AE/005GC00000KhBwYYAU",
-            "token_type": "Bearer",
-            "issued_at": now_ts
-        }
-        return jsonify(response_body), 200
+        # 呼び出しごとに新しいアクセストークンを発行し、セッションとして登録する
+        access_token, issued_at = OAUTH_SESSIONS.issue(client_id)
+        METRICS.add_session_event('issued', client_id)
+        app.logger.info("RES: 200 OK | OAuth Token Success. Active sessions: %s", len(OAUTH_SESSIONS), extra=log_extra)
+
+        # access_token と issued_at を、エンコード済みのテンプレートに埋め込む
+        return spliced_json_response(('oauth', 'token', 'success'), access_token, str(issued_at))
         
     else:
-        # 異常系レスポンス (HTTP 400)
-        app.logger.error(f"RES: 400 Bad Request | Authentication Failure.", extra=log_extra)
+        # 異常系レスポンス (シナリオの応答)
+        status = OAUTH_RESPONSE_STATUS[outcome]
+        app.logger.error("RES: %s | Authentication Failure. Scenario: %s", status, outcome, extra=log_extra)
+        return cached_json_response(('oauth', 'token', outcome), status)
+
+
+# ====================================================
+# 10. GET: ジョブストア統計 /stub/jobstore (スタブ独自)
+# ====================================================
+@app.route(STUB_ADMIN_PATH + '/jobstore', methods=['GET'])
+def get_job_store_stats():
+    auth_check = check_auth_and_log()
+    if auth_check: return auth_check
+
+    stats = JOB_STORE.stats()
+    app.logger.info("REQ: GET %s | Size: %s | Evictions: %s", request.path, stats['size'], stats['evictions'], extra={'job_info': 'JOB_STORE'})
+    return jsonify(stats), 200
+
+
+# ====================================================
+# 11. POST/PATCH: sObject Collections /composite/sobjects (作成 / 更新 / 外部IDによるアップサート)
+# ====================================================
+@app.route(SOBJECT_COLLECTIONS_PATH, methods=['POST', 'PATCH'])
+@app.route(f'{SOBJECT_COLLECTIONS_PATH}/<sobject>/<external_id_field>', methods=['PATCH'])
+def handle_sobject_collections(sobject=None, external_id_field=None):
+    # 共通認証チェック (Content-Type: application/jsonを期待)
+    auth_check = check_auth_and_log(expected_content_type_prefix='application/json')
+    if auth_check:
+        return auth_check
+
+    operation = 'upsert' if external_id_field else ('create' if request.method == 'POST' else 'update')
+    log_extra = {'job_info': f'SObjects:{operation}'}
+
+    try:
+        req_json = request.get_json(force=True)
+    except:
+        app.logger.error("REQ: %s %s | ERROR: Invalid JSON format.", request.method, request.path, extra=log_extra)
+        return jsonify({"message": "Invalid JSON format."}), 400
+
+    # 必須: records配列
+    records = req_json.get('records') if isinstance(req_json, dict) else None
+    if not isinstance(records, list) or not records:
+        app.logger.error("REQ: %s %s | ERROR: Missing or invalid records array.", request.method, request.path, extra=log_extra)
+        return jsonify({"message": "Invalid sObject collection request structure.", "errorCode": "INVALID_REQUEST"}), 400
+
+    if len(records) > SOBJECT_COLLECTIONS_MAX_RECORDS:
+        app.logger.error("REQ: %s %s | ERROR: Too many records: %s", request.method, request.path, len(records), extra=log_extra)
+        return jsonify({
+            "message": f"record limit reached. cannot submit more than {SOBJECT_COLLECTIONS_MAX_RECORDS} records into this call",
+            "errorCode": "EXCEEDED_ID_LIMIT"
+        }), 400
+
+    # X-API-Key の取得と正常/異常の判定 (Composite のシナリオで 'success' 以外の結果はすべて異常系)
+    api_key = request.headers.get('X-API-Key', '')
+    is_success_key = composite_key_outcome(api_key) == 'success'
+    all_or_none = bool(req_json.get('allOrNone', False))
+
+    # レコードごとの結果は起動時にエンコード済みの断片を組み合わせる
+    entries, error_count = build_sobject_results(operation, records, sobject, external_id_field, is_success_key, all_or_none)
+
+    app.logger.info(
+        "REQ: %s %s | API Key: %s | Records: %s | Errors: %s | allOrNone: %s", request.method, request.path,
+        api_key, len(records), error_count, all_or_none,
+        extra=log_extra
+    )
+    return Response(b'[' + b','.join(entries) + b']\n', status=200, mimetype='application/json')
+
+
+# ====================================================
+# 12. GET: メトリクス /metrics (スタブ独自・Prometheus テキスト形式)
+# ====================================================
+@app.route(METRICS_PATH, methods=['GET'])
+def handle_metrics():
+    return Response(render_metrics(), status=200, content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+# ====================================================
+# 13. POST: クエリジョブ作成 /jobs/query
+# ====================================================
+@app.route(QUERY_BASE_PATH, methods=['POST'])
+def create_query_job():
+    auth_check = check_auth_and_log(expected_content_type_prefix='application/json')
+    if auth_check: return auth_check
+
+    log_extra = {'job_info': 'QUERY'}
+
+    try:
+        req_json = request.get_json(force=True)
+    except:
+        app.logger.error("REQ: POST %s | ERROR: Invalid JSON format.", request.path, extra=log_extra)
+        return jsonify({"message": "Invalid JSON format."}), 400
+
+    operation = req_json.get('operation', 'query')
+    try:
+        if operation not in ('query', 'queryAll'):
+            raise QueryJobError(f"Invalid operation: {operation}", "INVALIDJOB")
+        object_name, fields, limit = parse_soql_query(req_json.get('query'))
+        if object_name not in INTERFACE_MAPPING:
+            raise QueryJobError(f"sObject type '{object_name}' is not supported.", "INVALID_TYPE")
+        # スタブ独自拡張: 結果の件数指定 (SOQL の LIMIT が小さければそちらを優先)
+        result_rows = parse_result_rows_override(req_json.get('stubResultRows'))
+    except QueryJobError as e:
+        app.logger.error("REQ: POST %s | ERROR: %s", request.path, e, extra=log_extra)
+        return jsonify({"message": str(e), "errorCode": e.error_code}), 400
+    except ValueError as e:
+        app.logger.error("REQ: POST %s | ERROR: %s", request.path, e, extra=log_extra)
+        return jsonify({"message": str(e), "errorCode": "INVALIDJOB"}), 400
+
+    # 項目は結果CSV (成功) のファイルの列から選ぶ
+    fixture = FIXTURES.get("success", object_name)
+    template = fixture["template"] if fixture else None
+    if not template:
+        app.logger.error("CSV Data Missing: Could not load successful CSV template for object: %s", object_name, extra=log_extra)
+        return jsonify({"message": "CSV Data not found on server.", "errorCode": "INTERNAL_SERVER_ERROR"}), 500
+    positions = query_field_positions(template)
+    unknown = [field for field in fields if field.lower() not in positions]
+    if unknown:
+        app.logger.error("REQ: POST %s | ERROR: No such column %s on entity %s", request.path, unknown, object_name, extra=log_extra)
         return jsonify({
-            "error": "invalid_grant",
-            "error_description": "authentication failure"
+            "message": f"No such column '{unknown[0]}' on entity '{object_name}'.",
+            "errorCode": "INVALID_FIELD"
         }), 400
 
+    limit_check = check_active_job_limit(log_extra)
+    if limit_check: return limit_check
+
+    row_count = result_rows["success"] if result_rows else QUERY_DEFAULT_RESULT_ROWS
+    if limit is not None:
+        row_count = min(row_count, limit)
+
+    interface = INTERFACE_MAPPING[object_name]
+    new_job_id = generate_job_id(interface['id'])
+    now_utc = datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S.000+0000")
+
+    # クエリジョブはアップロードがないため、作成時点で UploadComplete とし InProgress / JobComplete への遷移時刻を決める
+    job_data = {
+        "id": new_job_id,
+        "job_type": "V2Query",
+        "object": object_name,
+        "interface_id": interface['id'],
+        "interface_name": interface['name'],
+        "operation": operation,
+        "query_fields": fields,
+        "query_rows": row_count,
+        "state": "UploadComplete",
+    }
+    job_data["state_schedule"] = build_state_schedule(job_data, time.time())
+    JOB_STORE.put(new_job_id, job_data)
+    JOB_SCHEDULER.schedule(new_job_id, job_data["state_schedule"])
+
+    app.logger.info(
+        "REQ: POST %s | Job ID: %s | Object: %s | Rows: %s | JSON Body: %s", request.path, new_job_id, object_name, row_count, truncate_for_log(req_json),
+        extra={'job_info': f"{interface['id']}:{interface['name']}"}
+    )
+
+    response_body = {
+        "id": new_job_id,
+        "operation": operation,
+        "object": object_name,
+        "createdById": "005GC00000KhouiYAA",
+        "createdDate": now_utc,
+        "systemModstamp": now_utc,
+        "state": "UploadComplete",
+        "concurrencyMode": "Parallel",
+        "contentType": "CSV",
+        "apiVersion": 62.0,
+        "lineEnding": "LF",
+        "columnDelimiter": "COMMA"
+    }
+    return jsonify(response_body), 200
+
+# ====================================================
+# 14. GET: クエリジョブ詳細情報取得 /jobs/query/{id}
+# ====================================================
+@app.route(QUERY_BASE_PATH + '/<jobId>', methods=['GET'])
+def get_query_job_details(jobId):
+    auth_check = check_auth_and_log()
+    if auth_check: return auth_check
+
+    job_data = get_job(jobId, 'V2Query')
+    if job_data is None:
+        app.logger.error("RES: 404 NOT FOUND | Job ID: %s ID not found.", jobId, extra={'job_info': 'NOT_FOUND'})
+        return jsonify({"message": "The requested resource does not exist", "errorCode": "NOT_FOUND"}), 404
+
+    log_extra = {'job_info': f"{job_data['interface_id']}:{job_data['interface_name']}"}
+    state = resolve_job_state(job_data)
+    if state != job_data['state']:
+        advance_job_state(jobId, state)
+    app.logger.info("REQ: GET %s | Job ID: %s | State Check | State: %s", request.path, jobId, state, extra=log_extra)
+
+    schedule = job_data["state_schedule"]
+    is_complete = state == 'JobComplete'
+    now_utc = datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S.000+0000")
+    response_body = {
+        "id": jobId,
+        "operation": job_data["operation"],
+        "object": job_data["object"],
+        "createdById": "005GC00000KhouiYAA",
+        "createdDate": "2024-11-14T09:39:09.000+0000",
+        "systemModstamp": now_utc,
+        "state": state,
+        "concurrencyMode": "Parallel",
+        "contentType": "CSV",
+        "apiVersion": 62.0,
+        "jobType": "V2Query",
+        "lineEnding": "LF",
+        "columnDelimiter": "COMMA",
+        "numberRecordsProcessed": job_data["query_rows"] if is_complete else 0,
+        "retries": 0,
+        "totalProcessingTime": int((schedule["JobComplete"] - schedule["InProgress"]) * 1000) if is_complete else 0,
+        "isPkChunkingSupported": False
+    }
+    return jsonify(response_body), 200
+
+# ====================================================
+# 15. GET: クエリ結果取得 /jobs/query/{id}/results (maxRecords / locator によるページ分割)
+# ====================================================
+@app.route(QUERY_BASE_PATH + '/<jobId>/results', methods=['GET'])
+def get_query_results(jobId):
+    auth_check = check_auth_and_log()
+    if auth_check: return auth_check
+
+    job_data = get_job(jobId, 'V2Query')
+    if job_data is None:
+        app.logger.error("RES: 404 NOT FOUND | Job ID: %s ID not found.", jobId, extra={'job_info': 'NOT_FOUND'})
+        return jsonify({"message": "The requested resource does not exist", "errorCode": "NOT_FOUND"}), 404
+
+    log_extra = {'job_info': f"{job_data['interface_id']}:{job_data['interface_name']}"}
+    app.logger.info("REQ: GET %s | Job ID: %s", request.path, jobId, extra=log_extra)
+
+    state = resolve_job_state(job_data)
+    if state != 'JobComplete':
+        app.logger.error("REQ: GET %s | ERROR: Job is not complete. State: %s", request.path, state, extra=log_extra)
+        return jsonify({"message": f"Job is not complete. State: {state}", "errorCode": "INVALIDJOBSTATE"}), 400
+
+    fixture = FIXTURES.get("success", job_data["object"])
+    template = fixture["template"] if fixture else None
+    if not template:
+        app.logger.error("CSV Data Missing: Could not load successful CSV template for object: %s", job_data["object"], extra=log_extra)
+        return jsonify({"message": "CSV Data not found on server.", "errorCode": "INTERNAL_SERVER_ERROR"}), 500
+
+    # 結果は行番号から直接生成するため、どのページも全件を保持せずにストリームで返す
+    try:
+        start_row, max_records = parse_result_page_params(request.args) or (0, None)
+        response = build_generated_page_response(
+            jobId, build_query_template(template, job_data["query_fields"]), job_data["query_rows"], start_row, max_records
+        )
+    except ResultPageError as e:
+        app.logger.error("REQ: GET %s | ERROR: %s", request.path, e, extra=log_extra)
+        return jsonify({"message": str(e), "errorCode": e.error_code}), 400
+    app.logger.debug(
+        "Returning %s query rows from row %s for Job ID: %s | Next locator: %s", response.headers["Sforce-NumberOfRecords"],
+        start_row, jobId, response.headers["Sforce-Locator"], extra=log_extra
+    )
+    return negotiate_result_encoding(response)
+
+
+# ====================================================
+# 16. GET: ジョブ一覧 /jobs/ingest (queryLocator によるページ分割)
+# ====================================================
+@app.route(BASE_PATH, methods=['GET'])
+def list_ingest_jobs():
+    auth_check = check_auth_and_log()
+    if auth_check: return auth_check
+
+    log_extra = {'job_info': 'LIST'}
+
+    # スタブ独自拡張: state / object / interfaceId での絞り込み (ジョブストアの副索引を使用)
+    filters = {"job_type": "V2Ingest"}
+    for param, field in (("state", "state"), ("object", "object"), ("interfaceId", "interface_id")):
+        if request.args.get(param):
+            filters[field] = request.args[param]
+
+    try:
+        is_pk_chunking = request.args.get('isPkChunkingEnabled', 'false').lower()
+        if is_pk_chunking not in ('true', 'false'):
+            raise ResultPageError(f"Invalid value for isPkChunkingEnabled: {request.args['isPkChunkingEnabled']}", "INVALIDJOB")
+        locator = request.args.get('queryLocator')
+        after = decode_result_locator(locator) if locator else 0
+    except ResultPageError as e:
+        app.logger.error("REQ: GET %s | ERROR: %s", request.path, e, extra=log_extra)
+        return jsonify({"message": str(e), "errorCode": e.error_code}), 400
+
+    # PKチャンク分割を使うジョブ / V2Ingest 以外の jobType (Classic / BigObjectIngest) のジョブは存在しない
+    if is_pk_chunking == 'true' or request.args.get('jobType', 'V2Ingest') != 'V2Ingest':
+        jobs, next_after = [], None
+    else:
+        jobs, next_after = JOB_STORE.list_jobs(filters, after, JOB_LIST_PAGE_SIZE)
+
+    app.logger.info(
+        "REQ: GET %s | Filters: %s | Records: %s | Done: %s", request.path, truncate_for_log(dict(request.args)), len(jobs), next_after is None,
+        extra=log_extra
+    )
+
+    records = [{
+        "id": job["id"],
+        "operation": job.get("operation", "upsert"),
+        "object": job["object"],
+        "createdById": "005GC00000KhouiYAA",
+        "createdDate": job.get("created_date", "2024-11-14T09:39:09.000+0000"),
+        "systemModstamp": job.get("created_date", "2024-11-14T09:39:09.000+0000"),
+        "state": resolve_job_state(job),
+        "concurrencyMode": "Parallel",
+        "contentType": "CSV",
+        "apiVersion": 62.0,
+        "jobType": "V2Ingest",
+        "lineEnding": "CRLF",
+        "columnDelimiter": "COMMA",
+    } for job in jobs]
+    response_body = {"done": next_after is None, "records": records, "nextRecordsUrl": None}
+    if next_after is not None:
+        args = [(key, value) for key, value in request.args.items(multi=True) if key != 'queryLocator']
+        args.append(('queryLocator', encode_result_locator(next_after)))
+        response_body["nextRecordsUrl"] = f"{BASE_PATH}?{urlencode(args)}"
+    return jsonify(response_body), 200
+
+
+# ====================================================
+# 17. GET: OAuth セッション統計 /stub/sessions (スタブ独自)
+# ====================================================
+@app.route(STUB_ADMIN_PATH + '/sessions', methods=['GET'])
+def get_session_stats():
+    auth_check = check_auth_and_log()
+    if auth_check: return auth_check
+
+    stats = session_stats()
+    app.logger.info("REQ: GET %s | Active sessions: %s", request.path, stats['activeSessions'], extra={'job_info': 'OAuth:Sessions'})
+    return jsonify(stats), 200
+
+
+# ====================================================
+# 18. POST/GET/DELETE: リクエスト処理のプロファイリング /stub/profile (スタブ独自)
+# ====================================================
+# POST: 開始 ({"sampleRate": N件に1件, "seconds": 期間, "routes": [ルート名]}。いずれも省略可)
+# GET: 実行中 (なければ直近) のセッションの集計 / DELETE: 停止して .pstats を書き出す
+# プロセスごとの処理のため、--workers で複数プロセスを起動している場合はリクエストを受けたプロセスのみが対象
+@app.route(STUB_ADMIN_PATH + '/profile', methods=['POST', 'GET', 'DELETE'])
+def control_profiling():
+    auth_check = check_auth_and_log(expected_content_type_prefix='application/json' if request.method == 'POST' else None)
+    if auth_check: return auth_check
+
+    log_extra = {'job_info': 'PROFILE'}
+    admin_token = request.headers.get('X-Stub-Admin-Token', '')
+    if not ADMIN_TOKEN or not hmac.compare_digest(admin_token.encode('utf-8'), ADMIN_TOKEN.encode('utf-8')):
+        app.logger.error("REQ: %s %s | ERROR: Invalid admin token.", request.method, request.path, extra=log_extra)
+        return jsonify({"message": "Admin token is missing or invalid.", "errorCode": "INSUFFICIENT_ACCESS"}), 403
+
+    if request.method == 'GET':
+        session = PROFILE_SESSION or PROFILE_LAST_SESSION
+        if session is None:
+            return jsonify({"message": "No profiling session.", "errorCode": "NOT_FOUND"}), 404
+        return jsonify(session.summary()), 200
+
+    if request.method == 'DELETE':
+        session = stop_profiling()
+        if session is None:
+            return jsonify({"message": "Profiling is not running.", "errorCode": "INVALIDJOBSTATE"}), 409
+        return jsonify(session.summary()), 200
+
+    try:
+        req_json = request.get_json(force=True) or {}
+        sample_rate = int(req_json.get('sampleRate', PROFILE_DEFAULT_SAMPLE_RATE))
+        seconds = float(req_json.get('seconds', PROFILE_DEFAULT_SECONDS))
+        endpoints = ([str(endpoint) for endpoint in req_json['routes']] if req_json.get('routes')
+                     else [endpoint for endpoint in app.view_functions if endpoint not in PROFILE_EXCLUDED_ENDPOINTS])
+    except Exception:
+        app.logger.error("REQ: POST %s | ERROR: Invalid JSON format.", request.path, extra=log_extra)
+        return jsonify({"message": "Invalid JSON format."}), 400
+    unknown = [endpoint for endpoint in endpoints if endpoint not in app.view_functions or endpoint in PROFILE_EXCLUDED_ENDPOINTS]
+    if sample_rate < 1 or not 0 < seconds <= PROFILE_MAX_SECONDS or unknown:
+        message = (f"Unknown routes: {', '.join(map(str, unknown))}" if unknown
+                   else f"sampleRate must be >= 1 and seconds must be in (0, {PROFILE_MAX_SECONDS}]")
+        app.logger.error("REQ: POST %s | ERROR: %s", request.path, message, extra=log_extra)
+        return jsonify({"message": message, "errorCode": "INVALID_FIELD"}), 400
+
+    session = start_profiling(sample_rate, seconds, endpoints)
+    if session is None:
+        return jsonify({"message": "Profiling is already running.", "errorCode": "INVALIDJOBSTATE"}), 409
+    return jsonify(session.summary()), 200
+
+
+# --- アプリケーションの初期化 ---
+# gunicorn などから起動する場合は create_app() をアプリケーションとして指定する
+# 例: STUB_JOB_STORE_BACKEND=sqlite gunicorn -w 4 -b 0.0.0.0:8888 'stub_api:create_app()'
+_app_initialized = False
+
+# ロギングとCSVのロード (プロセスの fork 前に一度だけ行う)
+def init_app():
+    global _app_initialized
+    if not _app_initialized:
+        setup_logging()
+        load_csv_data()
+        instrument_view_functions()
+        install_traffic_capture()
+        install_upload_spool()
+        _app_initialized = True
+
+# バックグラウンドスレッドの起動 (スレッドは fork 後に引き継がれないため、ワーカープロセスごとに行う)
+def start_background_tasks():
+    start_job_store_reaper()
+    start_fixture_watcher()
+    JOB_SCHEDULER.start()
+    start_upload_validator()
+    if CAPTURE is not None:
+        CAPTURE.start()
+
+def create_app():
+    if not _app_initialized:
+        init_app()
+        start_background_tasks()
+    return app
+
+# ASGIサーバー (uvicorn など) 用のアプリケーションファクトリ
+# 例: uvicorn --factory stub_api:create_asgi_app
+def create_asgi_app():
+    from asgiref.wsgi import WsgiToAsgi
+    return WsgiToAsgi(create_app())
+
+
+# --- サーバー実装 ---
+# スレッドプールでリクエストを処理するWSGIサーバー
+# リクエストごとにスレッドを生成せず、固定数のスレッドで接続を処理する
+# 応答は werkzeug の WSGIRequestHandler が送信するため、常に Connection: close で1接続1リクエストになる
+# (接続を再利用する keep-alive が必要な場合は --server asgi を使う)
+class PooledWSGIServer(BaseWSGIServer):
+    multithread = True
+    request_queue_size = 1024
+
+    def __init__(self, host, port, app, threads):
+        super().__init__(host, port, app)
+        self.threads = threads
+        self._executor = None
+
+    def serve_forever(self, poll_interval=0.5):
+        # スレッドプールは fork 後の各ワーカープロセスで作成する
+        self._executor = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix='stub-http')
+        try:
+            super().serve_forever(poll_interval)
+        finally:
+            self._executor.shutdown(wait=False)
+
+    def process_request(self, request, client_address):
+        self._executor.submit(self._process_request_thread, request, client_address)
+
+    def _process_request_thread(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+
+# 複数ワーカープロセスで同じリスニングソケットを共有する (pre-fork)
+def serve_prefork(server, workers):
+    children = []
+    for _ in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            start_background_tasks()
+            server.serve_forever()
+            os._exit(0)
+        children.append(pid)
+
+    def stop_children(signum, frame):
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        sys.exit(0)
+
+    signal.signal(signal.SIGTERM, stop_children)
+    signal.signal(signal.SIGINT, stop_children)
+    app.logger.info("Started %s worker processes: %s", workers, children, extra={'job_info': 'BOOT'})
+    for pid in children:
+        os.waitpid(pid, 0)
+
+
+def run_threaded_server(host, port, threads, workers):
+    init_app()
+    server = PooledWSGIServer(host, port, app, threads)
+    if workers > 1:
+        serve_prefork(server, workers)
+    else:
+        start_background_tasks()
+        server.serve_forever()
+
+
+def run_asgi_server(host, port, threads, workers):
+    try:
+        import uvicorn
+        import asgiref  # noqa: F401
+    except ImportError:
+        app.logger.error("ASGI mode requires uvicorn and asgiref: pip install uvicorn asgiref", extra={'job_info': 'BOOT'})
+        sys.exit(1)
+    # WSGIアプリを実行するスレッド数 (asgiref のスレッドプール)
+    os.environ.setdefault('ASGI_THREADS', str(threads))
+    uvicorn.run('stub_api:create_asgi_app', factory=True, host=host, port=port, workers=workers, log_level='warning')
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description='Salesforce API stub server')
+    # 従来どおり第1引数でポート番号を指定できる (数字以外は無視)
+    parser.add_argument('port_arg', nargs='?', default=None, help='port number (default: 8888)')
+    parser.add_argument('--port', type=int, default=None, help='port number (same as positional port)')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--server', choices=['threaded', 'asgi', 'dev'], default='threaded',
+                        help='threaded: thread-pool WSGI server / asgi: uvicorn (asyncio) / dev: Flask development server')
+    parser.add_argument('--threads', type=int, default=32, help='request handler threads per worker process')
+    parser.add_argument('--workers', type=int, default=1, help='number of worker processes')
+    parser.add_argument('--capture', nargs='?', const=CAPTURE_DEFAULT_FILE, default=None, metavar='FILE',
+                        help=f'append every request to FILE as JSONL for bench/replay.py (default: {CAPTURE_DEFAULT_FILE})')
+    args = parser.parse_args(argv)
+
+    args.port = args.port or (int(args.port_arg) if args.port_arg and args.port_arg.isdigit() else 8888)
+    return args
+
 
 # --- サーバー起動ロジック ---
 if __name__ == '__main__':
     # 起動ポートをコマンドライン引数から取得、ない場合はデフォルト8888
-    port = 8888
-    if len(sys.argv) > 1 and sys.argv[1].isdigit():
-        port = int(sys.argv[1])
-        
-    setup_logging()
-    load_csv_data()
+    args = parse_args(sys.argv[1:])
+    port = args.port
+
+    # 複数ワーカーではジョブ情報をプロセス間で共有する必要がある
+    if args.workers > 1 and isinstance(JOB_STORE, MemoryJobStore):
+        JOB_STORE_BACKEND = 'sqlite'
+        os.environ['STUB_JOB_STORE_BACKEND'] = 'sqlite'
+        JOB_STORE = create_job_store()
+
+    # uvicorn のワーカーはモジュールを読み込み直すため、環境変数でも引き継ぐ
+    if args.capture:
+        CAPTURE_FILE = args.capture
+        os.environ['STUB_CAPTURE_FILE'] = args.capture
+
+    init_app()
     
-    app.logger.info(f"Flask API Stub starting on port {port}. Default port is 8888.", extra={'job_info': 'BOOT'})
+    app.logger.info(
+        "Flask API Stub starting on port %s. Default port is 8888. Server: %s | Workers: %s | Threads: %s | Job Store: %s",
+        port, args.server, args.workers, args.threads, JOB_STORE_BACKEND,
+        extra={'job_info': 'BOOT'}
+    )
     
-    # Flaskサーバーの起動: debug=False で安定起動
-    app.run(host='0.0.0.0', debug=False, port=port)
+    if args.server == 'asgi':
+        run_asgi_server(args.host, port, args.threads, args.workers)
+    elif args.server == 'dev':
+        # Flaskサーバーの起動: debug=False で安定起動
+        start_background_tasks()
+        app.run(host=args.host, debug=False, port=port)
+    else:
+        run_threaded_server(args.host, port, args.threads, args.workers)
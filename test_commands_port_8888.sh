@@ -58,7 +58,8 @@ curl -X PATCH "${BASE_URL}/{YOUR_JOB_ID}" \
 # ----------------------------------------------------
 # 4. GET: ジョブ詳細情報取得 (ポーリングシミュレーション)
 # ----------------------------------------------------
-# 【要編集】 {YOUR_JOB_ID} をステップ1で取得したIDに置き換え、3回実行して JobComplete になるか確認
+# 【要編集】 {YOUR_JOB_ID} をステップ1で取得したIDに置き換えてください
+# 状態は PATCH からの経過時間で進みます (既定: 約1秒後に InProgress、さらに数秒後に JobComplete)
 echo "\n--- 4. GET: Job Details (Polling attempts 1/3, State: InProgress) ---"
 curl -X GET "${BASE_URL}/{YOUR_JOB_ID}" \
     -H "Accept: application/json" \
@@ -71,6 +72,7 @@ curl -X GET "${BASE_URL}/{YOUR_JOB_ID}" \
     -H "Authorization: ${AUTH_TOKEN}" \
     -H "X-API-Key: ${API_KEY}"
 
+sleep 5
 echo "\n--- 4. GET: Job Details (Polling attempts 3/3, State: JobComplete) ---"
 curl -X GET "${BASE_URL}/{YOUR_JOB_ID}" \
     -H "Accept: application/json" \